@@ -2,13 +2,37 @@
 Admin configuration for accounts app
 """
 from django.contrib import admin
-from .models import Node
+from .models import Node, NodeStatusChange, NodeDailyUptime, DeviceToken
 
 
 @admin.register(Node)
 class NodeAdmin(admin.ModelAdmin):
-    list_display = ['node_name', 'esp32_device_id', 'lora_node_id', 'status', 'last_seen', 'user']
-    list_filter = ['status', 'created_at']
+    list_display = ['node_name', 'esp32_device_id', 'lora_node_id', 'status', 'is_gateway', 'last_seen', 'user']
+    list_filter = ['status', 'is_gateway', 'created_at']
     search_fields = ['node_name', 'esp32_device_id', 'lora_node_id']
-    readonly_fields = ['created_at', 'updated_at']
+    # message_shard only changes together with the messages, through rebalance_shards
+    readonly_fields = ['message_shard', 'created_at', 'updated_at']
+    autocomplete_fields = ['relay_gateway']
 
+
+@admin.register(NodeStatusChange)
+class NodeStatusChangeAdmin(admin.ModelAdmin):
+    list_display = ['node', 'status', 'changed_at']
+    list_filter = ['status']
+    search_fields = ['node__node_name', 'node__esp32_device_id']
+    date_hierarchy = 'changed_at'
+
+
+@admin.register(NodeDailyUptime)
+class NodeDailyUptimeAdmin(admin.ModelAdmin):
+    list_display = ['node', 'day', 'online_seconds', 'transitions']
+    search_fields = ['node__node_name', 'node__esp32_device_id']
+    date_hierarchy = 'day'
+
+
+@admin.register(DeviceToken)
+class DeviceTokenAdmin(admin.ModelAdmin):
+    list_display = ['prefix', 'node', 'created_at', 'revoked_at']
+    list_filter = ['revoked_at']
+    search_fields = ['prefix', 'node__node_name', 'node__esp32_device_id']
+    readonly_fields = ['prefix', 'digest', 'created_at']
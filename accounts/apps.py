@@ -0,0 +1,13 @@
+"""
+App configuration for accounts app
+"""
+from django.apps import AppConfig
+
+
+class AccountsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'accounts'
+
+    def ready(self):
+        # Connect the device token cache invalidation and presence store signals
+        from . import presence, tokens  # noqa: F401
@@ -0,0 +1,88 @@
+"""
+Node directory search with keyset pagination.
+
+Prefix matches are expressed as ranges on lower-cased columns so they use the
+expression indexes on Node (``node_name_lower_idx``, ``node_device_id_lower_idx``)
+instead of scanning. Pages continue after the last node returned (keyset), so
+fetching any page costs the same no matter how large the fleet is. The cursor
+carries that node's sort key (lower-cased name, id) itself, so paging goes on
+even if the node is deleted in between.
+"""
+import base64
+import binascii
+import json
+
+from django.db.models import Count, Q
+from django.db.models.functions import Lower
+
+from .models import Node
+from .presence import status_counts
+
+MAX_PAGE_SIZE = 100
+# Upper bound for a prefix range: every string starting with the prefix sorts below prefix + this
+_PREFIX_END = '\U0010ffff'
+
+
+def _prefix_range(field, prefix):
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + _PREFIX_END})
+
+
+def encode_cursor(lname, pk):
+    """Opaque page cursor for the sort key (lower-cased name, id) of the last node shown."""
+    return base64.urlsafe_b64encode(json.dumps([lname, pk]).encode()).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(lname, pk) from a cursor made by encode_cursor(). Raises ValueError if it is malformed."""
+    try:
+        lname, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError('invalid cursor')
+    if not isinstance(lname, str) or not isinstance(pk, int) or isinstance(pk, bool):
+        raise ValueError('invalid cursor')
+    return lname, pk
+
+
+def search_nodes(query='', after=None, limit=25, exclude_pk=None):
+    """
+    Return (nodes, next_cursor) for nodes whose name or ESP32 ID starts with
+    ``query`` (case-insensitive), ordered by name. ``after`` is the cursor
+    returned by the previous page; ``next_cursor`` is None on the last page.
+    Raises ValueError for a malformed cursor.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    query = query.strip().lower()
+
+    nodes = Node.objects.annotate(
+        lname=Lower('node_name'), ldevice=Lower('esp32_device_id')
+    ).order_by('lname', 'id')
+
+    if query:
+        nodes = nodes.filter(_prefix_range('lname', query) | _prefix_range('ldevice', query))
+    if exclude_pk is not None:
+        nodes = nodes.exclude(pk=exclude_pk)
+    if after:
+        lname, pk = decode_cursor(after)
+        nodes = nodes.filter(Q(lname__gt=lname) | Q(lname=lname, id__gt=pk))
+
+    page = list(nodes.only(
+        'id', 'node_name', 'esp32_device_id', 'lora_node_id', 'status', 'last_seen'
+    )[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1].lname, page[limit - 1].pk) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def node_status_counts():
+    """
+    Return (total, online, offline) node counts: from the presence store's
+    counters when it is enabled, else in a single query.
+    """
+    counts = status_counts()
+    if counts is not None:
+        return counts
+    counts = Node.objects.aggregate(
+        total=Count('id'),
+        online=Count('id', filter=Q(status='ONLINE')),
+        offline=Count('id', filter=Q(status='OFFLINE')),
+    )
+    return counts['total'], counts['online'], counts['offline']
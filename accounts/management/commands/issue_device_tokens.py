@@ -0,0 +1,58 @@
+"""
+Django management command to issue, rotate or revoke device API tokens in bulk.
+Usage:
+    python manage.py issue_device_tokens --device ESP32-001 --device ESP32-002
+    python manage.py issue_device_tokens --all --output tokens.csv
+    python manage.py issue_device_tokens --all --revoke
+
+Issuing a token revokes the node's previous tokens (rotation) unless --keep-existing
+is given. Plain tokens are printed (or written to --output) once and never stored.
+"""
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import Node
+from accounts.tokens import issue_tokens, revoke_tokens
+
+
+class Command(BaseCommand):
+    help = 'Issues, rotates or revokes API tokens for ESP32 devices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--device', action='append', default=[], help='ESP32 device ID (repeatable)')
+        parser.add_argument('--all', action='store_true', help='Apply to every node')
+        parser.add_argument('--revoke', action='store_true', help='Revoke tokens instead of issuing new ones')
+        parser.add_argument('--keep-existing', action='store_true', help='Do not revoke existing tokens when issuing')
+        parser.add_argument('--output', help='Write device_id,token rows to this CSV file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            nodes = Node.objects.all()
+        elif options['device']:
+            nodes = Node.objects.filter(esp32_device_id__in=options['device'])
+        else:
+            raise CommandError('Pass --device ESP32-ID (repeatable) or --all.')
+
+        nodes = list(nodes.order_by('esp32_device_id'))
+        if not nodes:
+            raise CommandError('No matching nodes found.')
+
+        if options['revoke']:
+            count = revoke_tokens(nodes)
+            self.stdout.write(self.style.SUCCESS(f'Revoked {count} tokens for {len(nodes)} nodes.'))
+            return
+
+        issued = issue_tokens(nodes, rotate=not options['keep_existing'])
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as handle:
+                writer = csv.writer(handle)
+                writer.writerow(['esp32_device_id', 'token'])
+                for node, token in issued:
+                    writer.writerow([node.esp32_device_id, token])
+            self.stdout.write(self.style.SUCCESS(f'Issued {len(issued)} tokens to {options["output"]}.'))
+        else:
+            for node, token in issued:
+                self.stdout.write(f'{node.esp32_device_id}: {token}')
+            self.stdout.write(self.style.SUCCESS(f'Issued {len(issued)} tokens.'))
@@ -0,0 +1,53 @@
+"""
+Django management command to precompute per-day node uptime summaries.
+Usage: python manage.py rollup_uptime [--rebuild-days N]
+
+Run it once a day (e.g. from cron shortly after midnight UTC). Only completed
+days after the last summarized day are processed unless --rebuild-days is given.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Min
+from django.utils import timezone
+
+from accounts.models import Node, NodeStatusChange
+from accounts.uptime import rollup_day, summarized_until
+
+
+class Command(BaseCommand):
+    help = 'Builds NodeDailyUptime summaries for completed days'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild-days',
+            type=int,
+            default=0,
+            help='Recompute the last N completed days even if they are already summarized',
+        )
+
+    def handle(self, *args, **options):
+        today = timezone.now().date()
+
+        if options['rebuild_days']:
+            first_day = today - timedelta(days=options['rebuild_days'])
+        else:
+            first_day = summarized_until()
+            if first_day is None:
+                earliest = [
+                    NodeStatusChange.objects.aggregate(first=Min('changed_at'))['first'],
+                    Node.objects.aggregate(first=Min('created_at'))['first'],
+                ]
+                earliest = [value for value in earliest if value]
+                if not earliest:
+                    self.stdout.write('No nodes yet. Nothing to roll up.')
+                    return
+                first_day = min(earliest).date()
+
+        day = first_day
+        while day < today:
+            written = rollup_day(day)
+            self.stdout.write(f'{day}: {written} node summaries')
+            day += timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS('Uptime rollup complete.'))
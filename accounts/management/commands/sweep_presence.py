@@ -0,0 +1,52 @@
+"""
+Django management command to sweep the presence store.
+Usage: python manage.py sweep_presence [--offline-after SECONDS] [--loop] [--interval SECONDS] [--resync]
+
+Marks nodes OFFLINE whose last heartbeat is older than --offline-after seconds
+(default PRESENCE['OFFLINE_AFTER']) and writes last_seen values from the
+presence store to the Node table. Run it every minute from cron, or keep it
+running with --loop.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.presence import get_store, reconcile, sweep, sync_from_db
+
+
+class Command(BaseCommand):
+    help = 'Marks silent nodes OFFLINE and reconciles last_seen from the presence store'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--offline-after',
+            type=int,
+            default=None,
+            help='Seconds without a heartbeat before a node is marked OFFLINE',
+        )
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping until interrupted')
+        parser.add_argument('--interval', type=float, default=30, help='Seconds between sweeps with --loop')
+        parser.add_argument(
+            '--resync',
+            action='store_true',
+            help='First reload every node from the Node table (after bulk imports or restoring a backup)',
+        )
+
+    def handle(self, *args, **options):
+        store = get_store()
+        if store is None:
+            self.stdout.write('PRESENCE["BACKEND"] is None: sweeping from the Node table.')
+        elif options['resync']:
+            sync_from_db()
+
+        try:
+            while True:
+                marked = sweep(options['offline_after'])
+                reconciled = reconcile()
+                self.stdout.write(f'{len(marked)} nodes marked OFFLINE, {reconciled} last_seen values reconciled')
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS('Presence sweep complete.'))
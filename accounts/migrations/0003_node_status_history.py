@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_node_contact_email_node_contact_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeDailyUptime',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(help_text='UTC day covered by this summary')),
+                ('online_seconds', models.PositiveIntegerField(default=0, help_text='Seconds spent ONLINE during the day')),
+                ('transitions', models.PositiveIntegerField(default=0, help_text='Number of status changes during the day')),
+                ('node', models.ForeignKey(help_text='The node this summary belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='daily_uptime', to='accounts.node')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['day'], name='accounts_no_day_a1907c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('node', 'day'), name='unique_node_day_uptime')],
+            },
+        ),
+        migrations.CreateModel(
+            name='NodeStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('ONLINE', 'Online'), ('OFFLINE', 'Offline')], help_text='Status the node moved into', max_length=10)),
+                ('changed_at', models.DateTimeField(help_text='When the transition was observed')),
+                ('node', models.ForeignKey(help_text='The node whose status changed', on_delete=django.db.models.deletion.CASCADE, related_name='status_changes', to='accounts.node')),
+            ],
+            options={
+                'ordering': ['-changed_at'],
+                'indexes': [models.Index(fields=['node', 'changed_at'], name='accounts_no_node_id_659ea1_idx'), models.Index(fields=['changed_at'], name='accounts_no_changed_5e4091_idx')],
+            },
+        ),
+    ]
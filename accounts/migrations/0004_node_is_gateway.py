@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_node_status_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='is_gateway',
+            field=models.BooleanField(default=False, help_text='Whether this node relays queued messages over LoRa for other nodes'),
+        ),
+    ]
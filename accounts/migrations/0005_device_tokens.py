@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_node_is_gateway'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(help_text='Public part of the token used to look it up', max_length=16, unique=True)),
+                ('digest', models.CharField(help_text='HMAC-SHA256 hex digest of the secret part of the token', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('revoked_at', models.DateTimeField(blank=True, help_text='When this token was revoked (empty = active)', null=True)),
+                ('node', models.ForeignKey(help_text='The node this token authenticates', on_delete=django.db.models.deletion.CASCADE, related_name='api_tokens', to='accounts.node')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
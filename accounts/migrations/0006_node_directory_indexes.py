@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:22
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_device_tokens'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(django.db.models.functions.text.Lower('node_name'), models.F('id'), name='node_name_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(django.db.models.functions.text.Lower('esp32_device_id'), name='node_device_id_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['status', 'node_name'], name='node_status_name_idx'),
+        ),
+    ]
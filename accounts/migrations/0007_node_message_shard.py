@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_node_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='message_shard',
+            field=models.CharField(blank=True, help_text="Database alias this node's received messages are pinned to by rebalance_shards (empty = placed by hash, see communication/sharding.py)", max_length=100),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_node_message_shard'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='relay_gateway',
+            field=models.ForeignKey(blank=True, db_index=False, help_text='Gateway whose device token may send messages and status updates for this node', limit_choices_to={'is_gateway': True}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='relayed_nodes', to='accounts.node'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(condition=models.Q(('relay_gateway__isnull', False)), fields=['relay_gateway'], name='node_relay_gateway_idx'),
+        ),
+    ]
@@ -2,6 +2,8 @@
 Models for accounts app - Node/User profiles
 """
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 
@@ -46,6 +48,28 @@ class Node(models.Model):
         blank=True,
         help_text="Last time this node updated its status"
     )
+    is_gateway = models.BooleanField(
+        default=False,
+        help_text="Whether this node relays queued messages over LoRa for other nodes"
+    )
+    relay_gateway = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='relayed_nodes',
+        limit_choices_to={'is_gateway': True},
+        # Indexed in Meta only where set: SQLite picks a full index over mostly
+        # NULLs to list every node, and that is slower than scanning the table
+        db_index=False,
+        help_text="Gateway whose device token may send messages and status updates for this node"
+    )
+    message_shard = models.CharField(
+        max_length=100,
+        blank=True,
+        help_text="Database alias this node's received messages are pinned to by rebalance_shards "
+                  "(empty = placed by hash, see communication/sharding.py)"
+    )
     description = models.TextField(
         blank=True,
         help_text="Optional description or location information"
@@ -69,6 +93,15 @@ class Node(models.Model):
 
     class Meta:
         ordering = ['node_name']
+        indexes = [
+            # Case-insensitive prefix search and keyset paging for the node directory
+            models.Index(Lower('node_name'), F('id'), name='node_name_lower_idx'),
+            models.Index(Lower('esp32_device_id'), name='node_device_id_lower_idx'),
+            models.Index(fields=['status', 'node_name'], name='node_status_name_idx'),
+            models.Index(
+                fields=['relay_gateway'], name='node_relay_gateway_idx', condition=models.Q(relay_gateway__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.node_name} ({self.esp32_device_id})"
@@ -79,3 +112,104 @@ class Node(models.Model):
             raise ValidationError({'esp32_device_id': 'This ESP32 device ID is already registered.'})
 
 
+class NodeStatusChange(models.Model):
+    """
+    Append-only log of node status transitions.
+    A row is written only when the status actually changes, not on every heartbeat.
+    """
+    node = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='status_changes',
+        help_text="The node whose status changed"
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=Node.STATUS_CHOICES,
+        help_text="Status the node moved into"
+    )
+    changed_at = models.DateTimeField(
+        help_text="When the transition was observed"
+    )
+
+    class Meta:
+        ordering = ['-changed_at']
+        indexes = [
+            models.Index(fields=['node', 'changed_at']),
+            models.Index(fields=['changed_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.node.node_name} -> {self.status} ({self.changed_at})"
+
+
+class NodeDailyUptime(models.Model):
+    """
+    Precomputed per-day uptime summary for a node.
+    Built by the rollup_uptime command so long availability windows never rescan transitions.
+    """
+    node = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='daily_uptime',
+        help_text="The node this summary belongs to"
+    )
+    day = models.DateField(
+        help_text="UTC day covered by this summary"
+    )
+    online_seconds = models.PositiveIntegerField(
+        default=0,
+        help_text="Seconds spent ONLINE during the day"
+    )
+    transitions = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of status changes during the day"
+    )
+
+    class Meta:
+        ordering = ['-day']
+        constraints = [
+            models.UniqueConstraint(fields=['node', 'day'], name='unique_node_day_uptime'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    def __str__(self):
+        return f"{self.node.node_name} {self.day}: {self.online_seconds}s online"
+
+
+class DeviceToken(models.Model):
+    """
+    API key for an ESP32 device.
+    Only an HMAC-SHA256 digest of the secret is stored; the prefix identifies
+    the token so verification never needs to scan or hash more than once.
+    """
+    node = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='api_tokens',
+        help_text="The node this token authenticates"
+    )
+    prefix = models.CharField(
+        max_length=16,
+        unique=True,
+        help_text="Public part of the token used to look it up"
+    )
+    digest = models.CharField(
+        max_length=64,
+        help_text="HMAC-SHA256 hex digest of the secret part of the token"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    revoked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When this token was revoked (empty = active)"
+    )
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        state = 'revoked' if self.revoked_at else 'active'
+        return f"{self.prefix}... for {self.node.node_name} ({state})"
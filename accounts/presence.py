@@ -0,0 +1,563 @@
+"""
+Shared presence store: current status and last_seen of every node, readable
+by all worker processes in O(1).
+
+Heartbeats that repeat a node's status only update the store. Status
+transitions are still written to the database immediately, together with
+their NodeStatusChange row, so the Node table's status is always current.
+last_seen is copied to the database in bulk by ``reconcile()``, which also
+repairs statuses the database disagrees on, and ``sweep()`` marks nodes
+OFFLINE in the store and the database together once their last heartbeat is
+older than PRESENCE['OFFLINE_AFTER'] seconds. Both run from
+``manage.py sweep_presence``.
+
+Backends (settings.PRESENCE['BACKEND']):
+
+- ``'mmap'`` (default): a file-backed shared memory map next to the SQLite
+  database. Node ``id`` indexes a 16-byte slot, so a read is one struct
+  unpack. Writers take a per-slot file lock; readers use the slot's sequence
+  counter to retry instead of locking, and only fall back to the lock (and
+  repair the counter) if a writer died halfway through. Counts of
+  online/offline nodes are kept in the header.
+- ``'cache'``: a Django cache alias, e.g. a memcached or Redis server shared
+  by several hosts.
+- ``None``: no store; everything reads and writes the Node table as before.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Node, NodeStatusChange
+
+try:
+    import fcntl
+except ImportError:  # Windows: no inter-process locking, fine for a single process
+    fcntl = None
+
+DEFAULT_CONFIG = {
+    'BACKEND': 'mmap',
+    # None: "<database file>.presence", or a private temporary file for in-memory databases
+    'PATH': None,
+    'CACHE_ALIAS': 'default',
+    'OFFLINE_AFTER': 300,
+}
+
+UNKNOWN, ONLINE, OFFLINE = 0, 1, 2
+# Lock-free read attempts before a reader takes the slot lock
+READ_RETRIES = 1000
+_CODES = {'ONLINE': ONLINE, 'OFFLINE': OFFLINE}
+_NAMES = {ONLINE: 'ONLINE', OFFLINE: 'OFFLINE'}
+
+
+def presence_setting(key):
+    return getattr(settings, 'PRESENCE', {}).get(key, DEFAULT_CONFIG[key])
+
+
+def _to_datetime(seconds):
+    return datetime.fromtimestamp(seconds, tz=dt_timezone.utc) if seconds else None
+
+
+class MmapPresenceStore:
+    """
+    Presence slots in a memory-mapped file shared by every process on the host.
+
+    Layout: a 64-byte header (magic, loaded flag, online count, offline count,
+    reconcile watermark) followed by one ``<seq u32, status u8, last_seen f64>``
+    slot per node id. The file grows as node ids grow.
+    """
+
+    MAGIC = b'PRS1'
+    HEADER = struct.Struct('<4sIqqd')
+    HEADER_SIZE = 64
+    SLOT = struct.Struct('<IB3xd')
+    SEQ = struct.Struct('<I')
+    COUNTS = struct.Struct('<qq')
+    WATERMARK = struct.Struct('<d')
+
+    def __init__(self, path=None):
+        if path is None:
+            # Private to this process (in-memory databases): unlinked right away
+            self.fd, path = tempfile.mkstemp(suffix='.presence')
+            os.unlink(path)
+        else:
+            self.fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+        self.path = str(path)
+        self.local = threading.Lock()
+        with self._locked(0, self.HEADER_SIZE):
+            if os.fstat(self.fd).st_size < self.HEADER_SIZE:
+                os.ftruncate(self.fd, self.HEADER_SIZE + 1024 * self.SLOT.size)
+                os.pwrite(self.fd, self.HEADER.pack(self.MAGIC, 0, 0, 0, 0.0), 0)
+            self._remap()
+
+    # -- locking and mapping
+
+    @contextmanager
+    def _locked(self, start, length):
+        # fcntl locks are per process, so threads of one process also share a mutex
+        with self.local:
+            if fcntl is not None:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self.fd, fcntl.LOCK_UN, length, start)
+
+    def _remap(self):
+        self.map = mmap.mmap(self.fd, os.fstat(self.fd).st_size)
+
+    def _offset(self, node_id):
+        return self.HEADER_SIZE + node_id * self.SLOT.size
+
+    def _mapped(self, node_id):
+        """The map, remapped if another process grew the file past ``node_id``."""
+        end = self._offset(node_id) + self.SLOT.size
+        if end > len(self.map) and os.fstat(self.fd).st_size >= end:
+            self._remap()
+        return self.map if end <= len(self.map) else None
+
+    def _grow(self, node_id):
+        end = self._offset(node_id) + self.SLOT.size
+        with self._locked(0, self.HEADER_SIZE):
+            size = os.fstat(self.fd).st_size
+            if size < end:
+                os.ftruncate(self.fd, max(end, self.HEADER_SIZE + 2 * (size - self.HEADER_SIZE)))
+            self._remap()
+
+    # -- slots
+
+    def _read(self, node_id):
+        mapped = self._mapped(node_id)
+        if mapped is None:
+            return UNKNOWN, 0.0
+        offset = self._offset(node_id)
+        for _ in range(READ_RETRIES):
+            seq, status, last_seen = self.SLOT.unpack_from(mapped, offset)
+            # Odd sequence: a write is in progress; changed: the read was torn
+            if not seq & 1 and self.SEQ.unpack_from(mapped, offset)[0] == seq:
+                return status, last_seen
+        # Still odd: the writer may have died between its two bumps. No writer
+        # holds the lock once we have it, so an odd sequence is left over.
+        with self._locked(offset, self.SLOT.size):
+            seq, status, last_seen = self.SLOT.unpack_from(self.map, offset)
+            if seq & 1:
+                self.SEQ.pack_into(self.map, offset, seq + 1)
+        return status, last_seen
+
+    def _write(self, node_id, update):
+        """
+        Apply ``update(status, last_seen) -> (status, last_seen) or None`` to a
+        slot under its lock. Returns the previous (status, last_seen).
+        """
+        if self._mapped(node_id) is None:
+            self._grow(node_id)
+        offset = self._offset(node_id)
+        with self._locked(offset, self.SLOT.size):
+            mapped = self.map
+            seq, status, last_seen = self.SLOT.unpack_from(mapped, offset)
+            # Even again if a writer died halfway through
+            seq += seq & 1
+            new = update(status, last_seen)
+            if new is not None:
+                self.SEQ.pack_into(mapped, offset, seq + 1)
+                self.SLOT.pack_into(mapped, offset, seq + 1, *new)
+                self.SEQ.pack_into(mapped, offset, seq + 2)
+        if new is not None and new[0] != status:
+            self._count(status, new[0])
+        return status, last_seen
+
+    def _count(self, old, new):
+        with self._locked(0, self.HEADER_SIZE):
+            online, offline = self.COUNTS.unpack_from(self.map, 8)
+            online += (new == ONLINE) - (old == ONLINE)
+            offline += (new == OFFLINE) - (old == OFFLINE)
+            self.COUNTS.pack_into(self.map, 8, online, offline)
+
+    def slots(self):
+        """Yield (node_id, status code, last_seen seconds) for every known node."""
+        size = os.fstat(self.fd).st_size
+        if size > len(self.map):
+            self._remap()
+        data = self.map[self.HEADER_SIZE:]
+        for node_id, (_, status, last_seen) in enumerate(self.SLOT.iter_unpack(data[:len(data) - len(data) % self.SLOT.size])):
+            if status:
+                yield node_id, status, last_seen
+
+    # -- public API shared with CachePresenceStore
+
+    def touch(self, node_id, status, when):
+        """Record a heartbeat. Returns the previous status, or None if the node was unknown."""
+        previous, _ = self._write(node_id, lambda old, seen: (_CODES[status], max(seen, when.timestamp())))
+        return _NAMES.get(previous)
+
+    def set_status(self, node_id, status, only_if_seen_before=None):
+        """
+        Set a node's status, keeping last_seen. With ``only_if_seen_before``
+        (a datetime) the change only happens if the node was last seen before
+        it. Returns True if the status changed.
+        """
+        code = _CODES[status]
+        cutoff = only_if_seen_before.timestamp() if only_if_seen_before else None
+
+        def update(old, seen):
+            if old == code or (cutoff is not None and seen >= cutoff):
+                return None
+            return code, seen
+        previous, seen = self._write(node_id, update)
+        return previous != code and (cutoff is None or seen < cutoff)
+
+    def forget(self, node_id):
+        if self._mapped(node_id) is not None:
+            self._write(node_id, lambda old, seen: (UNKNOWN, 0.0) if old else None)
+
+    def get(self, node_id):
+        """(status, last_seen) for a node, or None if the store does not know it."""
+        status, last_seen = self._read(node_id)
+        return (_NAMES[status], _to_datetime(last_seen)) if status else None
+
+    def get_many(self, node_ids):
+        return {node_id: entry for node_id in node_ids if (entry := self.get(node_id))}
+
+    def counts(self):
+        """(online, offline)."""
+        return self.COUNTS.unpack_from(self.map, 8)
+
+    def items(self):
+        for node_id, status, last_seen in self.slots():
+            yield node_id, _NAMES[status], _to_datetime(last_seen)
+
+    def is_loaded(self):
+        return self.HEADER.unpack_from(self.map, 0)[1] == 1
+
+    def load(self, rows):
+        """Fill the store from (node_id, status, last_seen) rows and recount."""
+        for node_id, status, last_seen in rows:
+            seen = last_seen.timestamp() if last_seen else 0.0
+            self._write(node_id, lambda old, old_seen: (_CODES[status], max(old_seen, seen)))
+        self.recount()
+        with self._locked(0, self.HEADER_SIZE):
+            struct.pack_into('<I', self.map, 4, 1)
+
+    def recount(self):
+        """Recompute the header counts from the slots (fixes drift after crashes)."""
+        online = offline = 0
+        for _, status, _ in self.slots():
+            online += status == ONLINE
+            offline += status == OFFLINE
+        with self._locked(0, self.HEADER_SIZE):
+            self.COUNTS.pack_into(self.map, 8, online, offline)
+
+    def reconciled_until(self):
+        return _to_datetime(self.WATERMARK.unpack_from(self.map, 24)[0])
+
+    def set_reconciled_until(self, when):
+        with self._locked(0, self.HEADER_SIZE):
+            self.WATERMARK.pack_into(self.map, 24, when.timestamp())
+
+
+class CachePresenceStore:
+    """
+    Presence in a Django cache shared by all processes and hosts, as
+    ``presence:<node id> -> (status code, last_seen seconds)``. Read-modify-write
+    is not atomic across processes; ``recount()`` in the sweeper repairs the
+    counters.
+    """
+
+    PREFIX = 'presence:'
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def _key(self, node_id):
+        return f'{self.PREFIX}{node_id}'
+
+    def _count(self, old, new):
+        for code, delta in ((old, -1), (new, 1)):
+            if code:
+                try:
+                    self.cache.incr(f'{self.PREFIX}count:{code}', delta)
+                except ValueError:
+                    self.cache.set(f'{self.PREFIX}count:{code}', max(delta, 0), None)
+
+    def touch(self, node_id, status, when):
+        old, seen = self.cache.get(self._key(node_id), (UNKNOWN, 0.0))
+        code = _CODES[status]
+        self.cache.set(self._key(node_id), (code, max(seen, when.timestamp())), None)
+        if old != code:
+            self._count(old, code)
+        return _NAMES.get(old)
+
+    def set_status(self, node_id, status, only_if_seen_before=None):
+        old, seen = self.cache.get(self._key(node_id), (UNKNOWN, 0.0))
+        code = _CODES[status]
+        if old == code or (only_if_seen_before and seen >= only_if_seen_before.timestamp()):
+            return False
+        self.cache.set(self._key(node_id), (code, seen), None)
+        self._count(old, code)
+        return True
+
+    def forget(self, node_id):
+        old, _ = self.cache.get(self._key(node_id), (UNKNOWN, 0.0))
+        self.cache.delete(self._key(node_id))
+        if old:
+            self._count(old, UNKNOWN)
+
+    def get(self, node_id):
+        entry = self.cache.get(self._key(node_id))
+        return (_NAMES[entry[0]], _to_datetime(entry[1])) if entry else None
+
+    def get_many(self, node_ids):
+        found = self.cache.get_many([self._key(node_id) for node_id in node_ids])
+        return {
+            node_id: (_NAMES[entry[0]], _to_datetime(entry[1]))
+            for node_id in node_ids
+            if (entry := found.get(self._key(node_id)))
+        }
+
+    def counts(self):
+        return (
+            self.cache.get(f'{self.PREFIX}count:{ONLINE}', 0),
+            self.cache.get(f'{self.PREFIX}count:{OFFLINE}', 0),
+        )
+
+    def items(self):
+        # The cache cannot list its keys, so walk the node ids in chunks
+        node_ids = list(Node.objects.order_by('pk').values_list('pk', flat=True))
+        for i in range(0, len(node_ids), 1000):
+            for node_id, (status, last_seen) in self.get_many(node_ids[i:i + 1000]).items():
+                yield node_id, status, last_seen
+
+    def is_loaded(self):
+        return bool(self.cache.get(f'{self.PREFIX}loaded'))
+
+    def load(self, rows):
+        self.cache.set_many({
+            self._key(node_id): (_CODES[status], last_seen.timestamp() if last_seen else 0.0)
+            for node_id, status, last_seen in rows
+        }, None)
+        self.recount()
+        self.cache.set(f'{self.PREFIX}loaded', True, None)
+
+    def recount(self):
+        online = offline = 0
+        for _, status, _ in self.items():
+            online += status == 'ONLINE'
+            offline += status == 'OFFLINE'
+        self.cache.set_many({f'{self.PREFIX}count:{ONLINE}': online, f'{self.PREFIX}count:{OFFLINE}': offline}, None)
+
+    def reconciled_until(self):
+        return _to_datetime(self.cache.get(f'{self.PREFIX}reconciled_until', 0.0))
+
+    def set_reconciled_until(self, when):
+        self.cache.set(f'{self.PREFIX}reconciled_until', when.timestamp(), None)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _default_path():
+    name = str(connections['default'].settings_dict['NAME'])
+    if name == ':memory:' or 'mode=memory' in name:
+        return None
+    return f'{name}.presence'
+
+
+def get_store():
+    """The process-wide presence store, or None when PRESENCE['BACKEND'] is None."""
+    global _store
+    if _store is None:
+        backend = presence_setting('BACKEND')
+        if backend is None or backend == 'db':
+            return None
+        with _store_lock:
+            if _store is None:
+                if backend == 'cache':
+                    store = CachePresenceStore(presence_setting('CACHE_ALIAS'))
+                else:
+                    store = MmapPresenceStore(presence_setting('PATH') or _default_path())
+                if not store.is_loaded():
+                    store.load(Node.objects.values_list('pk', 'status', 'last_seen').iterator(chunk_size=5000))
+                _store = store
+    return _store
+
+
+def sync_from_db(node_ids=None):
+    """
+    Load node statuses from the Node table into the store, e.g. after
+    bulk_create() or queryset.update() bypassed the model signals. With no
+    ``node_ids`` the whole store is resynced and deleted nodes are dropped.
+    """
+    store = get_store()
+    if store is None:
+        return
+    nodes = Node.objects.order_by()
+    if node_ids is not None:
+        nodes = nodes.filter(pk__in=node_ids)
+    store.load(nodes.values_list('pk', 'status', 'last_seen').iterator(chunk_size=5000))
+    if node_ids is None:
+        existing = set(Node.objects.values_list('pk', flat=True))
+        for node_id in [node_id for node_id, _, _ in store.items() if node_id not in existing]:
+            store.forget(node_id)
+
+
+def reset_store():
+    """Forget the process-wide store (e.g. after changing settings or databases)."""
+    global _store
+    _store = None
+
+
+def status_counts():
+    """(total, online, offline) from the store, or None without a store."""
+    store = get_store()
+    if store is None:
+        return None
+    online, offline = store.counts()
+    return online + offline, online, offline
+
+
+def apply_presence(nodes):
+    """Overwrite ``status``/``last_seen`` of Node instances with the store's values."""
+    store = get_store()
+    nodes = list(nodes)
+    if store is None or not nodes:
+        return nodes
+    entries = store.get_many([node.pk for node in nodes])
+    for node in nodes:
+        entry = entries.get(node.pk)
+        if entry:
+            node.status, last_seen = entry
+            if last_seen and (node.last_seen is None or last_seen > node.last_seen):
+                node.last_seen = last_seen
+    return nodes
+
+
+def reconcile(now=None):
+    """
+    Copy last_seen values that changed since the last run from the store to
+    the Node table with one batched statement, and repair statuses the Node
+    table disagrees on (e.g. a worker died between writing the store and the
+    database), recording the transitions. Returns the number of rows sent.
+    """
+    store = get_store()
+    if store is None:
+        return 0
+    now = now or timezone.now()
+    since = store.reconciled_until()
+    rows = [
+        (last_seen, node_id, last_seen)
+        for node_id, _, last_seen in store.items()
+        if last_seen and (since is None or last_seen > since)
+    ]
+    if rows:
+        adapt = connection.ops.adapt_datetimefield_value
+        table = connection.ops.quote_name(Node._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {table} SET last_seen = %s WHERE id = %s AND (last_seen IS NULL OR last_seen < %s)',
+                [(adapt(seen), node_id, adapt(seen)) for seen, node_id, _ in rows],
+            )
+    _repair_statuses(store, now)
+    # A few seconds of overlap so heartbeats racing this scan are picked up next time
+    store.set_reconciled_until(now - timezone.timedelta(seconds=5))
+    return len(rows)
+
+
+def _repair_statuses(store, now):
+    """Write the store's status to nodes whose Node row disagrees. Returns their ids."""
+    with transaction.atomic():
+        # Inside the transaction, so heartbeat transitions wait for it (and then find the row already switched)
+        current = dict(Node.objects.values_list('pk', 'status').iterator(chunk_size=5000))
+        wrong = {}
+        for node_id, status, _ in store.items():
+            if current.get(node_id, status) != status:
+                wrong.setdefault(status, []).append(node_id)
+        _set_statuses(wrong, now)
+    return [node_id for node_ids in wrong.values() for node_id in node_ids]
+
+
+def _set_statuses(by_status, now):
+    """
+    Switch the nodes in ``by_status`` ({status: [node id, ...]}) to that
+    status in the Node table where they are not already in it, and record the
+    transitions. Returns the node ids switched.
+    """
+    switched = []
+    for status, node_ids in by_status.items():
+        for i in range(0, len(node_ids), 500):
+            nodes = Node.objects.filter(pk__in=node_ids[i:i + 500]).exclude(status=status)
+            changed = list(nodes.values_list('pk', flat=True))
+            nodes.filter(pk__in=changed).update(status=status, updated_at=now)
+            NodeStatusChange.objects.bulk_create(
+                [NodeStatusChange(node_id=node_id, status=status, changed_at=now) for node_id in changed],
+                batch_size=1000,
+            )
+            switched += changed
+    return switched
+
+
+def sweep(offline_after=None, now=None):
+    """
+    Mark ONLINE nodes OFFLINE when their last heartbeat is older than
+    ``offline_after`` seconds, recording the transitions. Returns the node ids marked.
+
+    With a store, the store's last_seen decides (the Node table's lags until
+    reconcile()). The store and the Node table are switched for the same
+    nodes inside one database transaction: the store compare lets a heartbeat
+    arriving meanwhile win, and a heartbeat arriving after the store flip
+    waits for the transaction before writing its own transition.
+    """
+    store = get_store()
+    now = now or timezone.now()
+    if offline_after is None:
+        offline_after = presence_setting('OFFLINE_AFTER')
+    cutoff = now - timezone.timedelta(seconds=offline_after)
+
+    with transaction.atomic():
+        if store is None:
+            stale = list(
+                Node.objects.select_for_update()
+                .filter(Q(last_seen__lt=cutoff) | Q(last_seen__isnull=True), status='ONLINE')
+                .values_list('pk', flat=True)
+            )
+        else:
+            candidates = [
+                node_id for node_id, status, last_seen in store.items()
+                if status == 'ONLINE' and (last_seen is None or last_seen < cutoff)
+            ]
+            if not candidates:
+                return []
+            # Hold the rows (the write lock on SQLite) before touching the store
+            list(Node.objects.select_for_update().filter(pk__in=candidates).values_list('pk', flat=True))
+            stale = [
+                node_id for node_id in candidates
+                if store.set_status(node_id, 'OFFLINE', only_if_seen_before=cutoff)
+            ]
+        return _set_statuses({'OFFLINE': stale}, now)
+
+
+@receiver(post_save, sender=Node)
+def _node_saved(sender, instance, **kwargs):
+    # Keeps the store in step with status changes made outside the heartbeat path (admin, forms)
+    store = get_store()
+    if store is not None:
+        store.set_status(instance.pk, instance.status)
+
+
+@receiver(post_delete, sender=Node)
+def _node_deleted(sender, instance, **kwargs):
+    store = get_store()
+    if store is not None:
+        store.forget(instance.pk)
@@ -0,0 +1,246 @@
+"""
+Per-device API tokens for the ESP32 endpoints.
+
+A token looks like ``<prefix>.<secret>``. Only an HMAC-SHA256 digest of the
+secret is stored, so verification costs one HMAC instead of a password hash.
+Verified prefixes are kept in a bounded in-process cache, so the hot device
+endpoints do not hit the database for authentication. Cache entries are
+dropped immediately in this process when a token is saved or deleted, and
+expire after DEVICE_TOKEN_CACHE['TTL_SECONDS'] in other worker processes.
+
+A token lets its device act as its own node only. The one exception is
+relaying: a gateway's token may also send messages and status updates for
+the nodes whose ``relay_gateway`` it is, as it forwards what it hears from
+them over LoRa (the binary ingest server applies the same rule, see
+communication/ingest.py).
+"""
+import hashlib
+import hmac
+import secrets
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import DeviceToken, Node
+
+DEFAULT_CACHE = {
+    'TTL_SECONDS': 60,
+    'MAX_ENTRIES': 100000,
+}
+
+# prefix -> (expires_at_monotonic, (digest, node_id, is_gateway, esp32_device_id) or None for unknown prefixes)
+_cache = OrderedDict()
+_MISSING = object()
+
+
+def _cache_setting(key):
+    return getattr(settings, 'DEVICE_TOKEN_CACHE', {}).get(key, DEFAULT_CACHE[key])
+
+
+def _hmac_key():
+    key = getattr(settings, 'DEVICE_TOKEN_HMAC_KEY', None) or settings.SECRET_KEY
+    return key.encode()
+
+
+def hash_secret(secret):
+    """HMAC-SHA256 hex digest of the secret part of a token."""
+    return hmac.new(_hmac_key(), secret.encode(), hashlib.sha256).hexdigest()
+
+
+def generate_token():
+    """Return (prefix, secret, token) for a new random token."""
+    prefix = secrets.token_hex(4)
+    secret = secrets.token_urlsafe(24)
+    return prefix, secret, f'{prefix}.{secret}'
+
+
+def invalidate(prefixes=None):
+    """Drop cached entries for ``prefixes``, or the whole cache if None."""
+    if prefixes is None:
+        _cache.clear()
+        return
+    for prefix in prefixes:
+        _cache.pop(prefix, None)
+
+
+def _cached(prefix):
+    cached = _cache.get(prefix)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    return _MISSING
+
+
+def _remember(prefix, entry):
+    if prefix not in _cache and len(_cache) >= _cache_setting('MAX_ENTRIES'):
+        # Evict the oldest entry; keeps memory bounded across large fleets
+        _cache.popitem(last=False)
+    _cache[prefix] = (time.monotonic() + _cache_setting('TTL_SECONDS'), entry)
+    return entry
+
+
+def _active(prefix):
+    return DeviceToken.objects.filter(prefix=prefix, revoked_at__isnull=True).values_list(
+        'digest', 'node_id', 'node__is_gateway', 'node__esp32_device_id'
+    )
+
+
+def _lookup(prefix):
+    entry = _cached(prefix)
+    if entry is _MISSING:
+        entry = _remember(prefix, _active(prefix).first())
+    return entry
+
+
+async def _alookup(prefix):
+    entry = _cached(prefix)
+    if entry is _MISSING:
+        entry = _remember(prefix, await _active(prefix).afirst())
+    return entry
+
+
+def _check(entry, secret):
+    """(node_id, is_gateway, esp32_device_id) of a cache entry whose digest matches ``secret``, else None."""
+    if entry is None:
+        return None
+    digest, *identity = entry
+    if hmac.compare_digest(digest, hash_secret(secret)):
+        return identity
+    return None
+
+
+def _identify(token):
+    prefix, sep, secret = token.partition('.')
+    if not sep or not secret:
+        return None
+    return _check(_lookup(prefix), secret)
+
+
+async def _aidentify(token):
+    prefix, sep, secret = token.partition('.')
+    if not sep or not secret:
+        return None
+    return _check(await _alookup(prefix), secret)
+
+
+def verify_token(token):
+    """Return the node id the token belongs to, or None if it is not valid."""
+    identity = _identify(token)
+    return identity[0] if identity else None
+
+
+async def averify_token(token):
+    """Async version of verify_token(); only a cache miss touches the database."""
+    identity = await _aidentify(token)
+    return identity[0] if identity else None
+
+
+def token_from_request(request):
+    """Read the token from ``Authorization: Token <token>`` (or Bearer) or ``X-Device-Token``."""
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if header:
+        scheme, _, token = header.partition(' ')
+        if scheme.lower() in ('token', 'bearer'):
+            return token.strip()
+    return request.META.get('HTTP_X_DEVICE_TOKEN', '')
+
+
+def device_token_required(view_func):
+    """
+    Decorator for device API views. Rejects requests without a valid device
+    token with 401 and sets ``request.device_node_id``,
+    ``request.device_is_gateway`` and ``request.device_esp32_id`` for the view.
+    Disabled (``request.device_node_id = None``) when settings.DEVICE_API_AUTH is False.
+    Works for both sync and async views.
+    """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapped(request, *args, **kwargs):
+            if not getattr(settings, 'DEVICE_API_AUTH', True):
+                request.device_node_id = None
+                return await view_func(request, *args, **kwargs)
+
+            token = token_from_request(request)
+            identity = await _aidentify(token) if token else None
+            if identity is None:
+                return JsonResponse({'error': 'Invalid or missing device token'}, status=401)
+            request.device_node_id, request.device_is_gateway, request.device_esp32_id = identity
+            return await view_func(request, *args, **kwargs)
+        return async_wrapped
+
+    @wraps(view_func)
+    def wrapped(request, *args, **kwargs):
+        if not getattr(settings, 'DEVICE_API_AUTH', True):
+            request.device_node_id = None
+            return view_func(request, *args, **kwargs)
+
+        token = token_from_request(request)
+        identity = _identify(token) if token else None
+        if identity is None:
+            return JsonResponse({'error': 'Invalid or missing device token'}, status=401)
+        request.device_node_id, request.device_is_gateway, request.device_esp32_id = identity
+        return view_func(request, *args, **kwargs)
+    return wrapped
+
+
+def device_allowed(request, node, relay=False):
+    """
+    Whether the authenticated device may act as ``node``: it is that node,
+    or with ``relay`` (sending messages and status updates) the gateway
+    set as the node's ``relay_gateway``.
+    """
+    device_node_id = getattr(request, 'device_node_id', None)
+    if device_node_id is None or device_node_id == node.pk:
+        return True
+    return relay and getattr(request, 'device_is_gateway', False) and node.relay_gateway_id == device_node_id
+
+
+def issue_tokens(nodes, rotate=True):
+    """
+    Create a new token for each node, revoking existing tokens first if
+    ``rotate`` is True. Returns a list of (node, token) pairs; the plain
+    tokens are only available here.
+    """
+    nodes = list(nodes)
+    issued = []
+    rows = []
+    for node in nodes:
+        prefix, secret, token = generate_token()
+        rows.append(DeviceToken(node=node, prefix=prefix, digest=hash_secret(secret)))
+        issued.append((node, token))
+
+    with transaction.atomic():
+        if rotate:
+            revoke_tokens(nodes)
+        DeviceToken.objects.bulk_create(rows, batch_size=1000)
+    return issued
+
+
+def revoke_tokens(nodes):
+    """Revoke all active tokens of ``nodes``. Returns the number revoked."""
+    active = DeviceToken.objects.filter(node__in=nodes, revoked_at__isnull=True)
+    prefixes = list(active.values_list('prefix', flat=True))
+    count = active.update(revoked_at=timezone.now())
+    # Bulk update bypasses signals, so invalidate explicitly
+    invalidate(prefixes)
+    return count
+
+
+@receiver(post_save, sender=DeviceToken)
+@receiver(post_delete, sender=DeviceToken)
+def _invalidate_token(sender, instance, **kwargs):
+    invalidate([instance.prefix])
+
+
+@receiver(post_save, sender=Node)
+def _node_saved(sender, instance, update_fields=None, **kwargs):
+    # The cached entries carry is_gateway and the ESP32 ID; status heartbeats leave them alone
+    if update_fields is None or {'is_gateway', 'esp32_device_id'} & set(update_fields):
+        invalidate([prefix for prefix, (_, entry) in list(_cache.items()) if entry and entry[1] == instance.pk])
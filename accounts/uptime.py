@@ -0,0 +1,272 @@
+"""
+Node status history and uptime/availability computation.
+
+Status transitions are stored append-only in NodeStatusChange. Availability over
+a window is computed with interval arithmetic: completed days come from the
+precomputed NodeDailyUptime summaries (built by ``manage.py rollup_uptime``) and
+only the un-summarized tail is derived from raw transitions.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from .models import Node, NodeStatusChange, NodeDailyUptime
+from .presence import get_store
+
+
+def day_start(day):
+    """Return the aware UTC datetime at midnight of ``day``."""
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def _other_status(status):
+    return 'OFFLINE' if status == 'ONLINE' else 'ONLINE'
+
+
+def _previous_status(store, node, status, when):
+    """Touch the presence store and return the status the node had before."""
+    previous = store.touch(node.pk, status, when) if store is not None else None
+    return previous or node.status
+
+
+def record_status(node, status, when=None):
+    """
+    Set ``node.status`` and append a NodeStatusChange if the status actually changed.
+    With a presence store, heartbeats that repeat the current status only
+    update the store (last_seen reaches the Node table via presence.reconcile());
+    without one they bump ``last_seen`` in the database.
+    Returns True if a transition was recorded.
+    """
+    when = when or timezone.now()
+    store = get_store()
+    changed = False
+    if _previous_status(store, node, status, when) != status:
+        # Conditional UPDATE: of two concurrent heartbeats reporting the same
+        # transition, only one matches the row and records it
+        changed = Node.objects.filter(pk=node.pk).exclude(status=status).update(
+            status=status, last_seen=when, updated_at=when
+        ) == 1
+    elif store is None:
+        Node.objects.filter(pk=node.pk).update(last_seen=when, updated_at=when)
+    node.status = status
+    node.last_seen = when
+    if changed:
+        NodeStatusChange.objects.create(node=node, status=status, changed_at=when)
+    return changed
+
+
+async def arecord_status(node, status, when=None):
+    """Async version of record_status(), for the ASGI device API."""
+    return await sync_to_async(record_status)(node, status, when)
+
+
+def record_statuses(updates, when=None):
+    """
+    Batch form of record_status() for many heartbeats received together.
+
+    ``updates`` is a sequence of (node_id, status) in arrival order, all
+    stamped ``when``. Every actual transition gets a NodeStatusChange; the
+    nodes are then updated with one UPDATE per final status. With a presence
+    store only nodes whose status changed are written. Unknown node ids are
+    skipped. Returns the set of node ids updated.
+    """
+    when = when or timezone.now()
+    store = get_store()
+    current = {}
+    if store is not None:
+        for node_id, status in updates:
+            previous = store.touch(node_id, status, when)
+            if previous is not None:
+                current.setdefault(node_id, previous)
+    missing = {node_id for node_id, _ in updates} - current.keys()
+    if missing:
+        current.update(Node.objects.filter(pk__in=missing).values_list('pk', 'status'))
+        if store is not None:
+            for node_id in missing - current.keys():
+                store.forget(node_id)
+
+    changes = []
+    final = {} if store is not None else dict(current)
+    for node_id, status in updates:
+        if node_id in current and current[node_id] != status:
+            changes.append(NodeStatusChange(node_id=node_id, status=status, changed_at=when))
+            current[node_id] = final[node_id] = status
+
+    for status in ('ONLINE', 'OFFLINE'):
+        node_ids = [node_id for node_id, last in final.items() if last == status]
+        if node_ids:
+            Node.objects.filter(pk__in=node_ids).update(status=status, last_seen=when, updated_at=when)
+    NodeStatusChange.objects.bulk_create(changes, batch_size=1000)
+    return set(final)
+
+
+def _initial_statuses(node_ids, start):
+    """
+    Status of each node at ``start``: the last transition before it, else the
+    opposite of the first transition after it, else the node's current status.
+    Returns {node_id: (status, created_at)}.
+    """
+    before = NodeStatusChange.objects.filter(
+        node=OuterRef('pk'), changed_at__lt=start
+    ).order_by('-changed_at').values('status')[:1]
+    after = NodeStatusChange.objects.filter(
+        node=OuterRef('pk'), changed_at__gte=start
+    ).order_by('changed_at').values('status')[:1]
+
+    nodes = Node.objects.order_by()
+    if node_ids is not None:
+        nodes = nodes.filter(pk__in=node_ids)
+    rows = nodes.annotate(
+        prev_status=Subquery(before), next_status=Subquery(after)
+    ).values_list('pk', 'status', 'created_at', 'prev_status', 'next_status')
+
+    initial = {}
+    for pk, current, created_at, prev_status, next_status in rows:
+        if prev_status:
+            status = prev_status
+        elif next_status:
+            status = _other_status(next_status)
+        else:
+            status = current
+        initial[pk] = (status, created_at)
+    return initial
+
+
+def _interval_totals(node_ids, start, end):
+    """
+    Walk raw transitions in [start, end) and return
+    {node_id: [online_seconds, transitions, total_seconds]}.
+    Each node's interval is clipped to its creation time.
+    """
+    initial = _initial_statuses(node_ids, start)
+    changes = NodeStatusChange.objects.filter(
+        changed_at__gte=start, changed_at__lt=end
+    ).order_by('node_id', 'changed_at')
+    if node_ids is not None:
+        changes = changes.filter(node_id__in=node_ids)
+
+    by_node = {}
+    for node_id, status, changed_at in changes.values_list('node_id', 'status', 'changed_at'):
+        by_node.setdefault(node_id, []).append((status, changed_at))
+
+    totals = {}
+    for node_id, (status, created_at) in initial.items():
+        lower = max(start, created_at)
+        if lower >= end:
+            totals[node_id] = [0, 0, 0]
+            continue
+        online = 0
+        cursor = lower
+        count = 0
+        for new_status, changed_at in by_node.get(node_id, ()):
+            count += 1
+            if changed_at <= cursor:
+                status = new_status
+                continue
+            if status == 'ONLINE':
+                online += (changed_at - cursor).total_seconds()
+            cursor = changed_at
+            status = new_status
+        if status == 'ONLINE':
+            online += (end - cursor).total_seconds()
+        totals[node_id] = [int(online), count, int((end - lower).total_seconds())]
+    return totals
+
+
+def rollup_day(day):
+    """
+    Build (or rebuild) NodeDailyUptime rows for every node for one UTC day.
+    Returns the number of rows written.
+    """
+    start = day_start(day)
+    end = start + timedelta(days=1)
+    totals = _interval_totals(None, start, end)
+    rows = [
+        NodeDailyUptime(node_id=node_id, day=day, online_seconds=online, transitions=count)
+        for node_id, (online, count, total) in totals.items()
+        if total
+    ]
+    NodeDailyUptime.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['node', 'day'],
+        update_fields=['online_seconds', 'transitions'],
+    )
+    return len(rows)
+
+
+def summarized_until():
+    """Return the first day that has no summary yet, or None if nothing was rolled up."""
+    last = NodeDailyUptime.objects.aggregate(last=Max('day'))['last']
+    return last + timedelta(days=1) if last else None
+
+
+def availability(node_ids=None, days=30, now=None):
+    """
+    Uptime for the last ``days`` whole UTC days plus today so far.
+
+    Returns {node_id: {'online_seconds', 'total_seconds', 'transitions', 'percent'}}.
+    Pass ``node_ids=None`` for the whole fleet.
+    """
+    now = now or timezone.now()
+    today = now.date()
+    first_day = today - timedelta(days=days)
+    window_start = day_start(first_day)
+
+    tail_day = summarized_until()
+    if tail_day is None or tail_day < first_day:
+        tail_day = first_day
+    tail_day = min(tail_day, today)
+
+    totals = _interval_totals(node_ids, day_start(tail_day), now)
+
+    if tail_day > first_day:
+        summaries = NodeDailyUptime.objects.filter(day__gte=first_day, day__lt=tail_day)
+        if node_ids is not None:
+            summaries = summaries.filter(node_id__in=node_ids)
+        summaries = summaries.order_by().values('node_id').annotate(
+            online=Sum('online_seconds'), changes=Sum('transitions')
+        )
+        summarized = {row['node_id']: row for row in summaries}
+        for node_id, entry in totals.items():
+            row = summarized.get(node_id)
+            if row:
+                entry[0] += row['online']
+                entry[1] += row['changes']
+
+    # Denominator: the window clipped to when each node was created.
+    created = dict(
+        (Node.objects.filter(pk__in=totals.keys()) if node_ids is not None else Node.objects.all())
+        .order_by().values_list('pk', 'created_at')
+    )
+    result = {}
+    for node_id, (online, count, _) in totals.items():
+        lower = max(window_start, created.get(node_id, window_start))
+        total = max(int((now - lower).total_seconds()), 0)
+        result[node_id] = {
+            'online_seconds': online,
+            'total_seconds': total,
+            'transitions': count,
+            'percent': round(100.0 * online / total, 1) if total else 0.0,
+        }
+    return result
+
+
+def fleet_availability(per_node):
+    """Aggregate an ``availability()`` result into one fleet-wide percentage."""
+    online = sum(entry['online_seconds'] for entry in per_node.values())
+    total = sum(entry['total_seconds'] for entry in per_node.values())
+    return round(100.0 * online / total, 1) if total else 0.0
+
+
+def cached_fleet_availability(days=30, timeout=300):
+    """Fleet-wide availability percentage, recomputed at most every ``timeout`` seconds."""
+    return cache.get_or_set(
+        f'uptime:fleet:{days}d',
+        lambda: fleet_availability(availability(days=days)),
+        timeout,
+    )
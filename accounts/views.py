@@ -8,16 +8,19 @@ from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib import messages
 from .forms import NodeRegistrationForm
 from .models import Node
+from .directory import node_status_counts
+from .presence import apply_presence
 from communication.models import Message
+from communication.conversations import conversations_for, unread_total
+from communication.fanout import inbox_for
+from communication.sharding import newest
 
 
 def home(request):
     """
     Home page showing overall statistics and links.
     """
-    total_nodes = Node.objects.count()
-    online_nodes = Node.objects.filter(status='ONLINE').count()
-    offline_nodes = Node.objects.filter(status='OFFLINE').count()
+    total_nodes, online_nodes, offline_nodes = node_status_counts()
 
     context = {
         'total_nodes': total_nodes,
@@ -101,17 +104,22 @@ def node_dashboard(request):
     except Node.DoesNotExist:
         messages.error(request, 'No node profile found for your account. Please contact an administrator.')
         return redirect('accounts:home')
+    apply_presence([node])
 
     # Handle message sending
     if request.method == 'POST':
         receiver_id = request.POST.get('receiver')
+        receiver_device_id = request.POST.get('receiver_device_id', '').strip()
         content = request.POST.get('content', '').strip()
 
-        if not receiver_id or not content:
+        if not (receiver_id or receiver_device_id) or not content:
             messages.error(request, 'Please select a receiver and enter a message.')
         else:
             try:
-                receiver = get_object_or_404(Node, pk=receiver_id)
+                if receiver_id:
+                    receiver = get_object_or_404(Node, pk=receiver_id)
+                else:
+                    receiver = get_object_or_404(Node, esp32_device_id=receiver_device_id)
                 if receiver.pk == node.pk:
                     messages.error(request, 'You cannot send a message to yourself.')
                 else:
@@ -126,18 +134,19 @@ def node_dashboard(request):
             except Exception as e:
                 messages.error(request, f'Error sending message: {str(e)}')
 
-    # Get other nodes for the message form dropdown
-    other_nodes = Node.objects.exclude(pk=node.pk).order_by('node_name')
+    # The target node field autocompletes from the node directory API, so the
+    # page no longer embeds every other node.
 
-    # Get inbox (messages received by this node)
-    inbox_messages = node.received_messages.all()[:50]  # Last 50 messages
+    # Get inbox (direct, group and broadcast messages received by this node)
+    inbox_messages = inbox_for(node, limit=50)  # Last 50 messages
 
-    # Get outbox (messages sent by this node)
-    outbox_messages = node.sent_messages.all()[:50]  # Last 50 messages
+    # Get outbox (messages sent by this node, from every shard)
+    outbox_messages = newest(Message.objects.filter(sender=node), 50, related=('receiver', 'group'))  # Last 50 messages
 
     context = {
         'node': node,
-        'other_nodes': other_nodes,
+        'conversations': conversations_for(node),
+        'unread_total': unread_total(node),
         'inbox_messages': inbox_messages,
         'outbox_messages': outbox_messages,
     }
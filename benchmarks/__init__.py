@@ -0,0 +1,6 @@
+"""
+Micro-benchmarks for the LoRa communication server.
+
+Each module is runnable on its own, e.g. ``python -m benchmarks.device_auth``,
+and uses a throwaway in-memory test database.
+"""
@@ -0,0 +1,202 @@
+"""
+Device API throughput under ASGI (native async views) vs WSGI (sync views).
+
+Each simulated device repeatedly sends a heartbeat, sends a message and
+fetches its inbox. The WSGI run feeds the WSGI handler from a thread pool,
+like a threaded WSGI server; the ASGI run drives the ASGI handler with one
+coroutine per device, like an ASGI server holding every connection open.
+Both go through the full middleware stack and device token auth, with rate
+limiting off. Each mode runs in its own process against a SQLite file.
+
+Usage: python -m benchmarks.asgi_vs_wsgi [--devices 1000] [--cycles 3] [--threads 32]
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from benchmarks.common import create_nodes, setup_django
+
+
+def _requests(device, peer, token):
+    """The (method, path, body) sequence of one device cycle."""
+    return [
+        ('POST', '/communication/api/nodes/update-status/',
+         {'esp32_device_id': device, 'status': 'ONLINE'}),
+        ('POST', '/communication/api/messages/send/',
+         {'from_esp32_device_id': device, 'to_esp32_device_id': peer, 'payload': f'Reading from {device}'}),
+        ('GET', f'/communication/api/messages/inbox/{device}/', None),
+    ]
+
+
+def _prepare(devices):
+    from django.conf import settings
+    from accounts.tokens import issue_tokens
+
+    settings.DEVICE_RATE_LIMIT = {'ENABLED': False}
+    nodes = create_nodes(devices)
+    tokens = dict((node.esp32_device_id, token) for node, token in issue_tokens(nodes))
+    ids = list(tokens)
+    return [(device, ids[(i + 1) % len(ids)], tokens[device]) for i, device in enumerate(ids)]
+
+
+def _summary(mode, latencies, errors, seconds):
+    latencies.sort()
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+    }
+
+
+def run_wsgi(devices, cycles, threads):
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connection
+
+    application = get_wsgi_application()
+
+    def call(method, path, body, token):
+        data = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(data)),
+            'HTTP_AUTHORIZATION': f'Token {token}',
+            'wsgi.input': io.BytesIO(data),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+        }
+        status = []
+        body = b''.join(application(environ, lambda s, headers: status.append(s)))
+        return status[0].startswith('200')
+
+    def device_loop(device, peer, token):
+        latencies, errors = [], 0
+        for _ in range(cycles):
+            for method, path, body in _requests(device, peer, token):
+                start = time.perf_counter()
+                errors += not call(method, path, body, token)
+                latencies.append(time.perf_counter() - start)
+        connection.close()
+        return latencies, errors
+
+    plan = _prepare(devices)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda args: device_loop(*args), plan))
+    seconds = time.perf_counter() - start
+    return _summary(f'wsgi ({threads} threads)', [l for r in results for l in r[0]], sum(r[1] for r in results), seconds)
+
+
+def run_asgi(devices, cycles):
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+
+    async def call(method, path, body, token):
+        data = json.dumps(body).encode() if body is not None else b''
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'server': ('testserver', 80),
+            'client': ('127.0.0.1', 50000),
+            'headers': [
+                (b'host', b'testserver'),
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(data)).encode()),
+                (b'authorization', f'Token {token}'.encode()),
+            ],
+        }
+        messages = [{'type': 'http.request', 'body': data, 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await application(scope, receive, send)
+        return status[0] == 200
+
+    async def device_loop(device, peer, token):
+        latencies, errors = [], 0
+        for _ in range(cycles):
+            for method, path, body in _requests(device, peer, token):
+                start = time.perf_counter()
+                errors += not await call(method, path, body, token)
+                latencies.append(time.perf_counter() - start)
+        return latencies, errors
+
+    async def main(plan):
+        return await asyncio.gather(*(device_loop(*args) for args in plan))
+
+    plan = _prepare(devices)
+    start = time.perf_counter()
+    results = asyncio.run(main(plan))
+    seconds = time.perf_counter() - start
+    return _summary('asgi (async views)', [l for r in results for l in r[0]], sum(r[1] for r in results), seconds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--devices', type=int, default=1000, help='Concurrent simulated devices')
+    parser.add_argument('--cycles', type=int, default=3, help='Heartbeat/send/inbox cycles per device')
+    parser.add_argument('--threads', type=int, default=32, help='WSGI worker threads')
+    parser.add_argument('--mode', choices=['wsgi', 'asgi'], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.mode:
+        # Child process: one mode against a fresh SQLite file
+        with tempfile.TemporaryDirectory() as tmp:
+            setup_django(db_file=Path(tmp) / 'bench.sqlite3')
+            if args.mode == 'wsgi':
+                result = run_wsgi(args.devices, args.cycles, args.threads)
+            else:
+                result = run_asgi(args.devices, args.cycles)
+        print(json.dumps(result))
+        return 0
+
+    print(f'{args.devices} devices x {args.cycles} cycles x 3 requests')
+    print(f'{"mode":<22}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+    for mode in ('wsgi', 'asgi'):
+        env = dict(os.environ, DEVICE_API_ASYNC='1' if mode == 'asgi' else '0')
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.asgi_vs_wsgi', '--mode', mode,
+             '--devices', str(args.devices), '--cycles', str(args.cycles), '--threads', str(args.threads)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['mode']:<22}{result['requests_per_second']:>10.0f}{result['p50_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}{result['errors']:>8}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
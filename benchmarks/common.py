@@ -0,0 +1,62 @@
+"""
+Shared helpers for benchmark scripts: Django bootstrap and timing.
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(settings_module='lora_comm.settings', db_file=None):
+    """
+    Configure Django and create a migrated throwaway test database.
+    In memory by default; pass ``db_file`` for a SQLite file that several
+    threads can write to concurrently.
+    """
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    if db_file:
+        connection.settings_dict['TEST']['NAME'] = str(db_file)
+    connection.creation.create_test_db(verbosity=0)
+
+
+def create_nodes(count, prefix='BENCH'):
+    """Bulk-create ``count`` users and nodes without password hashing."""
+    from django.contrib.auth.models import User
+    from accounts.models import Node
+    from accounts.presence import sync_from_db
+
+    users = User.objects.bulk_create(
+        [User(username=f'{prefix.lower()}{i}', password='!') for i in range(count)],
+        batch_size=1000,
+    )
+    nodes = Node.objects.bulk_create(
+        [
+            Node(user=user, node_name=f'{prefix} Node {i}', esp32_device_id=f'{prefix}-{i:06d}', lora_node_id=f'LORA-{i:06d}')
+            for i, user in enumerate(users)
+        ],
+        batch_size=1000,
+    )
+    # bulk_create() skips the signals that keep the presence store in step
+    sync_from_db([node.pk for node in nodes])
+    return nodes
+
+
+def per_call(func, number=10000, repeat=5):
+    """Best-of-``repeat`` seconds per call of ``func()``."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
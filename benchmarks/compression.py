@@ -0,0 +1,73 @@
+"""
+Response compression: bytes saved and CPU cost per endpoint.
+
+Fetches each endpoint uncompressed, then reports the gzip (and Brotli, if
+installed) size and the time to compress that body.
+Usage: python -m benchmarks.compression [--nodes 1000]
+"""
+import argparse
+import json
+import sys
+
+from benchmarks.common import create_nodes, per_call, setup_django
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    setup_django()
+
+    from django.contrib.auth.models import User
+    from django.test import Client, override_settings
+    from django.urls import reverse
+    from django.utils.text import compress_string
+    from communication.models import Message
+    from lora_comm import middleware
+
+    nodes = create_nodes(args.nodes)
+    Message.objects.bulk_create([
+        Message(sender=nodes[i % 10 + 1], receiver=nodes[0], content=f'Sensor report {i}: temperature 21.{i % 10}C, battery 3.{i % 9}V')
+        for i in range(60)
+    ])
+    admin = User.objects.create(username='bench-admin', is_staff=True, is_superuser=True)
+    device = nodes[0].esp32_device_id
+
+    client = Client()
+    client.force_login(admin)
+    requests = [
+        ('update_status (heartbeat)', lambda: client.post(
+            reverse('communication:api_update_status'),
+            json.dumps({'esp32_device_id': device, 'status': 'ONLINE'}),
+            content_type='application/json')),
+        ('inbox (50 messages)', lambda: client.get(reverse('communication:api_get_inbox', args=[device]))),
+        ('node directory', lambda: client.get(reverse('communication:api_node_directory') + '?limit=100')),
+        ('admin_dashboard', lambda: client.get(reverse('communication:admin_dashboard'))),
+        ('track_nodes', lambda: client.get(reverse('communication:track_nodes'))),
+    ]
+
+    min_size = middleware._config('MIN_SIZE')
+    print(f'{"endpoint":<28}{"raw":>10}{"gzip":>10}{"gzip us":>10}{"br":>10}{"br us":>10}')
+    with override_settings(DEVICE_API_AUTH=False, DEVICE_RATE_LIMIT={'ENABLED': False}):
+        for name, fetch in requests:
+            body = fetch().content
+            if len(body) < min_size:
+                print(f'{name:<28}{len(body):>10}  (below MIN_SIZE={min_size}, sent uncompressed)')
+                continue
+            gzip_size = len(compress_string(body))
+            gzip_time = per_call(lambda: compress_string(body), number=50, repeat=3)
+            line = f'{name:<28}{len(body):>10}{gzip_size:>10}{gzip_time * 1e6:>10.0f}'
+            if middleware.brotli is not None:
+                quality = middleware._config('BROTLI_QUALITY')
+                br_size = len(middleware.brotli.compress(body, quality=quality))
+                br_time = per_call(lambda: middleware.brotli.compress(body, quality=quality), number=50, repeat=3)
+                line += f'{br_size:>10}{br_time * 1e6:>10.0f}'
+            print(line)
+    if middleware.brotli is None:
+        print('(brotli not installed; Brotli columns skipped)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
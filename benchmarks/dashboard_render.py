@@ -0,0 +1,63 @@
+"""
+Admin dashboard render time with and without fragment caching.
+
+Renders admin_dashboard and track_nodes for a fleet of 5k nodes, first with
+caching disabled (DummyCache, the old behaviour) and then with a warm cache.
+Usage: python -m benchmarks.dashboard_render [--nodes 5000]
+"""
+import argparse
+import sys
+import time
+
+from benchmarks.common import create_nodes, setup_django
+
+
+def render_time(client, url, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        best = min(best, time.perf_counter() - start)
+        assert response.status_code == 200, response.status_code
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    setup_django()
+
+    from django.contrib.auth.models import User
+    from django.core.cache import cache
+    from django.test import Client, override_settings
+    from django.urls import reverse
+    from communication.models import Message
+
+    nodes = create_nodes(args.nodes)
+    Message.objects.bulk_create([
+        Message(sender=nodes[i], receiver=nodes[i + 1], content=f'Benchmark message {i}')
+        for i in range(50)
+    ])
+    admin = User.objects.create(username='bench-admin', is_staff=True, is_superuser=True)
+    client = Client()
+    client.force_login(admin)
+
+    dummy = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    print(f'{args.nodes} nodes')
+    for name in ('communication:admin_dashboard', 'communication:track_nodes'):
+        url = reverse(name)
+        with override_settings(CACHES=dummy):
+            uncached = render_time(client, url, args.repeat)
+        cache.clear()
+        client.get(url)  # warm the fragments
+        cached = render_time(client, url, args.repeat)
+        print(f'{name}: uncached {uncached * 1000:.1f} ms, cached {cached * 1000:.1f} ms '
+              f'({uncached / cached:.1f}x)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""
+Device token authentication overhead.
+
+Measures token verification on a warm cache and the full per-request overhead
+of the ``device_token_required`` decorator against an undecorated view.
+Usage: python -m benchmarks.device_auth
+"""
+import sys
+
+from benchmarks.common import create_nodes, per_call, setup_django
+
+BUDGET_SECONDS = 50e-6
+
+
+def main():
+    setup_django()
+
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from accounts.tokens import device_token_required, issue_tokens, verify_token
+
+    node = create_nodes(1)[0]
+    (_, token), = issue_tokens([node])
+
+    def view(request):
+        return HttpResponse()
+
+    protected = device_token_required(view)
+    request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {token}')
+
+    verify_token(token)  # warm the cache
+    verify = per_call(lambda: verify_token(token))
+    plain = per_call(lambda: view(request))
+    wrapped = per_call(lambda: protected(request))
+    overhead = wrapped - plain
+
+    print(f'verify_token (warm cache): {verify * 1e6:.2f} us')
+    print(f'decorator overhead per request: {overhead * 1e6:.2f} us (budget {BUDGET_SECONDS * 1e6:.0f} us)')
+    if overhead > BUDGET_SECONDS:
+        print('FAIL: auth overhead exceeds budget')
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
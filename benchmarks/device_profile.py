@@ -0,0 +1,128 @@
+"""
+Worker startup time and per-request overhead of the lean device-API profile
+(lora_comm.settings_device) vs the full site (lora_comm.settings).
+
+Startup: fresh interpreters import Django, run django.setup(), build the
+WSGI handler and load the URLconf, i.e. everything a worker does before it
+can answer its first request. Reported as the median over ``--starts`` runs
+with the number of imported modules.
+
+Per request: the WSGI handler is called directly (no server or socket)
+against an in-memory test database, with rate limiting off. "rejected" is a
+heartbeat without a token (401): middleware, URL resolution and token check
+only. "heartbeat" and "inbox" are authenticated requests that reach the
+database. Each profile runs in its own processes.
+
+Usage: python -m benchmarks.device_profile [--starts 10] [--requests 2000]
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROFILES = (
+    ('full site', 'lora_comm.settings'),
+    ('device API', 'lora_comm.settings_device'),
+)
+
+
+def measure_startup():
+    start = time.perf_counter()
+    import django
+    from django.core.wsgi import get_wsgi_application
+    from django.urls import get_resolver
+
+    django.setup()
+    get_wsgi_application()
+    get_resolver().url_patterns
+    return {'seconds': time.perf_counter() - start, 'modules': len(sys.modules)}
+
+
+def measure_requests(number):
+    from benchmarks.common import create_nodes, per_call, setup_django
+
+    setup_django()
+    from django.conf import settings
+    from django.core.wsgi import get_wsgi_application
+
+    from accounts.tokens import issue_tokens
+
+    settings.DEVICE_RATE_LIMIT = {'ENABLED': False}
+    (node, token), = issue_tokens(create_nodes(1))
+    device = node.esp32_device_id
+    application = get_wsgi_application()
+
+    def call(method, path, body=None, token=None, expect='200'):
+        data = json.dumps(body).encode() if body is not None else b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': '',
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'CONTENT_TYPE': 'application/json',
+            'CONTENT_LENGTH': str(len(data)),
+            'wsgi.input': io.BytesIO(data),
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+        }
+        if token:
+            environ['HTTP_AUTHORIZATION'] = f'Token {token}'
+        status = []
+        b''.join(application(environ, lambda s, headers: status.append(s)))
+        if not status[0].startswith(expect):
+            raise RuntimeError(f'{method} {path}: {status[0]}')
+
+    heartbeat = ('POST', '/communication/api/nodes/update-status/', {'esp32_device_id': device, 'status': 'ONLINE'})
+    inbox = ('GET', f'/communication/api/messages/inbox/{device}/')
+    scenarios = {
+        'rejected': lambda: call(*heartbeat, expect='401'),
+        'heartbeat': lambda: call(*heartbeat, token=token),
+        'inbox': lambda: call(*inbox, token=token),
+    }
+    return {name: per_call(func, number=number) for name, func in scenarios.items()}
+
+
+def _child(settings_module, *args):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.device_profile', *args],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--starts', type=int, default=10, help='Fresh worker starts per profile')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per timing round')
+    parser.add_argument('--child', choices=['startup', 'requests'], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child == 'startup':
+        print(json.dumps(measure_startup()))
+        return 0
+    if args.child == 'requests':
+        print(json.dumps(measure_requests(args.requests)))
+        return 0
+
+    print(f'{"profile":<12}{"startup ms":>12}{"modules":>9}{"rejected us":>13}{"heartbeat us":>14}{"inbox us":>10}')
+    for name, settings_module in PROFILES:
+        starts = [_child(settings_module, '--child', 'startup') for _ in range(args.starts)]
+        per_request = _child(settings_module, '--child', 'requests', '--requests', str(args.requests))
+        print(
+            f'{name:<12}{statistics.median(s["seconds"] for s in starts) * 1000:>12.1f}'
+            f'{starts[0]["modules"]:>9}'
+            f'{per_request["rejected"] * 1e6:>13.0f}{per_request["heartbeat"] * 1e6:>14.0f}'
+            f'{per_request["inbox"] * 1e6:>10.0f}'
+        )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
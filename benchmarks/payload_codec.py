@@ -0,0 +1,151 @@
+"""
+LoRa payload codec: compression ratio, fragments per message and CPU cost.
+
+Generates a corpus of long field messages (station reports, alerts,
+JSON telemetry, operator notes), trains preset dictionaries of several
+sizes on the first part and measures on the rest, so the dictionary never
+saw the messages it compresses. Also times reassembly of fragments
+submitted by a gateway (stored in the database until complete).
+Usage: python -m benchmarks.payload_codec [--messages 20000] [--seed 1]
+"""
+import argparse
+import random
+import sys
+import time
+
+from benchmarks.common import create_nodes, per_call, setup_django
+
+_STATIONS = ['North Field', 'River Bend', 'Pump House', 'East Gate', 'Hill Top', 'Barn 2', 'Well 7', 'Orchard']
+_DIRECTIONS = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
+_NOTES = [
+    'checked the fence along the north boundary, two posts need replacing',
+    'pump 2 restarted after the power cut, pressure back to normal',
+    'gate left open by the delivery truck, closed it at {h}:{m:02d}',
+    'water trough at the east paddock is low, refill before evening',
+    'solar panel on the relay mast covered in dust, cleaned it',
+    'battery swapped on sensor S-{s:04d}, old one reads {v:.2f}V',
+    'heavy rain expected tonight, moving the tractor into the barn',
+    'signal weak near the river, consider another relay node',
+    'irrigation zone {z} running {n} minutes longer than scheduled',
+    'all animals accounted for at the evening count',
+]
+
+
+def _corpus(count, seed):
+    rng = random.Random(seed)
+
+    def report():
+        return (
+            f'Station {rng.choice(_STATIONS)} report {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d} '
+            f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}: temp {rng.uniform(-5, 38):.1f}C, '
+            f'humidity {rng.randint(20, 99)}%, pressure {rng.uniform(990, 1030):.1f} hPa, '
+            f'wind {rng.uniform(0, 15):.1f} m/s {rng.choice(_DIRECTIONS)}, rain {rng.uniform(0, 5):.1f} mm, '
+            f'soil moisture {rng.randint(5, 60)}%, battery {rng.uniform(3.3, 4.2):.2f}V, '
+            f'RSSI {rng.randint(-120, -60)} dBm, SNR {rng.uniform(-10, 12):.1f} dB'
+        )
+
+    def alert():
+        level = rng.randint(60, 120)
+        return (
+            f'ALERT zone {rng.randint(1, 12)}: water level {level} cm above threshold {level - rng.randint(1, 20)} cm '
+            f'at sensor S-{rng.randint(1, 500):04d}, pump {rng.randint(1, 4)} started, '
+            f'operator notified, next reading in {rng.choice([5, 10, 15])} minutes'
+        )
+
+    def telemetry():
+        return '{' + ','.join([
+            f'"node":"ESP32-{rng.randint(1, 999):03d}"',
+            f'"seq":{rng.randint(1, 99999)}',
+            f'"temp":{rng.uniform(-5, 38):.1f}',
+            f'"hum":{rng.randint(20, 99)}',
+            f'"bat":{rng.uniform(3.3, 4.2):.2f}',
+            f'"rssi":{rng.randint(-120, -60)}',
+            f'"snr":{rng.uniform(-10, 12):.1f}',
+            f'"uptime":{rng.randint(0, 10 ** 6)}',
+            f'"gps":[{rng.uniform(-90, 90):.5f},{rng.uniform(-180, 180):.5f}]',
+        ]) + '}'
+
+    def note():
+        return '. '.join(
+            rng.choice(_NOTES).format(
+                h=rng.randint(0, 23), m=rng.randint(0, 59), s=rng.randint(1, 500),
+                v=rng.uniform(3.0, 3.6), z=rng.randint(1, 12), n=rng.randint(5, 45),
+            ).capitalize()
+            for _ in range(rng.randint(1, 8))
+        ) + '.'
+
+    kinds = [report, alert, telemetry, note]
+    return [rng.choices(kinds, weights=[4, 1, 3, 2])[0]() for _ in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    setup_django()
+
+    from communication import codec
+
+    corpus = _corpus(args.messages, args.seed)
+    cut = len(corpus) * 3 // 4
+    training, test = corpus[:cut], corpus[cut:]
+    raw_bytes = sum(len(content.encode('utf-8')) for content in test)
+    fragment_size = codec.codec_setting('FRAGMENT_SIZE')
+    print(f'{len(training)} training / {len(test)} test messages, '
+          f'{raw_bytes / len(test):.0f} bytes on average, fragments of {fragment_size} bytes\n')
+
+    setups = [('raw', None), ('deflate', b'')]
+    for size in (1024, 2048, 4096, 8192):
+        start = time.perf_counter()
+        dictionary = codec.train_dictionary(training, size)
+        print(f'trained {size}-byte dictionary in {time.perf_counter() - start:.2f}s')
+        setups.append((f'dict {size}', dictionary))
+    print()
+
+    print(f'{"method":<14}{"bytes/msg":>10}{"ratio":>8}{"frags/msg":>10}{"1 frag":>8}{"enc us":>9}{"dec us":>9}')
+    for name, dictionary in setups:
+        if dictionary is None:
+            encoded = [bytes([codec.RAW]) + content.encode('utf-8') for content in test]
+        else:
+            encoded = [codec.encode(content, 1, dictionary) for content in test]
+        lookup = {1: dictionary}.get
+        for content, payload in zip(test[:500], encoded[:500]):
+            assert codec.decode(payload, lookup) == content
+        size = sum(map(len, encoded))
+        fragments = [len(codec.split(payload, 0, fragment_size)) for payload in encoded]
+        sample = test[:200]
+        sample_encoded = encoded[:200]
+        if dictionary is None:
+            enc_time = dec_time = 0
+        else:
+            enc_time = per_call(lambda: [codec.encode(content, 1, dictionary) for content in sample], 5, 3) / len(sample)
+            dec_time = per_call(lambda: [codec.decode(payload, lookup) for payload in sample_encoded], 5, 3) / len(sample)
+        print(
+            f'{name:<14}{size / len(test):>10.0f}{size / raw_bytes:>8.0%}'
+            f'{sum(fragments) / len(test):>10.2f}{fragments.count(1) / len(test):>8.0%}'
+            f'{enc_time * 1e6:>9.0f}{dec_time * 1e6:>9.0f}'
+        )
+
+    # Gateway-side reassembly: fragments of the longest messages, stored until complete
+    node = create_nodes(1)[0]
+    long_messages = sorted(test, key=len, reverse=True)[:200]
+    transfers = [
+        codec.split(bytes([codec.RAW]) + content.encode('utf-8'), tag, fragment_size)
+        for tag, content in enumerate(long_messages)
+    ]
+    count = sum(map(len, transfers))
+    start = time.perf_counter()
+    for transfer in transfers:
+        for fragment in reversed(transfer):
+            content, _, _ = codec.receive_fragment(node.pk, fragment)
+        assert content is not None
+    elapsed = time.perf_counter() - start
+    print(f'\nreassembly: {count} fragments of {len(transfers)} messages, '
+          f'{elapsed / count * 1e3:.2f} ms per fragment')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+Benchmark suite for the web pages and the device API, with a tracked baseline.
+
+For every fleet size (10, 1k and 100k nodes by default) the throwaway test
+databases (the default one and any message shards) are emptied and filled by
+communication.dataset with ``messages_per_node`` messages per node over the
+last 30 days. Each scenario is then requested through the test client as the
+busiest node (its pages and inbox are the heaviest to serve) or as a staff
+user: a few warm-up requests, ``repeat`` timed ones (median, p95 and min
+latency), one under CaptureQueriesContext on every connection (query count)
+and one under tracemalloc (peak memory allocated while handling the
+request).
+
+Results are saved as JSON and compared with a baseline file. Query counts
+must not grow at all; latency and allocations may grow by ``threshold``
+(plus a small absolute allowance for noise) before counting as a regression.
+Run with: python manage.py run_benchmarks
+"""
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone as dt_timezone
+from pathlib import Path
+
+BENCHMARK_DIR = Path(__file__).resolve().parent
+DEFAULT_BASELINE = BENCHMARK_DIR / 'baseline.json'
+DEFAULT_OUTPUT = BENCHMARK_DIR / 'results' / 'latest.json'
+
+DEFAULT_SIZES = (10, 1000, 100000)
+SCENARIOS = (
+    'home',
+    'admin_dashboard',
+    'track_nodes',
+    'node_detail',
+    # A repeated view answered 304 Not Modified from the ETag
+    'node_detail_revalidate',
+    'node_dashboard',
+    'api_update_status',
+    'api_get_inbox',
+    # Last: every new message invalidates the cached Recent Messages panel
+    'api_send_message',
+)
+
+# Absolute growth ignored on top of the relative threshold (timer and allocator noise)
+LATENCY_ALLOWANCE_MS = 0.5
+ALLOCATION_ALLOWANCE_KIB = 64
+
+_UNLIMITED = {'rate': 1e9, 'burst': 1e9}
+
+
+def _reset_stores():
+    from django.core.cache import caches
+
+    from accounts.presence import reset_store
+    from communication.ratelimit import reset_limiter
+    from communication.topology import reset_topology
+
+    reset_store()
+    reset_topology()
+    reset_limiter()
+    for cache in caches.all():
+        cache.clear()
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Migrated test databases in place of the configured ones: the default
+    database and, with MESSAGE_SHARDS, every message shard.
+    """
+    from django.db import DEFAULT_DB_ALIAS, connections
+
+    from communication.sharding import message_databases
+
+    # Shards first, so migrating the default database never sees a real shard
+    aliases = [alias for alias in message_databases() if alias != DEFAULT_DB_ALIAS] + [DEFAULT_DB_ALIAS]
+    created = []
+    try:
+        for alias in aliases:
+            created.append((alias, connections[alias].creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False,
+            )))
+        yield
+    finally:
+        _reset_stores()
+        for alias, old_name in reversed(created):
+            connections[alias].creation.destroy_test_db(old_name, verbosity=0)
+
+
+def empty_database():
+    """
+    Delete every row of every test database (an in-memory test database
+    outlives destroy_test_db) and reset the stores.
+    """
+    from django.core.management import call_command
+
+    from communication.sharding import message_databases
+
+    for alias in message_databases():
+        call_command('flush', interactive=False, verbosity=0, database=alias)
+    _reset_stores()
+
+
+class Fleet:
+    """One dataset size: the busiest node, a peer, a staff user and logged-in clients."""
+
+    def __init__(self, size, messages_per_node=10, seed=1):
+        from django.contrib.auth.models import User
+        from django.db.models import Count
+        from django.test import Client
+
+        from accounts.models import Node
+        from accounts.tokens import issue_tokens
+        from communication.dataset import create_fleet, create_messages
+        from communication.models import Message
+        from communication.traffic import rollup
+
+        node_ids = create_fleet(size, prefix='BENCH', gateways=max(1, size // 1000), seed=seed)
+        create_messages(
+            node_ids, size * messages_per_node, raw=True, drop_indexes=size >= 10000, seed=seed,
+        )
+        # Fill the traffic counters behind the Admin Dashboard charts
+        rollup()
+        busiest = (
+            Message.objects.values('sender').annotate(sent=Count('pk')).order_by('-sent')
+            .values_list('sender', flat=True).first()
+        )
+        self.size = size
+        self.node = Node.objects.get(pk=busiest or node_ids[0])
+        self.peer = Node.objects.exclude(pk=self.node.pk).order_by('pk').first()
+        (_, self.token), = issue_tokens([self.node])
+
+        admin = User.objects.create(username='bench-admin', is_staff=True, is_superuser=True)
+        self.admin_client = Client()
+        self.admin_client.force_login(admin)
+        self.node_client = Client()
+        self.node_client.force_login(self.node.user)
+        self.device_client = Client(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def rate_limits(self):
+        """DEVICE_RATE_LIMIT with the benchmark device's buckets opened up (the check itself still runs)."""
+        from django.conf import settings
+
+        limits = dict(getattr(settings, 'DEVICE_RATE_LIMIT', {}))
+        nodes = dict(limits.get('NODES', {}))
+        nodes[self.node.esp32_device_id] = {
+            endpoint: _UNLIMITED for endpoint in ('update_status', 'send_message', 'inbox')
+        }
+        limits['NODES'] = nodes
+        return limits
+
+    def request(self, scenario):
+        """A zero-argument callable issuing one request for ``scenario``."""
+        from django.urls import reverse
+
+        device = self.node.esp32_device_id
+        if scenario == 'home':
+            return lambda: self.node_client.get(reverse('accounts:home'))
+        if scenario == 'node_dashboard':
+            return lambda: self.node_client.get(reverse('accounts:node_dashboard'))
+        if scenario in ('admin_dashboard', 'track_nodes'):
+            return lambda: self.admin_client.get(reverse(f'communication:{scenario}'))
+        if scenario == 'node_detail':
+            url = reverse('communication:node_detail', args=[self.node.pk])
+            return lambda: self.admin_client.get(url)
+        if scenario == 'node_detail_revalidate':
+            url = reverse('communication:node_detail', args=[self.node.pk])
+            etag = self.admin_client.get(url)['ETag']
+            return lambda: self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        if scenario == 'api_update_status':
+            body = json.dumps({'esp32_device_id': device, 'status': 'ONLINE'})
+            url = reverse('communication:api_update_status')
+            return lambda: self.device_client.post(url, body, content_type='application/json')
+        if scenario == 'api_send_message':
+            body = json.dumps({
+                'from_esp32_device_id': device,
+                'to_esp32_device_id': self.peer.esp32_device_id,
+                'payload': 'Benchmark message',
+            })
+            url = reverse('communication:api_send_message')
+            return lambda: self.device_client.post(url, body, content_type='application/json')
+        if scenario == 'api_get_inbox':
+            url = reverse('communication:api_get_inbox', args=[device])
+            return lambda: self.device_client.get(url)
+        raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def _checked(request):
+    def call():
+        response = request()
+        if response.status_code >= 300 and response.status_code != 304:
+            raise RuntimeError(f'HTTP {response.status_code}: {response.content[:200]!r}')
+        return response
+    return call
+
+
+def measure(request, repeat=20, warmup=3):
+    """Latency, query count and peak allocation of one scenario."""
+    from django.db import connections
+    from django.test.utils import CaptureQueriesContext
+
+    request = _checked(request)
+    for _ in range(warmup):
+        request()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        request()
+        timings.append((time.perf_counter() - start) * 1000)
+    # Every connection, so queries on message shards count too
+    with ExitStack() as stack:
+        captured = [stack.enter_context(CaptureQueriesContext(conn)) for conn in connections.all()]
+        request()
+    # Read now: the next request clears the connections' query logs
+    query_count = sum(len(queries) for queries in captured)
+    tracemalloc.start()
+    try:
+        request()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    timings.sort()
+    return {
+        'median_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        'min_ms': round(timings[0], 3),
+        'queries': query_count,
+        'peak_alloc_kib': round(peak / 1024, 1),
+    }
+
+
+def run(sizes=DEFAULT_SIZES, scenarios=SCENARIOS, messages_per_node=10, repeat=20, warmup=3, seed=1, log=None):
+    """Run ``scenarios`` at every fleet size. Returns the results document."""
+    import django
+    from django.db import connection
+    from django.test import override_settings
+
+    from communication.sharding import message_shards
+
+    results = {}
+    with throwaway_database():
+        for size in sizes:
+            empty_database()
+            start = time.perf_counter()
+            fleet = Fleet(size, messages_per_node, seed)
+            if log:
+                log(f'{size} nodes: dataset built in {time.perf_counter() - start:.1f}s')
+            results[str(size)] = {}
+            with override_settings(DEVICE_RATE_LIMIT=fleet.rate_limits()):
+                for scenario in scenarios:
+                    metrics = measure(fleet.request(scenario), repeat, warmup)
+                    results[str(size)][scenario] = metrics
+                    if log:
+                        log(f'  {scenario}: {metrics["median_ms"]:.2f} ms, {metrics["queries"]} queries, '
+                            f'{metrics["peak_alloc_kib"]:.0f} KiB')
+    return {
+        'meta': {
+            'created': datetime.now(dt_timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'message_shards': len(message_shards()),
+            'machine': platform.machine(),
+            'messages_per_node': messages_per_node,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def save(document, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(document, indent=2, sort_keys=True) + '\n')
+
+
+def load(path):
+    return json.loads(Path(path).read_text())
+
+
+def compare(current, baseline, threshold=0.5):
+    """
+    Compare two results documents. Returns a list of
+    (size, scenario, metric, baseline_value, current_value) regressions;
+    sizes and scenarios missing from either side are skipped.
+    """
+    regressions = []
+    for size, scenarios in current['results'].items():
+        for scenario, metrics in scenarios.items():
+            base = baseline['results'].get(size, {}).get(scenario)
+            if base is None:
+                continue
+            if metrics['queries'] > base['queries']:
+                regressions.append((size, scenario, 'queries', base['queries'], metrics['queries']))
+            for metric, allowance in (('median_ms', LATENCY_ALLOWANCE_MS), ('peak_alloc_kib', ALLOCATION_ALLOWANCE_KIB)):
+                if metrics[metric] > base[metric] * (1 + threshold) + allowance:
+                    regressions.append((size, scenario, metric, base[metric], metrics[metric]))
+    return regressions
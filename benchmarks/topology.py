@@ -0,0 +1,128 @@
+"""
+Mesh topology: graph load, incremental route repair, route lookups and the
+visualization payload.
+
+Builds a random geometric mesh (nodes scattered on a square, links between
+near neighbors, quality falling off with distance) of 10k nodes and about
+100k links with a few gateways. Link updates are applied incrementally and
+every few hundred updates the trees are checked against a from-scratch
+recomputation.
+Usage: python -m benchmarks.topology [--nodes 10000] [--links 100000] [--gateways 10] [--updates 2000]
+"""
+import argparse
+import math
+import random
+import sys
+import time
+
+from benchmarks.common import create_nodes, per_call, setup_django
+
+
+def random_mesh(node_ids, link_count, rng):
+    """[(source, target, quality)] linking each node to its nearest neighbors."""
+    points = {node_id: (rng.random(), rng.random()) for node_id in node_ids}
+    per_node = max(1, link_count // len(node_ids))
+    cell = math.sqrt(per_node / len(node_ids)) * 1.5
+    grid = {}
+    for node_id, (x, y) in points.items():
+        grid.setdefault((int(x / cell), int(y / cell)), []).append(node_id)
+    links = []
+    for node_id, (x, y) in points.items():
+        cx, cy = int(x / cell), int(y / cell)
+        nearby = [
+            (math.dist((x, y), points[other]), other)
+            for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+            for other in grid.get((cx + dx, cy + dy), ())
+            if other != node_id
+        ]
+        nearby.sort()
+        for distance, other in nearby[:per_node]:
+            links.append((node_id, other, max(0.1, 1 - distance / (2 * cell)) * rng.uniform(0.8, 1.0)))
+    return links
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--links', type=int, default=100000)
+    parser.add_argument('--gateways', type=int, default=10)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    setup_django()
+
+    from django.utils import timezone
+    from accounts.models import Node
+    from communication.models import NodeLink
+    from communication.topology import MeshGraph, get_topology
+
+    rng = random.Random(args.seed)
+    node_ids = [node.pk for node in create_nodes(args.nodes)]
+    gateways = rng.sample(node_ids, args.gateways)
+    Node.objects.filter(pk__in=gateways).update(is_gateway=True)
+    links = random_mesh(node_ids, args.links, rng)
+    now = timezone.now()
+    NodeLink.objects.bulk_create(
+        [NodeLink(source_id=s, target_id=t, quality=q, observations=1, last_heard=now) for s, t, q in links],
+        batch_size=5000,
+    )
+    print(f'{args.nodes} nodes, {len(links)} links, {args.gateways} gateways')
+
+    topology = get_topology()
+    start = time.perf_counter()
+    graph = topology.current()
+    print(f'load from database + build trees: {(time.perf_counter() - start) * 1000:.0f} ms')
+
+    def rebuild():
+        fresh = MeshGraph()
+        fresh.out = graph.out
+        fresh.inc = graph.inc
+        fresh.set_gateways(gateways)
+        return fresh
+
+    start = time.perf_counter()
+    rebuild()
+    full = time.perf_counter() - start
+    print(f'full route recomputation: {full * 1000:.1f} ms')
+
+    updates = [rng.choice(links)[:2] for _ in range(args.updates)]
+    mismatches = 0
+    start = time.perf_counter()
+    for i, (source, target) in enumerate(updates):
+        # Mix of improvements, degradations and links dropping out
+        roll = rng.random()
+        graph.set_link(source, target, 0 if roll < 0.2 else rng.uniform(0.1, 1.0))
+        if i % 500 == 499:
+            elapsed = time.perf_counter() - start
+            expected = rebuild()
+            for root, tree in graph.trees.items():
+                reference = expected.trees[root].dist
+                if tree.dist.keys() != reference.keys() or any(
+                    abs(tree.dist[node] - reference[node]) > 1e-9 for node in reference
+                ):
+                    mismatches += 1
+            start = time.perf_counter() - elapsed
+    incremental = (time.perf_counter() - start) / len(updates)
+    print(f'incremental link update: {incremental * 1e6:.0f} µs '
+          f'({full / incremental:.0f}x faster than recomputing); tree mismatches: {mismatches}')
+
+    targets = rng.sample(node_ids, 1000)
+    lookup = per_call(lambda: topology.route(rng.choice(targets)), number=2000, repeat=3)
+    print(f'route lookup from best gateway: {lookup * 1e6:.1f} µs')
+    lookup = per_call(lambda: topology.route(rng.choice(targets), rng.choice(node_ids)), number=200, repeat=3)
+    print(f'route lookup between two nodes: {lookup * 1e6:.0f} µs')
+
+    for min_quality in (0, 0.9):
+        topology._rendered = {}
+        start = time.perf_counter()
+        body = topology.render(min_quality)
+        cold = time.perf_counter() - start
+        warm = per_call(lambda: topology.render(min_quality), number=100, repeat=3)
+        print(f'graph payload (min_quality={min_quality}): {len(body) / 1024:.0f} KiB, '
+              f'{cold * 1000:.0f} ms cold, {warm * 1e6:.0f} µs cached')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
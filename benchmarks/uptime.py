@@ -0,0 +1,78 @@
+"""
+Fleet availability: availability() over the whole fleet for a 30-day window.
+
+Creates the nodes and a status history of random transitions spread over the
+window, then times availability() from raw transitions only and again after
+the completed days were rolled up into NodeDailyUptime.
+Usage: python -m benchmarks.uptime [--nodes 10000] [--transitions 20]
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import timedelta
+
+from benchmarks.common import create_nodes, setup_django
+
+BUDGET_SECONDS = 1.0
+
+
+def timed(func, repeat=3):
+    """Best-of-``repeat`` (seconds, result) of ``func()``."""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--nodes', type=int, default=10000)
+    parser.add_argument('--transitions', type=int, default=20, help='status changes per node over the window')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    setup_django()
+
+    from django.utils import timezone
+    from accounts.models import Node, NodeStatusChange
+    from accounts.uptime import availability, rollup_day
+
+    rng = random.Random(args.seed)
+    now = timezone.now()
+    start = now - timedelta(days=args.days + 1)
+    nodes = create_nodes(args.nodes)
+    Node.objects.update(created_at=start)
+
+    changes = []
+    for node in nodes:
+        moments = sorted(rng.uniform(0, (now - start).total_seconds()) for _ in range(args.transitions))
+        status = rng.choice(['ONLINE', 'OFFLINE'])
+        for seconds in moments:
+            status = 'OFFLINE' if status == 'ONLINE' else 'ONLINE'
+            changes.append(NodeStatusChange(node=node, status=status, changed_at=start + timedelta(seconds=seconds)))
+    NodeStatusChange.objects.bulk_create(changes, batch_size=5000)
+    print(f'{args.nodes} nodes, {len(changes)} transitions over {args.days} days')
+
+    raw, result = timed(lambda: availability(days=args.days, now=now))
+    print(f'availability() from raw transitions: {raw * 1000:.0f} ms for {len(result)} nodes')
+
+    today = now.date()
+    for offset in range(args.days, 0, -1):
+        rollup_day(today - timedelta(days=offset))
+    summarized, result = timed(lambda: availability(days=args.days, now=now))
+    print(f'availability() after rollup_uptime: {summarized * 1000:.0f} ms for {len(result)} nodes '
+          f'(budget {BUDGET_SECONDS * 1000:.0f} ms)')
+
+    if summarized > BUDGET_SECONDS:
+        print('FAIL: fleet availability exceeds budget')
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Denormalized per-node activity summaries: message totals, the newest
+message time and the busiest peer.
+
+Every inserted message adds to its sender's NodeActivity row (sent_count)
+and, for direct messages, to its receiver's (received_count), in the same
+transaction as the conversation summaries (conversations.record_messages()
+calls record_activity()). The busiest peer is the conversation with the
+highest ``message_count``; as those counts only grow, it only has to be
+compared with the conversations the new messages touched.
+
+``version`` is bumped on every change to what the node detail page shows
+about a node's messages: new messages, unread counts released by
+acknowledgements and dead-lettering, and purges (touch()). activity_for()
+serves the summaries from the cache, keyed by a per-node generation that
+writes replace once they commit; a summary read before a commit can only be
+cached under the generation it replaced, so it is never served again. Like
+the counters in traffic.py these are history: purged messages stay counted.
+rebuild_activity() recounts the stored messages.
+"""
+import time
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from .models import Conversation, Message, NodeActivity
+from .sharding import message_databases
+
+CACHE_TIMEOUT = 3600
+
+_TABLE = NodeActivity._meta.db_table
+
+# The busiest peer of the new messages overtook the stored one (or is the stored one)
+_OVERTAKEN = (
+    'excluded.busiest_peer_id IS NOT NULL AND (a.busiest_peer_id IS NULL '
+    'OR a.busiest_peer_id = excluded.busiest_peer_id OR excluded.busiest_peer_count > a.busiest_peer_count)'
+)
+
+# Conflicting rows add up the totals and keep the newer message time and busiest peer
+_UPSERT = (
+    f'INSERT INTO {_TABLE} AS a (node_id, sent_count, received_count, last_message_at, busiest_peer_id, '
+    'busiest_peer_count, version, updated_at) '
+    'VALUES {values} '
+    'ON CONFLICT (node_id) DO UPDATE SET '
+    'sent_count = a.sent_count + excluded.sent_count, '
+    'received_count = a.received_count + excluded.received_count, '
+    'last_message_at = CASE WHEN a.last_message_at IS NULL OR excluded.last_message_at > a.last_message_at '
+    'THEN excluded.last_message_at ELSE a.last_message_at END, '
+    f'busiest_peer_id = CASE WHEN {_OVERTAKEN} THEN excluded.busiest_peer_id ELSE a.busiest_peer_id END, '
+    f'busiest_peer_count = CASE WHEN {_OVERTAKEN} THEN excluded.busiest_peer_count ELSE a.busiest_peer_count END, '
+    'version = a.version + 1, '
+    'updated_at = excluded.updated_at'
+)
+
+# The conversation with the most messages of every node
+_BUSIEST_SQL = f"""
+SELECT node_id, peer_id, message_count FROM (
+    SELECT node_id, peer_id, message_count,
+           ROW_NUMBER() OVER (PARTITION BY node_id ORDER BY message_count DESC, last_message_at DESC) AS position
+    FROM {Conversation._meta.db_table} WHERE message_count > 0
+) AS ranked
+WHERE position = 1
+"""
+
+
+def _generation_key(node_id):
+    return f'node_activity:generation:{node_id}'
+
+
+def _cache_key(node_id):
+    """The cache key of node ``node_id``'s summary under its current generation."""
+    key = _generation_key(node_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, time.time_ns(), None)
+        generation = cache.get(key)
+    return f'node_activity:{node_id}:{generation}'
+
+
+def _invalidate(node_ids):
+    """Start new generations for the summaries of ``node_ids`` once the current transaction commits."""
+    keys = [_generation_key(node_id) for node_id in node_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.set_many(dict.fromkeys(keys, time.time_ns()), None))
+
+
+def record_activity(messages, conversation_counts):
+    """
+    Add newly inserted ``messages`` to their nodes' totals with batched
+    upserts. ``conversation_counts`` maps the (node, peer) conversations
+    the messages touched to their new ``message_count``.
+    """
+    rows = defaultdict(lambda: [0, 0, None])
+    for message in messages:
+        sides = [(message.sender_id, 0)]
+        if message.receiver_id:
+            sides.append((message.receiver_id, 1))
+        for node_id, column in sides:
+            row = rows[node_id]
+            row[column] += 1
+            if row[2] is None or message.created_at > row[2]:
+                row[2] = message.created_at
+    if not rows:
+        return
+
+    # The touched conversation with the most messages is the only candidate per node
+    busiest = {}
+    for (node_id, peer_id), count in conversation_counts.items():
+        if count > busiest.get(node_id, (None, -1))[1]:
+            busiest[node_id] = (peer_id, count)
+    adapt = connection.ops.adapt_datetimefield_value
+    now = adapt(timezone.now())
+    values = [
+        [node_id, sent, received, adapt(last_at), *busiest.get(node_id, (None, 0)), 1, now]
+        for node_id, (sent, received, last_at) in rows.items()
+    ]
+
+    per_statement = min(500, (connection.features.max_query_params or 2500) // 8)
+    with connection.cursor() as cursor:
+        for start in range(0, len(values), per_statement):
+            chunk = values[start:start + per_statement]
+            cursor.execute(
+                _UPSERT.format(values=', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s)'] * len(chunk))),
+                [value for row in chunk for value in row],
+            )
+    _invalidate(rows)
+
+
+def touch(node_ids):
+    """
+    Bump the version of ``node_ids``' summaries after a change that does not
+    alter the totals (unread counts released, messages purged). Call it inside
+    the transaction making the change.
+    """
+    node_ids = sorted(set(node_ids))
+    if not node_ids:
+        return
+    now = timezone.now()
+    for start in range(0, len(node_ids), 500):
+        NodeActivity.objects.filter(pk__in=node_ids[start:start + 500]).update(
+            version=F('version') + 1, updated_at=now
+        )
+    _invalidate(node_ids)
+
+
+def activity_for(node_id):
+    """
+    The summary of node ``node_id`` as a dict (NodeActivity fields, with
+    ``busiest_peer_id``), from the cache when possible. Nodes without
+    messages get zeros and version 0.
+    """
+    key = _cache_key(node_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = NodeActivity.objects.filter(pk=node_id).values(
+            'sent_count', 'received_count', 'last_message_at', 'busiest_peer_id', 'busiest_peer_count',
+            'version', 'updated_at',
+        ).first() or {
+            'sent_count': 0, 'received_count': 0, 'last_message_at': None, 'busiest_peer_id': None,
+            'busiest_peer_count': 0, 'version': 0, 'updated_at': None,
+        }
+        cache.set(key, summary, CACHE_TIMEOUT)
+    return summary
+
+
+def rebuild_activity():
+    """
+    Recompute every summary from the Message table(s) and the conversation
+    summaries (rebuild those first). Versions keep counting up, so cached
+    pages are not mistaken for current. Returns the number of rows.
+    """
+    totals = defaultdict(lambda: [0, 0, None])
+    for using in message_databases():
+        messages = Message.objects.using(using).order_by()
+        for column, field, queryset in (
+            (0, 'sender_id', messages),
+            (1, 'receiver_id', messages.filter(receiver__isnull=False)),
+        ):
+            for node_id, count, last_at in queryset.values_list(field).annotate(Count('pk'), Max('created_at')):
+                row = totals[node_id]
+                row[column] += count
+                if row[2] is None or last_at > row[2]:
+                    row[2] = last_at
+    with connection.cursor() as cursor:
+        cursor.execute(_BUSIEST_SQL)
+        busiest = {node_id: (peer_id, count) for node_id, peer_id, count in cursor.fetchall()}
+
+    now = timezone.now()
+    with transaction.atomic():
+        versions = dict(NodeActivity.objects.values_list('pk', 'version'))
+        NodeActivity.objects.all().delete()
+        NodeActivity.objects.bulk_create([
+            NodeActivity(
+                node_id=node_id,
+                sent_count=sent,
+                received_count=received,
+                last_message_at=last_at,
+                busiest_peer_id=busiest.get(node_id, (None, 0))[0],
+                busiest_peer_count=busiest.get(node_id, (None, 0))[1],
+                version=versions.get(node_id, 0) + 1,
+                updated_at=now,
+            )
+            for node_id, (sent, received, last_at) in totals.items()
+        ], batch_size=2000)
+        _invalidate(versions.keys() | totals.keys())
+    return len(totals)
@@ -2,13 +2,23 @@
 Admin configuration for communication app
 """
 from django.contrib import admin
-from .models import Message
+from .models import Conversation, Message, MessageRecipient, NodeActivity, NodeGroup, NodeLink
+
+
+@admin.register(NodeGroup)
+class NodeGroupAdmin(admin.ModelAdmin):
+    list_display = ['name', 'description', 'created_at']
+    search_fields = ['name']
+    filter_horizontal = ['members']
+    readonly_fields = ['created_at']
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ['id', 'sender', 'receiver', 'content_preview', 'status', 'created_at']
-    list_filter = ['status', 'message_type', 'created_at']
+    # Lists the default database only: with MESSAGE_SHARDS set, direct messages live in
+    # the shards, which cannot join to the node tables. The Admin Dashboard merges them.
+    list_display = ['id', 'sender', 'receiver', 'group', 'is_broadcast', 'content_preview', 'status', 'created_at']
+    list_filter = ['status', 'message_type', 'is_broadcast', 'created_at']
     search_fields = ['content', 'sender__node_name', 'receiver__node_name']
     readonly_fields = ['created_at', 'updated_at']
     date_hierarchy = 'created_at'
@@ -18,3 +28,34 @@ class MessageAdmin(admin.ModelAdmin):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Content Preview'
 
+
+@admin.register(MessageRecipient)
+class MessageRecipientAdmin(admin.ModelAdmin):
+    list_display = ['message', 'node', 'status']
+    list_filter = ['status']
+    raw_id_fields = ['message', 'node']
+
+
+@admin.register(NodeLink)
+class NodeLinkAdmin(admin.ModelAdmin):
+    list_display = ['source', 'target', 'quality', 'rssi', 'snr', 'observations', 'last_heard']
+    raw_id_fields = ['source', 'target']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ['node', 'peer', 'last_message_id', 'last_message_at', 'unread_count', 'message_count']
+    raw_id_fields = ['node', 'peer']
+    # Maintained by communication/conversations.py; use the rebuild_conversations command to repair
+    readonly_fields = ['last_message_id', 'last_message_at', 'unread_count', 'message_count']
+
+
+@admin.register(NodeActivity)
+class NodeActivityAdmin(admin.ModelAdmin):
+    list_display = ['node', 'sent_count', 'received_count', 'last_message_at', 'busiest_peer', 'busiest_peer_count']
+    raw_id_fields = ['node', 'busiest_peer']
+    # Maintained by communication/activity.py; rebuilt by the rebuild_conversations command
+    readonly_fields = [
+        'sent_count', 'received_count', 'last_message_at', 'busiest_peer_count', 'version', 'updated_at'
+    ]
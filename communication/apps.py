@@ -0,0 +1,13 @@
+"""
+App configuration for communication app
+"""
+from django.apps import AppConfig
+
+
+class CommunicationConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'communication'
+
+    def ready(self):
+        # Connect the dashboard cache invalidation signals
+        from . import signals  # noqa: F401
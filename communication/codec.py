@@ -0,0 +1,328 @@
+"""
+Compact payload encoding and fragmentation for messages carried over LoRa.
+
+LoRa frames are tiny (at most 255 bytes, and every byte costs airtime at
+SF7/125 kHz), so long message content is compressed and split into
+sequence-numbered fragments of at most FRAGMENT_SIZE bytes. Integers are
+big-endian, like the ingest protocol (ingest_protocol.py).
+
+Encoded payload:
+
+    method   1 byte   RAW (UTF-8 as is), DEFLATE or DEFLATE_DICT
+    dict id  2 bytes  DEFLATE_DICT only: the PayloadDictionary used
+    body              UTF-8 content, or a raw deflate stream (zlib wbits=-15:
+                      no zlib header or checksum)
+
+encode() keeps whichever method gives the fewest bytes. Short messages
+barely compress on their own; a preset dictionary (zlib's ``zdict``) holding
+the words and phrases common in past messages lets deflate refer back to
+them from the first byte. train_dictionary() builds one from stored
+messages (``manage.py train_payload_dictionary``); devices fetch it from
+the dictionary API once and keep it.
+
+Fragment:
+
+    tag      2 bytes  transfer id: the low 16 bits of the message id for
+                      messages sent by the server, chosen by the sender otherwise
+    index    1 byte   0-based
+    count    1 byte   fragments in the transfer (at most 255)
+    data              the next slice of the encoded payload
+
+Gateways submit the fragments they hear one by one (receive_fragment()).
+They are kept in MessageFragment until the transfer is complete, so
+fragments may reach different workers; incomplete transfers are dropped
+after FRAGMENT_TTL seconds.
+"""
+import heapq
+import struct
+import time
+import zlib
+from collections import Counter, namedtuple
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Message, MessageFragment, PayloadDictionary
+from .sharding import message_databases
+
+DEFAULT_CONFIG = {
+    # Bytes per fragment, header included
+    'FRAGMENT_SIZE': 200,
+    'DICTIONARY_SIZE': 4096,
+    # Newest messages a dictionary is trained on
+    'TRAINING_MESSAGES': 20000,
+    'LEVEL': 9,
+    # Seconds an incomplete transfer is kept
+    'FRAGMENT_TTL': 600,
+    # Seconds before a worker checks for a newer dictionary
+    'DICTIONARY_TTL': 60,
+}
+
+# Encoding methods
+RAW = 0
+DEFLATE = 1
+DEFLATE_DICT = 2
+
+_DICT_HEADER = struct.Struct('!BH')
+FRAGMENT_HEADER = struct.Struct('!HBB')
+MAX_FRAGMENTS = 255
+
+# Longest word sequences considered for a dictionary
+MAX_NGRAM = 4
+
+Fragment = namedtuple('Fragment', 'tag index count data')
+
+
+class CodecError(ValueError):
+    """An encoded payload or fragment that cannot be decoded."""
+
+
+def codec_setting(key):
+    return getattr(settings, 'PAYLOAD_CODEC', {}).get(key, DEFAULT_CONFIG[key])
+
+
+def _deflate(data, level, zdict=None):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict) if zdict else \
+        zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _inflate(data, zdict=None):
+    decompressor = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj(-15)
+    try:
+        result = decompressor.decompress(data) + decompressor.flush()
+    except zlib.error as e:
+        raise CodecError(f'Corrupt payload: {e}')
+    if not decompressor.eof:
+        raise CodecError('Truncated payload')
+    return result
+
+
+def encode(content, dictionary_id=None, dictionary=b'', level=None):
+    """Encode ``content`` with the shortest method; ``dictionary`` is used if given."""
+    level = codec_setting('LEVEL') if level is None else level
+    raw = content.encode('utf-8')
+    candidates = [bytes([RAW]) + raw, bytes([DEFLATE]) + _deflate(raw, level)]
+    if dictionary:
+        candidates.append(_DICT_HEADER.pack(DEFLATE_DICT, dictionary_id) + _deflate(raw, level, dictionary))
+    return min(candidates, key=len)
+
+
+def decode(data, dictionary_for=None):
+    """
+    Decode an encoded payload back to text. ``dictionary_for(id)`` returns
+    the bytes of a dictionary (default: the trained dictionaries).
+    """
+    if not data:
+        raise CodecError('Empty payload')
+    method = data[0]
+    if method == RAW:
+        raw = data[1:]
+    elif method == DEFLATE:
+        raw = _inflate(data[1:])
+    elif method == DEFLATE_DICT:
+        if len(data) < _DICT_HEADER.size:
+            raise CodecError('Truncated payload')
+        _, dictionary_id = _DICT_HEADER.unpack_from(data)
+        dictionary_for = dictionary_for or get_dictionaries().get
+        raw = _inflate(data[_DICT_HEADER.size:], dictionary_for(dictionary_id))
+    else:
+        raise CodecError(f'Unknown encoding method {method}')
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        raise CodecError('Invalid UTF-8 content')
+
+
+def train_dictionary(contents, size=None):
+    """
+    Build a preset dictionary from message ``contents``: the word sequences
+    (up to MAX_NGRAM words) that would save the most bytes, i.e. length x
+    number of other messages containing them, until ``size`` bytes. Deflate
+    codes nearer matches more cheaply, so the most valuable come last.
+    """
+    size = size or codec_setting('DICTIONARY_SIZE')
+    counts = Counter()
+    for content in contents:
+        words = content.split(' ')
+        counts.update({
+            ' '.join(words[i:i + n])
+            for n in range(1, MAX_NGRAM + 1)
+            for i in range(len(words) - n + 1)
+        })
+    ranked = sorted(
+        ((count - 1) * len(gram.encode('utf-8')), gram)
+        for gram, count in counts.items()
+        if count > 1 and len(gram) > 2
+    )
+    chosen = []
+    used = 0
+    text = ''
+    for _, gram in reversed(ranked):
+        piece = len(gram.encode('utf-8')) + 1
+        if used + piece > size or gram in text:
+            continue
+        chosen.append(gram)
+        text += gram + ' '
+        used += piece
+        if size - used < 4:
+            break
+    return ' '.join(reversed(chosen)).encode('utf-8')[:size]
+
+
+def train_from_messages(limit=None, size=None):
+    """
+    Train a dictionary of ``size`` bytes on the newest ``limit`` stored
+    messages and save it as the active PayloadDictionary. Returns it, or
+    None without messages.
+    """
+    limit = limit or codec_setting('TRAINING_MESSAGES')
+    recent = heapq.merge(*(
+        Message.objects.using(using).order_by('-created_at').values_list('created_at', 'content')[:limit]
+        for using in message_databases()
+    ), reverse=True)
+    contents = [content for _, content in islice(recent, limit)]
+    if not contents:
+        return None
+    dictionary = PayloadDictionary.objects.create(data=train_dictionary(contents, size), sample_size=len(contents))
+    reset_dictionaries()
+    return dictionary
+
+
+class DictionaryCache:
+    """
+    Trained dictionaries by id, loaded on first use. The newest id is
+    re-read every ``ttl`` seconds, so a dictionary trained by another
+    process is picked up.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.dictionaries = {}
+        self.active_id = None
+        self.checked_at = None
+
+    def active(self):
+        """(id, bytes) of the newest dictionary, or (None, b'') if none was trained."""
+        if self.checked_at is None or time.monotonic() - self.checked_at > self.ttl:
+            self.active_id = PayloadDictionary.objects.order_by('-pk').values_list('pk', flat=True).first()
+            self.checked_at = time.monotonic()
+        if self.active_id is None:
+            return None, b''
+        return self.active_id, self.get(self.active_id)
+
+    def get(self, dictionary_id):
+        data = self.dictionaries.get(dictionary_id)
+        if data is None:
+            data = PayloadDictionary.objects.filter(pk=dictionary_id).values_list('data', flat=True).first()
+            if data is None:
+                raise CodecError(f'Unknown dictionary {dictionary_id}')
+            data = self.dictionaries[dictionary_id] = bytes(data)
+        return data
+
+
+_dictionaries = None
+
+
+def get_dictionaries():
+    """The process-wide DictionaryCache."""
+    global _dictionaries
+    if _dictionaries is None:
+        _dictionaries = DictionaryCache(codec_setting('DICTIONARY_TTL'))
+    return _dictionaries
+
+
+def reset_dictionaries():
+    """Forget the cached dictionaries (after training, in tests and benchmarks)."""
+    global _dictionaries
+    _dictionaries = None
+
+
+def encode_payload(content):
+    """encode() with the active trained dictionary, if any."""
+    dictionary_id, dictionary = get_dictionaries().active()
+    return encode(content, dictionary_id, dictionary)
+
+
+def split(payload, tag, size=None):
+    """Split an encoded payload into fragments of at most ``size`` bytes."""
+    size = size or codec_setting('FRAGMENT_SIZE')
+    chunk = size - FRAGMENT_HEADER.size
+    if chunk <= 0:
+        raise CodecError('Fragment size leaves no room for data')
+    count = max(1, -(-len(payload) // chunk))
+    if count > MAX_FRAGMENTS:
+        raise CodecError(f'Payload needs {count} fragments, more than {MAX_FRAGMENTS}')
+    tag &= 0xFFFF
+    return [
+        FRAGMENT_HEADER.pack(tag, index, count) + payload[index * chunk:(index + 1) * chunk]
+        for index in range(count)
+    ]
+
+
+def parse_fragment(data):
+    """Return the Fragment in ``data``."""
+    if len(data) < FRAGMENT_HEADER.size:
+        raise CodecError('Fragment shorter than header')
+    tag, index, count = FRAGMENT_HEADER.unpack_from(data)
+    if count == 0 or index >= count:
+        raise CodecError('Fragment index out of range')
+    return Fragment(tag, index, count, bytes(data[FRAGMENT_HEADER.size:]))
+
+
+def join(fragments):
+    """Reassemble the encoded payload from all fragments of one transfer, in any order."""
+    fragments = sorted(fragments, key=lambda fragment: fragment.index)
+    if not fragments or [f.index for f in fragments] != list(range(fragments[0].count)) or any(
+        f.count != fragments[0].count or f.tag != fragments[0].tag for f in fragments
+    ):
+        raise CodecError('Incomplete or mixed fragments')
+    return b''.join(fragment.data for fragment in fragments)
+
+
+def fits_lora(content, size=None):
+    """Whether ``content`` encodes to at most MAX_FRAGMENTS fragments of ``size`` bytes."""
+    size = size or codec_setting('FRAGMENT_SIZE')
+    capacity = MAX_FRAGMENTS * (size - FRAGMENT_HEADER.size)
+    # encode() never returns more than the raw UTF-8 plus its type byte
+    if len(content.encode('utf-8')) + 1 <= capacity:
+        return True
+    return len(encode_payload(content)) <= capacity
+
+
+def lora_fragments(message_id, content):
+    """The fragments that carry ``content`` of message ``message_id`` over LoRa."""
+    return split(encode_payload(content), tag=message_id)
+
+
+def receive_fragment(sender_id, data, now=None):
+    """
+    Store one fragment sent by node ``sender_id``. Returns (content, received,
+    count): the decoded content once every fragment of the transfer is in
+    (None before), and how many of its fragments have arrived.
+    """
+    fragment = parse_fragment(data)
+    if fragment.count == 1:
+        return decode(fragment.data), 1, 1
+    now = now or timezone.now()
+    transfer = MessageFragment.objects.filter(sender_id=sender_id, tag=fragment.tag)
+    with transaction.atomic():
+        MessageFragment.objects.filter(received_at__lt=now - timedelta(seconds=codec_setting('FRAGMENT_TTL'))).delete()
+        # A tag reused for a transfer of another length starts over
+        transfer.exclude(count=fragment.count).delete()
+        # Resent fragments are ignored
+        MessageFragment.objects.bulk_create([MessageFragment(
+            sender_id=sender_id, tag=fragment.tag, index=fragment.index, count=fragment.count,
+            data=fragment.data, received_at=now,
+        )], ignore_conflicts=True)
+        parts = [
+            Fragment(fragment.tag, index, fragment.count, bytes(part))
+            for index, part in transfer.order_by('index').values_list('index', 'data')
+        ]
+        if len(parts) < fragment.count:
+            return None, len(parts), fragment.count
+        transfer.delete()
+    return decode(join(parts)), len(parts), fragment.count
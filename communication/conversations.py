@@ -0,0 +1,203 @@
+"""
+Denormalized per-peer conversation summaries and unread counters.
+
+Every direct message touches two Conversation rows: the sender's (node =
+sender, peer = receiver) and the receiver's (node = receiver, peer =
+sender). Both get the message as their newest one and count it in
+``message_count``, and the receiver's row counts it as unread while its
+status is SENT. The per-node totals in activity.py are updated alongside.
+The counters are adjusted in the same transaction as the change that
+causes them:
+
+- record_messages(): after inserting messages (Message.save() through the
+  post_save signal, and bulk inserts such as the binary ingest server)
+- release_unread(): before messages leave SENT or are deleted (gateway
+  acknowledgements, dead-lettering, expiry purges)
+
+The conversation list and unread badges then read O(conversations) rows
+instead of grouping over Message. rebuild_conversations() recomputes the
+whole table from Message (``manage.py rebuild_conversations``) after bulk
+loads or if the counters ever drift, e.g. after editing messages in the
+Django admin.
+
+The newest message is picked by creation time, not id: with sharded
+messages (see sharding.py) ids from different shards are not in time order.
+"""
+from django.db import connection, connections, transaction
+from django.db.models import Count, Q, Sum
+
+from .activity import record_activity, touch
+from .models import Conversation, Message
+from .sharding import in_bulk, message_databases, sharding_enabled
+
+_TABLE = Conversation._meta.db_table
+
+# Conflicting rows keep the newer message and add up the unread and message counts
+_UPSERT = (
+    f'INSERT INTO {_TABLE} AS c (node_id, peer_id, last_message_id, last_message_at, unread_count, message_count) '
+    'VALUES {values} '
+    'ON CONFLICT (node_id, peer_id) DO UPDATE SET '
+    'last_message_id = CASE WHEN c.last_message_id IS NULL OR excluded.last_message_at >= c.last_message_at '
+    'THEN excluded.last_message_id ELSE c.last_message_id END, '
+    'last_message_at = CASE WHEN excluded.last_message_at > c.last_message_at '
+    'THEN excluded.last_message_at ELSE c.last_message_at END, '
+    'unread_count = c.unread_count + excluded.unread_count, '
+    'message_count = c.message_count + excluded.message_count '
+    'RETURNING node_id, peer_id, message_count'
+)
+
+_RELEASE = (
+    f'UPDATE {_TABLE} SET unread_count = CASE WHEN unread_count > %s THEN unread_count - %s ELSE 0 END '
+    'WHERE node_id = %s AND peer_id = %s'
+)
+
+_INSERT = (
+    f'INSERT INTO {_TABLE} (node_id, peer_id, last_message_id, last_message_at, unread_count, message_count) '
+    'VALUES (%s, %s, %s, %s, %s, %s)'
+)
+
+# Both directions of every direct message, grouped per (node, peer)
+DIRECTIONS_SQL = f"""
+SELECT node_id, peer_id, MAX(last_id), MAX(last_at), SUM(unread), SUM(messages) FROM (
+    SELECT sender_id AS node_id, receiver_id AS peer_id, MAX(id) AS last_id, MAX(created_at) AS last_at,
+           0 AS unread, COUNT(*) AS messages
+    FROM {Message._meta.db_table} WHERE receiver_id IS NOT NULL GROUP BY sender_id, receiver_id
+    UNION ALL
+    SELECT receiver_id, sender_id, MAX(id), MAX(created_at), SUM(CASE WHEN status = 'SENT' THEN 1 ELSE 0 END),
+           COUNT(*)
+    FROM {Message._meta.db_table} WHERE receiver_id IS NOT NULL GROUP BY receiver_id, sender_id
+) AS directions
+GROUP BY node_id, peer_id
+"""
+REBUILD_SQL = (
+    f'INSERT INTO {_TABLE} (node_id, peer_id, last_message_id, last_message_at, unread_count, message_count)'
+    + DIRECTIONS_SQL
+)
+
+
+def record_messages(messages):
+    """
+    Add newly inserted direct messages to both nodes' conversations with
+    batched upserts, and all of them (group and broadcast messages too) to
+    their nodes' activity summaries.
+    """
+    rows = {}
+    for message in messages:
+        if not message.receiver_id:
+            continue
+        unread = 1 if message.status == 'SENT' else 0
+        for key, unread_count in (
+            ((message.sender_id, message.receiver_id), 0),
+            ((message.receiver_id, message.sender_id), unread),
+        ):
+            row = rows.get(key)
+            if row is None or (message.created_at, message.pk) > (row[1], row[0]):
+                rows[key] = (message.pk, message.created_at, (row[2] if row else 0) + unread_count,
+                             (row[3] if row else 0) + 1)
+            else:
+                rows[key] = (row[0], row[1], row[2] + unread_count, row[3] + 1)
+    message_counts = {}
+    if rows:
+        adapt = connection.ops.adapt_datetimefield_value
+        rows = [
+            [node_id, peer_id, last_id, adapt(last_at), unread_count, message_count]
+            for (node_id, peer_id), (last_id, last_at, unread_count, message_count) in rows.items()
+        ]
+        per_statement = min(500, (connection.features.max_query_params or 2500) // 6)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), per_statement):
+                chunk = rows[start:start + per_statement]
+                cursor.execute(
+                    _UPSERT.format(values=', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(chunk))),
+                    [value for row in chunk for value in row],
+                )
+                message_counts.update(((node_id, peer_id), count) for node_id, peer_id, count in cursor.fetchall())
+    record_activity(messages, message_counts)
+
+
+def release_unread(messages):
+    """
+    Take the SENT direct messages in the Message queryset ``messages`` off
+    their receivers' unread counts. Call it inside the transaction that is
+    about to acknowledge, fail or delete them.
+    """
+    counts = (
+        messages.filter(status='SENT', receiver__isnull=False)
+        .order_by()
+        .values_list('receiver_id', 'sender_id')
+        .annotate(count=Count('pk'))
+    )
+    rows = [(count, count, receiver_id, sender_id) for receiver_id, sender_id, count in counts]
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(_RELEASE, rows)
+        touch(receiver_id for _, _, receiver_id, _ in rows)
+
+
+def conversations_for(node, limit=20):
+    """
+    ``node``'s most recent conversations with the peer and the newest
+    message (``conversation.last_message``, None once purged) attached.
+    """
+    conversations = list(
+        node.conversations.select_related('peer').order_by('-last_message_at')[:limit]
+    )
+    last_messages = in_bulk(
+        Message.objects.only('sender_id', 'content', 'created_at'),
+        [conversation.last_message_id for conversation in conversations],
+    )
+    for conversation in conversations:
+        conversation.last_message = last_messages.get(conversation.last_message_id)
+    return conversations
+
+
+def unread_total(node):
+    """Unread direct messages of ``node`` across all its conversations."""
+    return node.conversations.aggregate(total=Sum('unread_count'))['total'] or 0
+
+
+def replace_last_messages(node_id, new_ids):
+    """
+    Point the conversations of ``node_id`` (both sides) whose newest message
+    was copied to another database at the copy. ``new_ids`` maps old to new
+    message ids.
+    """
+    rows = (
+        Conversation.objects.filter(Q(node_id=node_id) | Q(peer_id=node_id), last_message_id__in=list(new_ids))
+        .values_list('pk', 'last_message_id')
+    )
+    updates = [(new_ids[last_message_id], pk) for pk, last_message_id in rows]
+    if updates:
+        with connection.cursor() as cursor:
+            cursor.executemany(f'UPDATE {_TABLE} SET last_message_id = %s WHERE id = %s', updates)
+
+
+def _sharded_directions():
+    """DIRECTIONS_SQL over every message database, merged: a pair may have messages in two shards."""
+    merged = {}
+    for using in message_databases():
+        with connections[using].cursor() as cursor:
+            cursor.execute(DIRECTIONS_SQL)
+            for node_id, peer_id, last_id, last_at, unread, messages in cursor.fetchall():
+                row = merged.get((node_id, peer_id))
+                if row is None:
+                    merged[(node_id, peer_id)] = [last_id, last_at, unread, messages]
+                    continue
+                if last_at > row[1]:
+                    row[0], row[1] = last_id, last_at
+                row[2] += unread
+                row[3] += messages
+    return [(node_id, peer_id, *row) for (node_id, peer_id), row in merged.items()]
+
+
+def rebuild_conversations():
+    """Recompute every conversation from the Message table(s). Returns the number of rows."""
+    rows = _sharded_directions() if sharding_enabled() else None
+    with transaction.atomic():
+        Conversation.objects.all().delete()
+        with connection.cursor() as cursor:
+            if rows is None:
+                cursor.execute(REBUILD_SQL)
+            else:
+                cursor.executemany(_INSERT, rows)
+    return Conversation.objects.count()
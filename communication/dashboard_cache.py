@@ -0,0 +1,52 @@
+"""
+Cache versions for dashboard template fragments.
+
+Node rows are cached per node, keyed by node id and ``updated_at``, so a row
+is re-rendered only when that node changes. The recent-messages panel is
+keyed by a version number that is bumped whenever a Message is saved, a
+node is edited or deleted (see communication/signals.py), or messages are
+updated or purged in bulk.
+
+Node detail pages are revalidated with an ETag (see views.node_detail) that
+includes when any node was last edited or deleted, since they show other
+nodes' names.
+"""
+import time
+
+from django.core.cache import cache
+from django.utils import timezone
+
+RECENT_MESSAGES_VERSION_KEY = 'dashboard:recent_messages:version'
+NODES_CHANGED_KEY = 'dashboard:nodes:changed_at'
+
+
+def recent_messages_version():
+    """Current version of the recent-messages panel."""
+    version = cache.get(RECENT_MESSAGES_VERSION_KEY)
+    if version is None:
+        cache.add(RECENT_MESSAGES_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(RECENT_MESSAGES_VERSION_KEY)
+    return version
+
+
+def bump_recent_messages():
+    """
+    Invalidate the cached recent-messages panel. Versions are clock readings,
+    so a version key culled from the cache never comes back as one that
+    earlier panels were cached under.
+    """
+    cache.set(RECENT_MESSAGES_VERSION_KEY, time.time_ns(), None)
+
+
+def nodes_changed_at():
+    """When a node was last edited or deleted (as far as this cache knows)."""
+    changed_at = cache.get(NODES_CHANGED_KEY)
+    if changed_at is None:
+        cache.add(NODES_CHANGED_KEY, timezone.now(), None)
+        changed_at = cache.get(NODES_CHANGED_KEY)
+    return changed_at
+
+
+def bump_nodes():
+    """Record that a node was edited or deleted."""
+    cache.set(NODES_CHANGED_KEY, timezone.now(), None)
@@ -0,0 +1,341 @@
+"""
+Synthetic fleet and message data for load testing and benchmarks.
+
+Nodes get a configurable ONLINE share and gateway count. Messages are direct
+messages whose senders follow a Zipf distribution (a few chatty nodes, a long
+tail of quiet ones) and whose timestamps follow a daily cycle peaking at
+PEAK_HOUR. They are generated day by day in time order, so ids increase with
+``created_at`` as they do in production. Statuses and message types are
+drawn from configurable mixes.
+
+Everything is written in chunked transactions: users and nodes with
+bulk_create() (all users share one password hash, computed once), messages
+either with bulk_create() or, with ``raw=True``, as plain tuples through the
+DB-API cursor's executemany(), which skips model instances entirely. On
+SQLite the load runs without fsync and, optionally, without the Message
+indexes, which are rebuilt in one pass at the end. With sharded messages
+(see sharding.py) each chunk is split by receiver and every shard is
+loaded the same way.
+"""
+import itertools
+import math
+import random
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
+from operator import attrgetter, itemgetter
+from queue import Queue
+from threading import Thread
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+
+from accounts.models import Node
+from accounts.presence import sync_from_db
+
+from .activity import rebuild_activity
+from .conversations import rebuild_conversations
+from .dashboard_cache import bump_recent_messages
+from .models import Message, default_ttl, preserve_timestamps
+from .sharding import message_databases, split
+
+DEFAULT_STATUS_MIX = {'DELIVERED': 0.85, 'SENT': 0.1, 'FAILED': 0.05}
+DEFAULT_TYPE_MIX = {'TEXT': 0.9, 'ALERT': 0.08, 'COMMAND': 0.02}
+
+_CONTENT = (
+    'Reading {i}: temp 21.{d}C humidity 4{d}%',
+    'Gate {d} opened',
+    'Battery at {d}0%',
+    'Ping {i}',
+    'Water level {d}{d} cm at sensor {i}',
+    'Motion detected in zone {d}',
+)
+
+
+def zipf_cum_weights(count, exponent):
+    """Cumulative Zipf weights for ranks 1..count, for random.choices(cum_weights=...)."""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def diurnal_cum_weights(peak_hour, amplitude=0.8):
+    """Cumulative weights of the 24 hours: a cosine day cycle peaking at ``peak_hour``."""
+    return list(itertools.accumulate(
+        1 + amplitude * math.cos(2 * math.pi * (hour - peak_hour) / 24) for hour in range(24)
+    ))
+
+
+def create_fleet(count, prefix='GEN', password='testpass123', online=0.3, gateways=0,
+                 chunk_size=5000, seed=None, log=None):
+    """
+    Create ``count`` users and nodes named ``<prefix> Node 000001`` with ESP32
+    IDs ``<prefix>-000001``; with ``gateways``, every other node is relayed by
+    one of them. Returns the new node ids.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    password_hash = make_password(password)
+    gateway_numbers = set(rng.sample(range(count), min(gateways, count)))
+    node_ids = []
+    with bulk_load():
+        for start in range(0, count, chunk_size):
+            numbers = range(start, min(start + chunk_size, count))
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(username=f'{prefix.lower()}{i + 1:06d}', password=password_hash, date_joined=now)
+                    for i in numbers
+                ])
+                nodes = []
+                for i, user in zip(numbers, users):
+                    is_online = rng.random() < online
+                    nodes.append(Node(
+                        user=user,
+                        node_name=f'{prefix} Node {i + 1:06d}',
+                        esp32_device_id=f'{prefix}-{i + 1:06d}',
+                        lora_node_id=f'{prefix}-L{i + 1:06d}',
+                        status='ONLINE' if is_online else 'OFFLINE',
+                        last_seen=now - timedelta(
+                            seconds=rng.uniform(0, 120) if is_online else rng.uniform(3600, 30 * 86400)
+                        ),
+                        is_gateway=i in gateway_numbers,
+                    ))
+                node_ids.extend(node.pk for node in Node.objects.bulk_create(nodes))
+            if log:
+                log(f'{len(node_ids)}/{count} nodes')
+    gateway_ids = [node_ids[i] for i in sorted(gateway_numbers)]
+    if gateway_ids:
+        relayed = defaultdict(list)
+        for i, node_id in enumerate(node_ids):
+            if i not in gateway_numbers:
+                relayed[rng.choice(gateway_ids)].append(node_id)
+        with transaction.atomic():
+            for gateway_id, ids in relayed.items():
+                for start in range(0, len(ids), chunk_size):
+                    Node.objects.filter(pk__in=ids[start:start + chunk_size]).update(relay_gateway_id=gateway_id)
+    # bulk_create() skips the signals that keep the presence store in step
+    sync_from_db(node_ids)
+    return node_ids
+
+
+class _MessageRows:
+    """Generates message rows day by day: (sender, receiver, content, type, status, naive UTC created_at)."""
+
+    def __init__(self, node_ids, zipf=1.1, peak_hour=14, status_mix=None, type_mix=None, seed=None):
+        self.rng = random.Random(seed)
+        self.senders = list(node_ids)
+        # Shuffle so the busiest senders are not simply the lowest ids
+        self.rng.shuffle(self.senders)
+        self.receivers = node_ids
+        # Receiver to use instead when the draw picked the sender itself
+        self.following = dict(zip(node_ids, node_ids[1:] + node_ids[:1]))
+        # Rendered once; formatting a fresh string per message costs more than writing it
+        self.contents = [
+            _CONTENT[k % len(_CONTENT)].format(i=k * 7919 % 100000, d=k % 10) for k in range(1009)
+        ]
+        self.sender_weights = zipf_cum_weights(len(node_ids), zipf)
+        self.hour_weights = diurnal_cum_weights(peak_hour)
+        status_mix = status_mix or DEFAULT_STATUS_MIX
+        type_mix = type_mix or DEFAULT_TYPE_MIX
+        self.statuses, self.status_weights = list(status_mix), list(itertools.accumulate(status_mix.values()))
+        self.types, self.type_weights = list(type_mix), list(itertools.accumulate(type_mix.values()))
+
+    def day(self, day_start, count, span=86400):
+        """Rows of one day; ``span`` < 86400 squeezes the day into its first ``span`` seconds (today so far)."""
+        rng = self.rng
+        hours = rng.choices(range(24), cum_weights=self.hour_weights, k=count)
+        scale = span / 86400
+        offsets = sorted((hour * 3600 + rng.random() * 3600) * scale for hour in hours)
+        senders = rng.choices(self.senders, cum_weights=self.sender_weights, k=count)
+        receivers = rng.choices(self.receivers, k=count)
+        statuses = rng.choices(self.statuses, cum_weights=self.status_weights, k=count)
+        types = rng.choices(self.types, cum_weights=self.type_weights, k=count)
+        contents, following = self.contents, self.following
+        for i, (offset, sender, receiver, status, message_type) in enumerate(
+            zip(offsets, senders, receivers, statuses, types)
+        ):
+            if receiver == sender:
+                receiver = following[sender]
+            yield (
+                sender, receiver, contents[i % len(contents)], message_type, status,
+                day_start + timedelta(seconds=offset),
+            )
+
+
+def _daily_counts(total, days):
+    base, extra = divmod(total, days)
+    return [base + (1 if i < extra else 0) for i in range(days)]
+
+
+def create_messages(node_ids, count, days=30, zipf=1.1, peak_hour=14, status_mix=None, type_mix=None,
+                    chunk_size=100000, raw=False, drop_indexes=False, seed=None, log=None):
+    """
+    Create ``count`` direct messages between ``node_ids`` over the last
+    ``days`` days, inside bulk_load(). The next chunk is generated on a
+    background thread while the current one is written (SQLite releases the
+    GIL while it works). Returns the number of messages written.
+    """
+    node_ids = sorted(node_ids)
+    if len(node_ids) < 2 or count <= 0:
+        return 0
+    rows = _MessageRows(node_ids, zipf, peak_hour, status_mix, type_mix, seed)
+    now = timezone.now()
+    today = now.date()
+    ttl = {message_type: default_ttl(message_type) for message_type in rows.types}
+    prepare, write = (_raw_rows, _insert_rows) if raw else (_message_objects, _bulk_create)
+    receiver_id = itemgetter(1) if raw else attrgetter('receiver_id')
+
+    def chunks():
+        for day_number, day_count in enumerate(_daily_counts(count, days)):
+            day = today - timedelta(days=days - 1 - day_number)
+            day_start = datetime.combine(day, dt_time.min)
+            # Today's messages all lie in the past
+            span = (now.replace(tzinfo=None) - day_start).total_seconds() if day == today else 86400
+            generated = rows.day(day_start, day_count, span)
+            while chunk := list(itertools.islice(generated, chunk_size)):
+                yield day, prepare(chunk, ttl)
+
+    written = 0
+    with ExitStack() as stack:
+        for using in message_databases():
+            stack.enter_context(bulk_load(drop_indexes, using=using))
+        stack.enter_context(preserve_timestamps())
+        for day, prepared in _prefetch(chunks()):
+            for using, part in split(prepared, receiver_id).items():
+                with transaction.atomic(using=using):
+                    write(part, using)
+            written += len(prepared)
+            if log:
+                log(f'{day}: {written}/{count} messages')
+        if log and drop_indexes:
+            log('Rebuilding indexes...')
+    if log:
+        log('Rebuilding conversation and activity summaries...')
+    # Rows written in bulk bypass record_messages()
+    rebuild_conversations()
+    rebuild_activity()
+    bump_recent_messages()
+    return written
+
+
+def _prefetch(iterable, depth=2):
+    """Iterate ``iterable`` on a background thread, up to ``depth`` items ahead."""
+    items = Queue(depth)
+    done = object()
+    failure = []
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as exc:
+            failure.append(exc)
+        finally:
+            items.put(done)
+
+    Thread(target=produce, daemon=True).start()
+    while (item := items.get()) is not done:
+        yield item
+    if failure:
+        raise failure[0]
+
+
+def _message_values(chunk, ttl):
+    """Field values shared by both writers; SENT messages are queued for relaying as of creation."""
+    for sender, receiver, content, message_type, status, created_at in chunk:
+        expires = ttl[message_type]
+        yield (
+            sender, receiver, content, message_type, status,
+            created_at if status == 'SENT' else None,
+            created_at + expires if expires else None,
+            created_at,
+        )
+
+
+def _message_objects(chunk, ttl):
+    def aware(value):
+        return value.replace(tzinfo=dt_timezone.utc) if value is not None else None
+    return [
+        Message(
+            sender_id=sender, receiver_id=receiver, content=content, message_type=message_type,
+            status=status, next_attempt_at=aware(next_attempt_at), expires_at=aware(expires_at),
+            created_at=aware(created_at), updated_at=aware(created_at),
+        )
+        for sender, receiver, content, message_type, status, next_attempt_at, expires_at, created_at
+        in _message_values(chunk, ttl)
+    ]
+
+
+def _bulk_create(messages, using):
+    Message.objects.using(using).bulk_create(messages, batch_size=2000)
+
+
+def _raw_rows(chunk, ttl):
+    # Naive UTC datetimes formatted with str(), exactly as the SQLite backend stores them
+    return [
+        (sender, receiver, content, message_type, status,
+         created if next_attempt_at else None, str(expires_at) if expires_at else None,
+         created, created, False, 0)
+        for sender, receiver, content, message_type, status, next_attempt_at, expires_at, created_at
+        in _message_values(chunk, ttl)
+        for created in (str(created_at),)
+    ]
+
+
+def _insert_rows(rows, using):
+    connection = connections[using]
+    table = connection.ops.quote_name(Message._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {table} (sender_id, receiver_id, content, message_type, status, next_attempt_at, '
+            'expires_at, created_at, updated_at, is_broadcast, attempts) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+            rows,
+        )
+
+
+@contextmanager
+def bulk_load(drop_indexes=False, cache_mb=256, using=DEFAULT_DB_ALIAS):
+    """
+    Speed up a large SQLite load into database ``using``: a bigger page
+    cache, no fsync, no foreign key checks (the generated ids are known to
+    exist), and with ``drop_indexes`` the Message table's secondary indexes
+    are dropped for the load and rebuilt afterwards, which is much faster
+    than updating them row by row. Does nothing on other databases.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        yield
+        return
+    table = Message._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA synchronous')
+        synchronous = cursor.fetchone()[0]
+        # Shards run with foreign keys off for good; re-enabling them afterwards would break their inserts
+        cursor.execute('PRAGMA foreign_keys')
+        foreign_keys = cursor.fetchone()[0]
+        cursor.execute(f'PRAGMA cache_size = {-cache_mb * 1024}')
+        cursor.execute('PRAGMA synchronous = OFF')
+        indexes = []
+        if drop_indexes:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                [table],
+            )
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+    try:
+        if foreign_keys:
+            with connection.constraint_checks_disabled():
+                yield
+        else:
+            yield
+    finally:
+        with connection.cursor() as cursor:
+            for _, sql in indexes:
+                cursor.execute(sql)
+            cursor.execute(f'PRAGMA synchronous = {synchronous}')
+            # Sampled statistics: a full ANALYZE would read every row again
+            cursor.execute('PRAGMA analysis_limit = 1000')
+            cursor.execute('ANALYZE')
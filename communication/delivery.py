@@ -0,0 +1,141 @@
+"""
+Store-and-forward delivery scheduler for relaying messages through gateways.
+
+Direct messages are queued with ``next_attempt_at`` when created. A gateway
+claims a batch of due messages; each claim counts as an attempt and pushes
+``next_attempt_at`` out by an exponential backoff, so a message that is never
+acknowledged becomes due again automatically. After MAX_ATTEMPTS claims
+without an acknowledgement the message is dead-lettered as FAILED.
+
+Due messages are read from a partial index on ``next_attempt_at`` that only
+contains messages still waiting (status SENT), never from a table scan. With
+sharded messages (see sharding.py) every shard's queue is read and the
+oldest-due messages of all of them are handed out.
+"""
+import heapq
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .conversations import release_unread
+from .dashboard_cache import bump_recent_messages
+from .models import Message
+from .sharding import atomic, ids_by_database, message_databases, with_related
+
+DEFAULT_RETRY = {
+    'BASE_SECONDS': 30,
+    'MAX_SECONDS': 60 * 60,
+    'MAX_ATTEMPTS': 8,
+    'BATCH_SIZE': 20,
+}
+
+
+def retry_setting(key):
+    return getattr(settings, 'DELIVERY_RETRY', {}).get(key, DEFAULT_RETRY[key])
+
+
+def backoff(attempt):
+    """Delay before a message handed out for the ``attempt``-th time becomes due again."""
+    seconds = retry_setting('BASE_SECONDS') * 2 ** max(attempt - 1, 0)
+    return timedelta(seconds=min(seconds, retry_setting('MAX_SECONDS')))
+
+
+def _due(now, using=DEFAULT_DB_ALIAS):
+    return Message.objects.using(using).filter(status='SENT', next_attempt_at__lte=now)
+
+
+def dead_letter(now=None):
+    """
+    Mark due messages that used up their attempts as FAILED and drop expired
+    ones from the queue. Returns the number of messages dead-lettered.
+    """
+    now = now or timezone.now()
+    failed = 0
+    for using in message_databases():
+        with atomic(using):
+            _due(now, using).filter(expires_at__lte=now).update(next_attempt_at=None)
+            exhausted = _due(now, using).filter(attempts__gte=retry_setting('MAX_ATTEMPTS'))
+            release_unread(exhausted)
+            failed += exhausted.update(status='FAILED', next_attempt_at=None)
+    if failed:
+        bump_recent_messages()
+    return failed
+
+
+def claim_batch(gateway, limit=None, now=None):
+    """
+    Hand up to ``limit`` due messages to ``gateway`` for relaying.
+    Returns the claimed messages, oldest-due first.
+    """
+    now = now or timezone.now()
+    limit = limit or retry_setting('BATCH_SIZE')
+
+    with transaction.atomic():
+        dead_letter(now)
+        # (database, pk, attempts) of the oldest-due messages of every database
+        due = [
+            row[1:] for row in heapq.nsmallest(limit, (
+                (next_attempt_at, using, pk, attempts)
+                for using in message_databases()
+                for pk, attempts, next_attempt_at in (
+                    _due(now, using)
+                    .order_by('next_attempt_at')
+                    .values_list('pk', 'attempts', 'next_attempt_at')[:limit]
+                )
+            ))
+        ]
+        # One conditional UPDATE per database and attempt count. The
+        # next_attempt_at guard means a message already taken by a concurrent
+        # claim is skipped.
+        due.sort(key=lambda row: (row[0], row[2]))
+        for (using, attempts), rows in groupby(due, key=lambda row: (row[0], row[2])):
+            with transaction.atomic(using=using, savepoint=False):
+                _due(now, using).filter(pk__in=[pk for _, pk, _ in rows]).update(
+                    attempts=F('attempts') + 1,
+                    last_attempt_at=now,
+                    next_attempt_at=now + backoff(attempts + 1),
+                    gateway=gateway,
+                )
+
+    claimed = []
+    for using, rows in groupby(due, key=lambda row: row[0]):
+        claimed += with_related(
+            Message.objects.using(using).filter(
+                pk__in=[pk for _, pk, _ in rows], gateway=gateway, last_attempt_at=now
+            ),
+            'sender', 'receiver',
+        ).order_by('pk')
+    return claimed
+
+
+def acknowledge(gateway, message_ids):
+    """
+    Mark messages relayed by ``gateway`` as DELIVERED.
+    Returns the number of messages updated.
+    """
+    updated = 0
+    for using, ids in ids_by_database(message_ids).items():
+        with atomic(using):
+            relayed = Message.objects.using(using).filter(pk__in=ids, gateway=gateway, status='SENT')
+            release_unread(relayed)
+            updated += relayed.update(status='DELIVERED', next_attempt_at=None, updated_at=timezone.now())
+    if updated:
+        bump_recent_messages()
+    return updated
+
+
+def queue_stats(now=None):
+    """Counts of queued, due, delivered and failed direct messages."""
+    now = now or timezone.now()
+    stats = {'queued': 0, 'due': 0, 'delivered': 0, 'failed': 0}
+    for using in message_databases():
+        direct = Message.objects.using(using).filter(receiver__isnull=False)
+        stats['queued'] += direct.filter(status='SENT', next_attempt_at__isnull=False).count()
+        stats['due'] += _due(now, using).count()
+        stats['delivered'] += direct.filter(status='DELIVERED').count()
+        stats['failed'] += direct.filter(status='FAILED').count()
+    return stats
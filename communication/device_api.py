@@ -0,0 +1,697 @@
+"""
+Device API views for ESP32 nodes and gateways.
+
+All device endpoints require "Authorization: Token <device token>" (see
+accounts/tokens.py and the issue_device_tokens command). They are kept apart
+from the web views so the lean device-API profile (lora_comm/settings_device.py)
+can serve them without importing forms, templates or the admin.
+"""
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+
+from accounts.models import Node
+from accounts.tokens import device_allowed, device_token_required
+from accounts.uptime import arecord_status, record_status
+from .codec import MAX_FRAGMENTS, CodecError, fits_lora, get_dictionaries, lora_fragments, receive_fragment
+from .delivery import acknowledge, claim_batch
+from .fanout import ainbox_for, inbox_for, send_broadcast, send_to_group
+from .models import Message, NodeGroup
+from .ratelimit import device_rate_limit
+
+# The mesh topology module (graph, route search) is imported by the views that
+# use it, so workers that only take heartbeats and messages never load it.
+
+
+def _status_params(data):
+    """Validate an update-status body. Returns ((esp32_device_id, status), None) or (None, error response)."""
+    esp32_device_id = data.get('esp32_device_id')
+    status = data.get('status', 'ONLINE').upper()
+
+    if not esp32_device_id:
+        return None, JsonResponse({'error': 'esp32_device_id is required'}, status=400)
+
+    if status not in ['ONLINE', 'OFFLINE']:
+        return None, JsonResponse({'error': 'status must be ONLINE or OFFLINE'}, status=400)
+
+    return (esp32_device_id, status), None
+
+
+def _status_response(node, status):
+    return JsonResponse({
+        'success': True,
+        'message': f'Status updated to {status}',
+        'node_name': node.node_name
+    })
+
+
+def _too_long():
+    return JsonResponse({'error': f'payload is too long for LoRa (more than {MAX_FRAGMENTS} fragments)'}, status=400)
+
+
+def _send_params(data):
+    """
+    Validate a send-message body. Returns (params, None) or (None, error response);
+    params holds the device IDs, group, broadcast flag, payload and the extra
+    Message fields (message_type, expires_at).
+    """
+    params = {
+        'from_esp32_id': data.get('from_esp32_device_id'),
+        'to_esp32_id': data.get('to_esp32_device_id'),
+        'to_group': data.get('to_group'),
+        'broadcast': bool(data.get('broadcast')),
+        'payload': data.get('payload', ''),
+    }
+    message_type = str(data.get('message_type', 'TEXT')).upper()
+    ttl_seconds = data.get('ttl_seconds')
+
+    if not all([params['from_esp32_id'], params['payload']]) or not (
+        params['to_esp32_id'] or params['to_group'] or params['broadcast']
+    ):
+        return None, JsonResponse({
+            'error': 'from_esp32_device_id, payload and one of to_esp32_device_id, to_group or broadcast are required'
+        }, status=400)
+
+    if message_type not in dict(Message.MESSAGE_TYPE_CHOICES):
+        return None, JsonResponse({'error': 'Invalid message_type'}, status=400)
+
+    if not fits_lora(str(params['payload'])):
+        return None, _too_long()
+
+    message_fields = {'message_type': message_type}
+    if ttl_seconds is not None:
+        # JSON true/false are ints to Python; true would mean one second
+        if not isinstance(ttl_seconds, int) or isinstance(ttl_seconds, bool) or ttl_seconds <= 0:
+            return None, JsonResponse({'error': 'ttl_seconds must be a positive integer'}, status=400)
+        message_fields['expires_at'] = timezone.now() + timedelta(seconds=ttl_seconds)
+    params['message_fields'] = message_fields
+    return params, None
+
+
+def _sent_response(message, recipient_count=None):
+    data = {
+        'success': True,
+        'message_id': message.id,
+        'message': 'Message sent successfully'
+    }
+    if recipient_count is not None:
+        data['recipient_count'] = recipient_count
+    return JsonResponse(data)
+
+
+def _lora_encoded(request):
+    return request.GET.get('encoding') == 'lora'
+
+
+def _payload(msg, lora):
+    """
+    The content of ``msg``, or with ``lora`` its fragments (see codec.py) in
+    base64; "error": "too_long" when it no longer fits in MAX_FRAGMENTS (e.g.
+    stored before the limit was enforced, or after FRAGMENT_SIZE shrank).
+    """
+    if lora:
+        try:
+            fragments = lora_fragments(msg.id, msg.content)
+        except CodecError:
+            return {'error': 'too_long'}
+        return {'fragments': [base64.b64encode(fragment).decode('ascii') for fragment in fragments]}
+    return {'content': msg.content}
+
+
+def _inbox_response(node, messages, lora=False):
+    messages_data = [{
+        'id': msg.id,
+        'from': {
+            'node_name': msg.sender.node_name,
+            'esp32_device_id': msg.sender.esp32_device_id,
+        },
+        **_payload(msg, lora),
+        'status': msg.delivery_status,
+        'message_type': msg.message_type,
+        'expires_at': msg.expires_at.isoformat() if msg.expires_at else None,
+        'target': 'broadcast' if msg.is_broadcast else ('group' if msg.group_id else 'direct'),
+        'created_at': msg.created_at.isoformat(),
+    } for msg in messages]
+
+    return JsonResponse({
+        'success': True,
+        'node_name': node.node_name,
+        'messages': messages_data,
+        'count': len(messages_data)
+    })
+
+
+def _send(sender_node, params):
+    """Store the message described by ``params`` (see _send_params) from ``sender_node``."""
+    message_fields = params['message_fields']
+    if params['broadcast']:
+        return _sent_response(*send_broadcast(sender_node, params['payload'], **message_fields))
+    if params['to_group']:
+        try:
+            group = NodeGroup.objects.get(name=params['to_group'])
+        except NodeGroup.DoesNotExist:
+            return JsonResponse({'error': f"Group not found: {params['to_group']}"}, status=404)
+        return _sent_response(*send_to_group(sender_node, group, params['payload'], **message_fields))
+
+    receiver_node = Node.objects.get(esp32_device_id=params['to_esp32_id'])
+
+    message = Message.objects.create(
+        sender=sender_node,
+        receiver=receiver_node,
+        content=params['payload'],
+        status='SENT',
+        **message_fields
+    )
+    return _sent_response(message)
+
+
+def _forbidden():
+    return JsonResponse({'error': 'Token does not belong to this device'}, status=403)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@device_token_required
+@device_rate_limit('update_status')
+def api_update_status(request):
+    """
+    API endpoint for ESP32 to update node status.
+    POST /api/nodes/update-status/
+    Request: {"esp32_device_id": "ESP32-001", "status": "ONLINE"}
+    """
+    try:
+        params, error = _status_params(json.loads(request.body))
+        if error:
+            return error
+        esp32_device_id, status = params
+
+        try:
+            node = Node.objects.get(esp32_device_id=esp32_device_id)
+            if not device_allowed(request, node, relay=True):
+                return _forbidden()
+            record_status(node, status)
+            return _status_response(node, status)
+        except Node.DoesNotExist:
+            return JsonResponse({'error': 'Node not found'}, status=404)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@device_token_required
+@device_rate_limit('send_message')
+def api_send_message(request):
+    """
+    API endpoint for ESP32 to send messages.
+    POST /api/messages/send/
+    Request: {
+        "from_esp32_device_id": "ESP32-001",
+        "to_esp32_device_id": "ESP32-002",
+        "payload": "Hello from Node 1"
+    }
+    Instead of "to_esp32_device_id", send "to_group": "<group name>" or
+    "broadcast": true to reach many nodes with one stored message.
+    Optional: "message_type" (TEXT, ALERT, COMMAND) and "ttl_seconds";
+    without ttl_seconds the per-type default from settings.MESSAGE_TYPE_TTL applies.
+    """
+    try:
+        params, error = _send_params(json.loads(request.body))
+        if error:
+            return error
+
+        try:
+            sender_node = Node.objects.get(esp32_device_id=params['from_esp32_id'])
+            if not device_allowed(request, sender_node, relay=True):
+                return _forbidden()
+            return _send(sender_node, params)
+        except Node.DoesNotExist as e:
+            return JsonResponse({'error': f'Node not found: {str(e)}'}, status=404)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@device_token_required
+@device_rate_limit('inbox')
+def api_get_inbox(request, esp32_device_id):
+    """
+    API endpoint for ESP32 to fetch messages.
+    GET /api/messages/inbox/<esp32_device_id>/
+    Returns JSON list of messages for that node, including group and broadcast messages.
+    With ?encoding=lora each message carries "fragments" (base64, see codec.py)
+    instead of "content", ready to be sent over LoRa as they are.
+    """
+    try:
+        node = Node.objects.get(esp32_device_id=esp32_device_id)
+        if not device_allowed(request, node):
+            return _forbidden()
+        # Last 50 direct + group messages
+        return _inbox_response(node, inbox_for(node, limit=50), _lora_encoded(request))
+
+    except Node.DoesNotExist:
+        return JsonResponse({'error': 'Node not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+# Native async versions of the hot device endpoints, routed instead of the
+# sync ones when settings.DEVICE_API_ASYNC is on. Same requests and responses
+# as the views above.
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@device_token_required
+@device_rate_limit('update_status')
+async def aapi_update_status(request):
+    """Async version of api_update_status."""
+    try:
+        params, error = _status_params(json.loads(request.body))
+        if error:
+            return error
+        esp32_device_id, status = params
+
+        try:
+            node = await Node.objects.aget(esp32_device_id=esp32_device_id)
+            if not device_allowed(request, node, relay=True):
+                return _forbidden()
+            await arecord_status(node, status)
+            return _status_response(node, status)
+        except Node.DoesNotExist:
+            return JsonResponse({'error': 'Node not found'}, status=404)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@device_token_required
+@device_rate_limit('send_message')
+async def aapi_send_message(request):
+    """
+    Async version of api_send_message. Group and broadcast fan-out runs in
+    one transaction, so it is handed to a worker thread.
+    """
+    try:
+        params, error = _send_params(json.loads(request.body))
+        if error:
+            return error
+        message_fields = params['message_fields']
+
+        try:
+            sender_node = await Node.objects.aget(esp32_device_id=params['from_esp32_id'])
+            if not device_allowed(request, sender_node, relay=True):
+                return _forbidden()
+
+            if params['broadcast']:
+                return _sent_response(*await sync_to_async(send_broadcast)(
+                    sender_node, params['payload'], **message_fields
+                ))
+            if params['to_group']:
+                try:
+                    group = await NodeGroup.objects.aget(name=params['to_group'])
+                except NodeGroup.DoesNotExist:
+                    return JsonResponse({'error': f"Group not found: {params['to_group']}"}, status=404)
+                return _sent_response(*await sync_to_async(send_to_group)(
+                    sender_node, group, params['payload'], **message_fields
+                ))
+
+            receiver_node = await Node.objects.aget(esp32_device_id=params['to_esp32_id'])
+
+            message = await Message.objects.acreate(
+                sender=sender_node,
+                receiver=receiver_node,
+                content=params['payload'],
+                status='SENT',
+                **message_fields
+            )
+            return _sent_response(message)
+        except Node.DoesNotExist as e:
+            return JsonResponse({'error': f'Node not found: {str(e)}'}, status=404)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@device_token_required
+@device_rate_limit('inbox')
+async def aapi_get_inbox(request, esp32_device_id):
+    """Async version of api_get_inbox."""
+    try:
+        node = await Node.objects.aget(esp32_device_id=esp32_device_id)
+        if not device_allowed(request, node):
+            return _forbidden()
+        messages = await ainbox_for(node, limit=50)
+        if _lora_encoded(request):
+            # Encoding may load the trained dictionary
+            return await sync_to_async(_inbox_response)(node, messages, True)
+        return _inbox_response(node, messages)
+
+    except Node.DoesNotExist:
+        return JsonResponse({'error': 'Node not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@device_token_required
+@device_rate_limit('gateway_pull')
+def api_gateway_pull(request):
+    """
+    API endpoint for gateway nodes to take a batch of queued messages to relay over LoRa.
+    POST /api/gateway/pull/
+    Request: {"gateway_esp32_device_id": "ESP32-001", "limit": 20}
+    Messages not acknowledged are handed out again after an exponential backoff.
+    With "encoding": "lora" each message carries "fragments" instead of "content",
+    as in the inbox.
+    """
+    try:
+        data = json.loads(request.body)
+        gateway_id = data.get('gateway_esp32_device_id')
+        limit = data.get('limit')
+        lora = data.get('encoding') == 'lora'
+
+        if not gateway_id:
+            return JsonResponse({'error': 'gateway_esp32_device_id is required'}, status=400)
+
+        if limit is not None and (not isinstance(limit, int) or limit <= 0):
+            return JsonResponse({'error': 'limit must be a positive integer'}, status=400)
+
+        try:
+            gateway = Node.objects.get(esp32_device_id=gateway_id, is_gateway=True)
+        except Node.DoesNotExist:
+            return JsonResponse({'error': 'Gateway not found'}, status=404)
+
+        if not device_allowed(request, gateway):
+            return _forbidden()
+
+        batch = claim_batch(gateway, limit=limit)
+        routes = _relay_routes(gateway, batch)
+        messages_data = [{
+            'id': msg.id,
+            'from': msg.sender.esp32_device_id,
+            'to': msg.receiver.esp32_device_id,
+            'to_lora_node_id': msg.receiver.lora_node_id,
+            **_payload(msg, lora),
+            'attempt': msg.attempts,
+            'route': routes.get(msg.receiver_id),
+        } for msg in batch]
+
+        return JsonResponse({
+            'success': True,
+            'messages': messages_data,
+            'count': len(messages_data)
+        })
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+def _relay_routes(gateway, batch):
+    """{receiver node id: ESP32 IDs of the relay hops from ``gateway``} for the claimed messages."""
+    from .topology import get_topology
+
+    paths = get_topology().routes_from(gateway.pk, {msg.receiver_id for msg in batch})
+    if not paths:
+        return {}
+    device_ids = dict(
+        Node.objects.filter(pk__in={node_id for path in paths.values() for node_id in path})
+        .values_list('pk', 'esp32_device_id')
+    )
+    # Skip routes through nodes deleted since this worker last synced its graph
+    return {
+        target: [device_ids[node_id] for node_id in path]
+        for target, path in paths.items()
+        if all(node_id in device_ids for node_id in path)
+    }
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@device_token_required
+@device_rate_limit('gateway_ack')
+def api_gateway_ack(request):
+    """
+    API endpoint for gateway nodes to confirm messages were relayed.
+    POST /api/gateway/ack/
+    Request: {"gateway_esp32_device_id": "ESP32-001", "delivered": [12, 13]}
+    """
+    try:
+        data = json.loads(request.body)
+        gateway_id = data.get('gateway_esp32_device_id')
+        delivered = data.get('delivered', [])
+
+        if not gateway_id:
+            return JsonResponse({'error': 'gateway_esp32_device_id is required'}, status=400)
+
+        if not isinstance(delivered, list) or not all(isinstance(pk, int) for pk in delivered):
+            return JsonResponse({'error': 'delivered must be a list of message ids'}, status=400)
+
+        try:
+            gateway = Node.objects.get(esp32_device_id=gateway_id, is_gateway=True)
+        except Node.DoesNotExist:
+            return JsonResponse({'error': 'Gateway not found'}, status=404)
+
+        if not device_allowed(request, gateway):
+            return _forbidden()
+
+        updated = acknowledge(gateway, delivered)
+        return JsonResponse({
+            'success': True,
+            'acknowledged': updated
+        })
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@device_token_required
+@device_rate_limit('gateway_fragments')
+def api_gateway_fragments(request):
+    """
+    API endpoint for gateway nodes to submit the fragments of a long message heard over LoRa.
+    POST /api/gateway/fragments/
+    Request: {
+        "gateway_esp32_device_id": "ESP32-001",
+        "from_esp32_device_id": "ESP32-002",
+        "to_esp32_device_id": "ESP32-003",
+        "fragment": "<base64 fragment, see codec.py>"
+    }
+    Addressing, "message_type" and "ttl_seconds" as in api_send_message; they
+    are taken from the request that completes the message. Until every
+    fragment is in, the response has "complete": false and the fragment counts.
+    """
+    try:
+        data = json.loads(request.body)
+        gateway_id = data.get('gateway_esp32_device_id')
+        fragment = data.get('fragment')
+
+        if not gateway_id or not isinstance(fragment, str):
+            return JsonResponse({'error': 'gateway_esp32_device_id and fragment are required'}, status=400)
+
+        params, error = _send_params({**data, 'payload': fragment})
+        if error:
+            return error
+
+        try:
+            gateway = Node.objects.get(esp32_device_id=gateway_id, is_gateway=True)
+        except Node.DoesNotExist:
+            return JsonResponse({'error': 'Gateway not found'}, status=404)
+
+        if not device_allowed(request, gateway):
+            return _forbidden()
+
+        try:
+            sender_node = Node.objects.get(esp32_device_id=params['from_esp32_id'])
+            if not device_allowed(request, sender_node, relay=True):
+                return _forbidden()
+            try:
+                content, received, count = receive_fragment(
+                    sender_node.pk, base64.b64decode(fragment, validate=True)
+                )
+            except (binascii.Error, CodecError) as e:
+                return JsonResponse({'error': f'Invalid fragment: {e}'}, status=400)
+            if content is None:
+                return JsonResponse({
+                    'success': True,
+                    'complete': False,
+                    'received': received,
+                    'count': count,
+                })
+            # Fragments may be larger than FRAGMENT_SIZE, so check what they add up to
+            if not fits_lora(content):
+                return _too_long()
+            params['payload'] = content
+            return _send(sender_node, params)
+        except Node.DoesNotExist as e:
+            return JsonResponse({'error': f'Node not found: {str(e)}'}, status=404)
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@device_token_required
+def api_payload_dictionary(request):
+    """
+    API endpoint for the preset dictionary of LoRa-encoded payloads.
+    GET /api/codec/dictionary/[?id=<dictionary id>]
+    Returns the newest trained dictionary (or the given one) in base64; devices
+    keep it and fetch it again when a payload names an id they do not have.
+    """
+    dictionaries = get_dictionaries()
+    dictionary_id = request.GET.get('id')
+    try:
+        if dictionary_id is None:
+            dictionary_id, dictionary = dictionaries.active()
+            if dictionary_id is None:
+                return JsonResponse({'error': 'No dictionary has been trained'}, status=404)
+        else:
+            dictionary_id = int(dictionary_id)
+            dictionary = dictionaries.get(dictionary_id)
+    except ValueError:
+        # CodecError for unknown ids is a ValueError too
+        return JsonResponse({'error': 'Dictionary not found'}, status=404)
+    return JsonResponse({
+        'success': True,
+        'dictionary_id': dictionary_id,
+        'dictionary': base64.b64encode(dictionary).decode('ascii'),
+    })
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+@device_token_required
+@device_rate_limit('topology_report')
+def api_topology_report(request):
+    """
+    API endpoint for nodes to report the neighbors they hear and for gateways
+    to report the hop-by-hop paths of packets they relayed.
+    POST /api/topology/report/
+    Request: {"esp32_device_id": "ESP32-001",
+              "neighbors": [{"esp32_device_id": "ESP32-002", "rssi": -97, "snr": 6.5}],
+              "paths": [["ESP32-001", "ESP32-004", "ESP32-002"]]}
+    Unknown ESP32 IDs are skipped and listed in the response.
+    """
+    from .topology import record_neighbors, record_path
+
+    try:
+        data = json.loads(request.body)
+        reporter_id = data.get('esp32_device_id')
+        neighbors = data.get('neighbors', [])
+        paths = data.get('paths', [])
+
+        if not reporter_id:
+            return JsonResponse({'error': 'esp32_device_id is required'}, status=400)
+
+        if not isinstance(neighbors, list) or not all(
+            isinstance(entry, dict) and isinstance(entry.get('esp32_device_id'), str)
+            and isinstance(entry.get('rssi'), (int, type(None)))
+            and isinstance(entry.get('snr'), (int, float, type(None)))
+            for entry in neighbors
+        ):
+            return JsonResponse({'error': 'neighbors must be a list of {esp32_device_id, rssi, snr}'}, status=400)
+
+        if not isinstance(paths, list) or not all(
+            isinstance(path, list) and len(path) >= 2 and all(isinstance(hop, str) for hop in path)
+            for path in paths
+        ):
+            return JsonResponse({'error': 'paths must be a list of lists of at least two ESP32 IDs'}, status=400)
+
+        try:
+            reporter = Node.objects.get(esp32_device_id=reporter_id)
+        except Node.DoesNotExist:
+            return JsonResponse({'error': 'Node not found'}, status=404)
+
+        if not device_allowed(request, reporter):
+            return _forbidden()
+
+        # Every hop of a path counts as a delivered packet, so only gateways may report them
+        if paths and not reporter.is_gateway:
+            return JsonResponse({'error': 'Only gateways may report paths'}, status=403)
+
+        mentioned = {entry['esp32_device_id'] for entry in neighbors} | {hop for path in paths for hop in path}
+        node_ids = dict(Node.objects.filter(esp32_device_id__in=mentioned).values_list('esp32_device_id', 'pk'))
+
+        now = timezone.now()
+        updated = record_neighbors(reporter.pk, [
+            (node_ids[entry['esp32_device_id']], entry.get('rssi'), entry.get('snr'))
+            for entry in neighbors if entry['esp32_device_id'] in node_ids
+        ], now)
+        for path in paths:
+            if all(hop in node_ids for hop in path):
+                updated += record_path([node_ids[hop] for hop in path], now)
+
+        return JsonResponse({
+            'success': True,
+            'links_updated': updated,
+            'unknown': sorted(mentioned - node_ids.keys()),
+        })
+
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@require_http_methods(["GET"])
+@device_token_required
+@device_rate_limit('route')
+def api_route(request, esp32_device_id):
+    """
+    API endpoint for the best relay route to a node.
+    GET /api/topology/route/<esp32_device_id>/?from=<esp32_device_id>
+    Routes start at the given node, or at the gateway with the most reliable route.
+    """
+    from .topology import get_topology
+
+    source_id = request.GET.get('from')
+    wanted = [esp32_device_id] + ([source_id] if source_id else [])
+    node_ids = dict(Node.objects.filter(esp32_device_id__in=wanted).values_list('esp32_device_id', 'pk'))
+    if len(node_ids) < len(set(wanted)):
+        return JsonResponse({'error': 'Node not found'}, status=404)
+
+    route = get_topology().route(node_ids[esp32_device_id], node_ids.get(source_id))
+    if route is None:
+        return JsonResponse({'error': 'No known route to this node'}, status=404)
+
+    path, reliability = route
+    device_ids = dict(Node.objects.filter(pk__in=path).values_list('pk', 'esp32_device_id'))
+    if len(device_ids) < len(path):
+        return JsonResponse({'error': 'No known route to this node'}, status=404)
+    return JsonResponse({
+        'success': True,
+        'from': device_ids[path[0]],
+        'to': esp32_device_id,
+        'hops': [device_ids[node_id] for node_id in path],
+        'hop_count': len(path) - 1,
+        'reliability': round(reliability, 3),
+    })
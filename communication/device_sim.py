@@ -0,0 +1,160 @@
+"""
+Simulated devices for the gateway ingest server (see communication/ingest.py).
+
+IngestClient speaks the binary protocol over UDP or TCP and resends a frame
+with the same sequence number until it is ACKed, exactly like a device
+would. simulate_devices() drives a fleet of simulated devices sending
+heartbeats and messages, optionally batched the way a gateway relays them.
+Nothing here touches the database, so it can run in any process.
+"""
+import asyncio
+import random
+import time
+from collections import Counter
+
+from . import ingest_protocol as protocol
+
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._ack_received(data)
+
+
+class IngestClient:
+    """
+    Minimal ingest protocol client with per-frame retries.
+    ``loss_rate`` drops that share of outgoing frames to exercise retries.
+    """
+
+    def __init__(self, host, port, transport='udp', token='', timeout=1.0, retries=3, loss_rate=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.transport_name = transport
+        self.token = token
+        self.timeout = timeout
+        self.retries = retries
+        self.loss_rate = loss_rate
+        self.random = random.Random(seed)
+        self.seq = self.random.randrange(1 << 32)
+        self.waiting = {}
+        self.stats = Counter()
+        self.transport = None
+        self.reader_task = None
+        self.token_acked = False
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        if self.transport_name == 'udp':
+            self.transport, _ = await loop.create_datagram_endpoint(
+                lambda: _ClientProtocol(self), remote_addr=(self.host, self.port)
+            )
+            self._write = self.transport.sendto
+        else:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+            self.transport = writer
+            self._write = writer.write
+            self.reader_task = asyncio.ensure_future(self._read_tcp(reader))
+        return self
+
+    async def _read_tcp(self, reader):
+        try:
+            while True:
+                header = await reader.readexactly(protocol.HEADER.size)
+                _, _, length, _ = protocol.parse_header(header)
+                self._ack_received(header + await reader.readexactly(length))
+        except (asyncio.IncompleteReadError, ConnectionError, protocol.ProtocolError):
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError('Ingest connection closed'))
+
+    def _ack_received(self, data):
+        try:
+            frame = protocol.decode_frame(data)
+            results = protocol.decode_ack(frame)
+        except protocol.ProtocolError:
+            self.stats['bad_ack'] += 1
+            return
+        future = self.waiting.get(frame.seq)
+        if future is not None and not future.done():
+            future.set_result(results)
+
+    async def send(self, records):
+        """
+        Send ``records`` in one frame and wait for the ACK, resending on timeout.
+        Returns the list of (result code, message id); raises TimeoutError
+        when every attempt went unanswered.
+        """
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        seq = self.seq
+        # Over TCP the server remembers the token once a frame carrying it was ACKed
+        token = '' if self.token_acked else self.token
+        frame = protocol.encode_request(seq, records, token)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[seq] = future
+        self.stats['frames'] += 1
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.stats['retries'] += 1
+                if self.random.random() >= self.loss_rate:
+                    self._write(frame)
+                else:
+                    self.stats['dropped'] += 1
+                try:
+                    results = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+                    self.token_acked = self.transport_name == 'tcp'
+                    return results
+                except asyncio.TimeoutError:
+                    continue
+            self.stats['timeouts'] += 1
+            raise TimeoutError(f'No ACK for frame {seq}')
+        finally:
+            del self.waiting[seq]
+
+    async def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+
+
+async def simulate_devices(client, device_ids, rounds=10, message_rate=0.2, batch=1, concurrency=50, seed=None):
+    """
+    Each round every device sends a heartbeat and, with probability
+    ``message_rate``, a message to a random other device. Records are grouped
+    ``batch`` per frame; up to ``concurrency`` frames are in flight at once.
+    Returns a Counter of result names plus 'records' and 'seconds'.
+    """
+    rng = random.Random(seed)
+    results = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(records):
+        async with semaphore:
+            try:
+                acks = await client.send(records)
+            except (TimeoutError, ConnectionError):
+                results['no_ack'] += len(records)
+                return
+        for code, _ in acks:
+            results[protocol.RESULT_NAMES[code]] += 1
+
+    start = time.perf_counter()
+    for round_number in range(rounds):
+        records = []
+        for device_id in device_ids:
+            records.append(protocol.StatusRecord(device_id, 'ONLINE'))
+            if len(device_ids) > 1 and rng.random() < message_rate:
+                receiver = rng.choice(device_ids)
+                while receiver == device_id:
+                    receiver = rng.choice(device_ids)
+                records.append(protocol.MessageRecord(
+                    device_id, receiver, 'TEXT', 0, f'Sim round {round_number} from {device_id}'
+                ))
+        results['records'] += len(records)
+        await asyncio.gather(*(send(records[i:i + batch]) for i in range(0, len(records), batch)))
+    results['seconds'] = time.perf_counter() - start
+    return results
@@ -0,0 +1,24 @@
+"""
+URL patterns of the device API, shared by the full site (communication/urls.py)
+and the lean device-API profile (lora_comm/urls_device.py).
+"""
+from django.conf import settings
+from django.urls import path
+from . import device_api
+
+app_name = 'communication'
+
+# Native async device views under ASGI, sync views under WSGI
+_async_api = getattr(settings, 'DEVICE_API_ASYNC', False)
+
+urlpatterns = [
+    path('api/nodes/update-status/', device_api.aapi_update_status if _async_api else device_api.api_update_status, name='api_update_status'),
+    path('api/messages/send/', device_api.aapi_send_message if _async_api else device_api.api_send_message, name='api_send_message'),
+    path('api/messages/inbox/<str:esp32_device_id>/', device_api.aapi_get_inbox if _async_api else device_api.api_get_inbox, name='api_get_inbox'),
+    path('api/gateway/pull/', device_api.api_gateway_pull, name='api_gateway_pull'),
+    path('api/gateway/ack/', device_api.api_gateway_ack, name='api_gateway_ack'),
+    path('api/gateway/fragments/', device_api.api_gateway_fragments, name='api_gateway_fragments'),
+    path('api/codec/dictionary/', device_api.api_payload_dictionary, name='api_payload_dictionary'),
+    path('api/topology/report/', device_api.api_topology_report, name='api_topology_report'),
+    path('api/topology/route/<str:esp32_device_id>/', device_api.api_route, name='api_route'),
+]
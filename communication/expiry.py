@@ -0,0 +1,58 @@
+"""
+Bulk purge of expired messages.
+
+Deletes run in small batches, each in its own transaction, so SQLite never
+holds the write lock for long while devices keep posting. Every message
+database is purged in turn (see sharding.py).
+"""
+from django.utils import timezone
+
+from .activity import touch
+from .conversations import release_unread
+from .dashboard_cache import bump_recent_messages
+from .models import Message
+from .sharding import atomic, message_databases
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def expired_count(now=None):
+    """Number of messages past their expiry that have not been purged yet."""
+    now = now or timezone.now()
+    return sum(
+        Message.objects.using(using).filter(expires_at__lte=now).count() for using in message_databases()
+    )
+
+
+def purge_expired(batch_size=DEFAULT_BATCH_SIZE, max_batches=None, now=None):
+    """
+    Delete expired messages in batches of ``batch_size``.
+    Stops after ``max_batches`` batches if given. Returns the number purged.
+    """
+    now = now or timezone.now()
+    purged = 0
+    batches = 0
+    for using in message_databases():
+        while max_batches is None or batches < max_batches:
+            # Walks the partial expires_at index; never scans unexpiring rows.
+            ids = list(
+                Message.objects.using(using).filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            with atomic(using):
+                batch = Message.objects.using(using).filter(pk__in=ids)
+                release_unread(batch)
+                # Purged messages leave the node pages' message lists
+                touch(
+                    node_id for pair in batch.values_list('sender_id', 'receiver_id') for node_id in pair
+                    if node_id is not None
+                )
+                batch.delete()
+            purged += len(ids)
+            batches += 1
+    if purged:
+        bump_recent_messages()
+    return purged
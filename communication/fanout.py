@@ -0,0 +1,109 @@
+"""
+Group and broadcast message fan-out, and the merged direct + group inbox.
+
+A group or broadcast message is stored once as a Message with no receiver;
+each recipient gets a slim MessageRecipient row created with bulk_create.
+"""
+import heapq
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Node
+from .models import Message, MessageRecipient, unexpired
+from .sharding import with_related
+
+# Rows per INSERT; keeps each statement well inside SQLite's variable limit.
+RECIPIENT_BATCH_SIZE = 2000
+
+
+def _fan_out(sender, content, recipient_ids, **message_fields):
+    """Create the Message once and one MessageRecipient per recipient id."""
+    with transaction.atomic():
+        message = Message.objects.create(
+            sender=sender,
+            content=content,
+            status='SENT',
+            **message_fields
+        )
+        MessageRecipient.objects.bulk_create(
+            [MessageRecipient(message_id=message.pk, node_id=node_id) for node_id in recipient_ids],
+            batch_size=RECIPIENT_BATCH_SIZE,
+        )
+    return message
+
+
+def send_to_group(sender, group, content, **message_fields):
+    """
+    Send ``content`` to every member of ``group`` except the sender.
+    Extra keyword arguments (``message_type``, ``expires_at``) go to the Message.
+    Returns (message, recipient_count).
+    """
+    recipient_ids = list(
+        group.members.exclude(pk=sender.pk).values_list('pk', flat=True)
+    )
+    message = _fan_out(sender, content, recipient_ids, group=group, **message_fields)
+    return message, len(recipient_ids)
+
+
+def send_broadcast(sender, content, **message_fields):
+    """
+    Send ``content`` to every node except the sender.
+    Extra keyword arguments (``message_type``, ``expires_at``) go to the Message.
+    Returns (message, recipient_count).
+    """
+    recipient_ids = list(
+        Node.objects.exclude(pk=sender.pk).order_by().values_list('pk', flat=True)
+    )
+    message = _fan_out(sender, content, recipient_ids, is_broadcast=True, **message_fields)
+    return message, len(recipient_ids)
+
+
+def _inbox_queries(node, limit, now):
+    # Routed to the node's shard when messages are sharded (see sharding.py)
+    direct = with_related(node.received_messages.filter(unexpired(now)), 'sender')[:limit]
+    group_rows = (
+        MessageRecipient.objects
+        .filter(unexpired(now, prefix='message__'), node=node)
+        .select_related('message__sender', 'message__group')
+        .order_by('-message_id')[:limit]
+    )
+    return direct, group_rows
+
+
+def _merge_inbox(direct, group_rows, limit):
+    for message in direct:
+        message.delivery_status = message.status
+    group = []
+    for row in group_rows:
+        message = row.message
+        message.delivery_status = row.status
+        group.append(message)
+
+    merged = heapq.merge(direct, group, key=lambda m: m.created_at, reverse=True)
+    return list(islice(merged, limit))
+
+
+def inbox_for(node, limit=50):
+    """
+    Return the newest ``limit`` messages for ``node``, merging direct and
+    group/broadcast messages. Expired messages are excluded. Each message gets
+    a ``delivery_status`` attribute holding the per-recipient status.
+
+    Both sides are fetched through indexes already ordered newest-first
+    ((receiver, -created_at, expires_at) and (node, message)), so the merge
+    reads at most ``limit`` rows from each.
+    """
+    direct, group_rows = _inbox_queries(node, limit, timezone.now())
+    return _merge_inbox(list(direct), group_rows, limit)
+
+
+async def ainbox_for(node, limit=50):
+    """Async version of inbox_for(), for the ASGI device API."""
+    direct, group_rows = _inbox_queries(node, limit, timezone.now())
+    return _merge_inbox(
+        [message async for message in direct],
+        [row async for row in group_rows],
+        limit,
+    )
@@ -0,0 +1,40 @@
+"""
+Simulated LoRa gateway for exercising the delivery scheduler without hardware.
+
+Each round the gateway claims a batch of due messages, "transmits" them with a
+configurable packet loss rate and acknowledges the ones that got through, just
+like a real gateway would through the pull/ack API.
+"""
+import random
+
+from django.utils import timezone
+
+from .delivery import acknowledge, claim_batch
+
+
+class SimulatedGateway:
+    """
+    In-process stand-in for a gateway node.
+    """
+
+    def __init__(self, gateway, loss_rate=0.2, batch_size=None, seed=None):
+        self.gateway = gateway
+        self.loss_rate = loss_rate
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+
+    def transmit(self, message):
+        """Pretend to send one message over LoRa. Returns True if it was received."""
+        return self.random.random() >= self.loss_rate
+
+    def run_once(self, now=None):
+        """Claim, transmit and acknowledge one batch. Returns per-round counts."""
+        now = now or timezone.now()
+        claimed = claim_batch(self.gateway, limit=self.batch_size, now=now)
+        delivered = [message.pk for message in claimed if self.transmit(message)]
+        acknowledge(self.gateway, delivered)
+        return {
+            'claimed': len(claimed),
+            'delivered': len(delivered),
+            'lost': len(claimed) - len(delivered),
+        }
@@ -0,0 +1,413 @@
+"""
+Gateway ingest server: status updates and messages over UDP or TCP, without HTTP.
+
+Frames (see ingest_protocol.py) are decoded on the asyncio event loop and
+queued. One writer drains the queue every FLUSH_INTERVAL_MS, or as soon as
+BATCH_SIZE records are waiting, and applies the whole batch in a single
+database transaction through the model layer: heartbeats through
+accounts.uptime.record_statuses() and messages through Message.bulk_create()
+(split by shard, see sharding.py) after Message.apply_defaults(). A frame is
+ACKed only after its batch has committed, so a device that gets no ACK just
+resends the same frame; a resent sequence number is answered from a replay
+cache instead of being written twice.
+
+Device IDs are resolved through NodeMap, an in-memory copy of the node table
+reloaded every NODE_MAP_TTL seconds, so validation does not query the
+database per packet. Tokens and rate limits are the same as for the HTTP
+device API: a token may submit records for its own node, and a gateway's
+token also for the nodes whose relay_gateway it is (changes to that take up
+to NODE_MAP_TTL to apply).
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Node
+from accounts.tokens import verify_token
+from accounts.uptime import record_statuses
+
+from . import ingest_protocol as protocol
+from .codec import fits_lora
+from .conversations import record_messages
+from .dashboard_cache import bump_recent_messages
+from .models import Message
+from .ratelimit import allow
+from .sharding import bulk_create
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    'HOST': '127.0.0.1',
+    'UDP_PORT': 9750,
+    'TCP_PORT': 9751,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL_MS': 20,
+    'NODE_MAP_TTL': 60,
+    'REPLAY_CACHE_SIZE': 50000,
+}
+
+# Results a device should retry; these are not kept in the replay cache
+RETRYABLE = (protocol.RATE_LIMITED, protocol.SERVER_ERROR)
+
+
+def ingest_setting(key):
+    return getattr(settings, 'INGEST_SERVER', {}).get(key, DEFAULT_CONFIG[key])
+
+
+class NodeMap:
+    """
+    ``esp32_device_id -> node id`` for the whole fleet, plus the set of
+    gateway node ids and each node's relay gateway. Reloaded every ``ttl``
+    seconds; a device ID that is not in the map is looked up once, so new
+    nodes work before the next reload.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.nodes = {}
+        self.gateways = set()
+        self.relays = {}
+        self.missing = set()
+        self.loaded_at = None
+
+    def reload(self):
+        rows = list(Node.objects.values_list('esp32_device_id', 'pk', 'is_gateway', 'relay_gateway_id'))
+        self.nodes = {device_id: pk for device_id, pk, _, _ in rows}
+        self.gateways = {pk for _, pk, is_gateway, _ in rows if is_gateway}
+        self.relays = {pk: gateway_id for _, pk, _, gateway_id in rows if gateway_id}
+        self.missing = set()
+        self.loaded_at = time.monotonic()
+
+    def get(self, device_id):
+        """Return the node id for ``device_id``, or None."""
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+            self.reload()
+        node_id = self.nodes.get(device_id)
+        if node_id is None and device_id not in self.missing:
+            row = Node.objects.filter(esp32_device_id=device_id).values_list(
+                'pk', 'is_gateway', 'relay_gateway_id'
+            ).first()
+            if row is None:
+                self.missing.add(device_id)
+            else:
+                node_id = self.nodes[device_id] = row[0]
+                if row[1]:
+                    self.gateways.add(node_id)
+                if row[2]:
+                    self.relays[node_id] = row[2]
+        return node_id
+
+    def may_act(self, token_node, node_id):
+        """Whether the token of ``token_node`` may submit records for ``node_id`` (see accounts/tokens.py)."""
+        return token_node == node_id or (token_node in self.gateways and self.relays.get(node_id) == token_node)
+
+
+class Request:
+    """One decoded frame waiting for the writer."""
+
+    __slots__ = ('token', 'records', 'future')
+
+    def __init__(self, token, records, future):
+        self.token = token
+        self.records = records
+        self.future = future
+
+
+class IngestWriter:
+    """
+    Collects requests from the event loop and writes them in batches on a
+    worker thread (the ORM is synchronous).
+    """
+
+    def __init__(self, node_map=None, batch_size=None, flush_interval=None):
+        self.node_map = node_map or NodeMap(ingest_setting('NODE_MAP_TTL'))
+        self.batch_size = batch_size or ingest_setting('BATCH_SIZE')
+        self.flush_interval = (flush_interval or ingest_setting('FLUSH_INTERVAL_MS')) / 1000
+        self.pending = []
+        self.pending_records = 0
+        self.has_work = asyncio.Event()
+        self.full = asyncio.Event()
+        self.stats = Counter()
+
+    def submit(self, token, records):
+        """Queue one request. Returns a future resolving to its ACK results."""
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(Request(token, records, future))
+        self.pending_records += len(records)
+        self.has_work.set()
+        if self.pending_records >= self.batch_size:
+            self.full.set()
+        return future
+
+    async def run(self):
+        while True:
+            await self.has_work.wait()
+            if self.pending_records < self.batch_size:
+                # Give more packets a moment to join this batch
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    async def flush(self):
+        batch, self.pending, self.pending_records = self.pending, [], 0
+        self.has_work.clear()
+        self.full.clear()
+        if not batch:
+            return
+        try:
+            results = await sync_to_async(self.process, thread_sensitive=True)(batch)
+        except Exception:
+            logger.exception('Ingest batch failed')
+            results = [[(protocol.SERVER_ERROR, None)] * len(request.records) for request in batch]
+        for request, request_results in zip(batch, results):
+            if not request.future.done():
+                request.future.set_result(request_results)
+
+    def process(self, batch):
+        """Validate and write one batch. Returns per-request lists of (code, message id)."""
+        now = timezone.now()
+        results, statuses, messages = self.validate(batch, now)
+        try:
+            with transaction.atomic():
+                self.write(statuses, messages, now)
+        except Exception:
+            # Usually a node deleted since the map was loaded: reload and
+            # retry each record in its own transaction.
+            logger.exception('Ingest batch write failed; retrying records one by one')
+            self.node_map.reload()
+            for slot, update in statuses:
+                self._write_one(results, slot, [update], [], now)
+            for slot, message in messages:
+                message.pk = None
+                self._write_one(results, slot, [], [message], now)
+        else:
+            for slot, message in messages:
+                results[slot[0]][slot[1]] = (protocol.OK, message.pk)
+        if messages:
+            bump_recent_messages()
+        return results
+
+    def _write_one(self, results, slot, statuses, messages, now):
+        try:
+            with transaction.atomic():
+                self.write([(slot, update) for update in statuses], [(slot, m) for m in messages], now)
+        except Exception:
+            results[slot[0]][slot[1]] = (protocol.SERVER_ERROR, None)
+        else:
+            results[slot[0]][slot[1]] = (protocol.OK, messages[0].pk if messages else None)
+
+    def write(self, statuses, messages, now):
+        if statuses:
+            record_statuses([update for _, update in statuses], now)
+        if messages:
+            created = bulk_create([message for _, message in messages], batch_size=500)
+            record_messages(created)
+        self.stats['statuses'] += len(statuses)
+        self.stats['messages'] += len(messages)
+
+    def validate(self, batch, now):
+        """
+        Check every record and build the writes, all stamped ``now``. Returns
+        (results, statuses, messages); results are pre-filled with OK or the
+        rejection code, and each write is tagged with its (request index,
+        record index) slot.
+        """
+        auth = getattr(settings, 'DEVICE_API_AUTH', True)
+        node_map = self.node_map
+        results = []
+        statuses = []
+        messages = []
+        for i, request in enumerate(batch):
+            request_results = [(protocol.OK, None)] * len(request.records)
+            results.append(request_results)
+            token_node = verify_token(request.token) if auth and request.token else None
+            if auth and token_node is None:
+                request_results[:] = [(protocol.UNAUTHORIZED, None)] * len(request.records)
+                self.stats['unauthorized'] += len(request.records)
+                continue
+
+            for j, record in enumerate(request.records):
+                is_status = isinstance(record, protocol.StatusRecord)
+                device_id = record.device_id if is_status else record.from_device_id
+                node_id = node_map.get(device_id)
+                code = None
+                if node_id is None:
+                    code = protocol.UNKNOWN_NODE
+                elif auth and not node_map.may_act(token_node, node_id):
+                    code = protocol.FORBIDDEN
+                elif not allow('update_status' if is_status else 'send_message', device_id)[0]:
+                    code = protocol.RATE_LIMITED
+
+                if code is None and is_status:
+                    statuses.append(((i, j), (node_id, record.status)))
+                elif code is None:
+                    receiver_id = node_map.get(record.to_device_id)
+                    if receiver_id is None:
+                        code = protocol.UNKNOWN_NODE
+                    elif not record.content or not fits_lora(record.content):
+                        code = protocol.INVALID
+                    else:
+                        message = Message(
+                            sender_id=node_id,
+                            receiver_id=receiver_id,
+                            content=record.content,
+                            message_type=record.message_type,
+                            status='SENT',
+                        )
+                        if record.ttl_seconds:
+                            message.expires_at = now + timedelta(seconds=record.ttl_seconds)
+                        message.apply_defaults(now)
+                        messages.append(((i, j), message))
+
+                if code is not None:
+                    request_results[j] = (code, None)
+                    self.stats[protocol.RESULT_NAMES[code]] += 1
+        return results, statuses, messages
+
+
+class _Connection:
+    """Per-TCP-connection state: the last token the device sent."""
+
+    __slots__ = ('token',)
+
+    def __init__(self):
+        self.token = ''
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        def send(frame):
+            self.transport.sendto(frame, addr)
+
+        try:
+            frame = protocol.decode_frame(data)
+        except protocol.ProtocolError:
+            self.server.reject(data, send)
+            return
+        self.server.spawn(self.server.handle(frame, _Connection(), addr[0], send))
+
+
+class IngestServer:
+    """
+    Runs the UDP and/or TCP listeners and the batch writer.
+    Pass ``udp_port=None`` or ``tcp_port=None`` to disable a transport.
+    """
+
+    def __init__(self, host=None, udp_port=None, tcp_port=None, writer=None):
+        self.host = host or ingest_setting('HOST')
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.writer = writer or IngestWriter()
+        self.replay = OrderedDict()
+        self.replay_size = ingest_setting('REPLAY_CACHE_SIZE')
+        self.tasks = set()
+        self.stats = self.writer.stats
+
+    def spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def reject(self, data, send):
+        """Answer an undecodable frame with BAD_FRAME if at least its header is readable."""
+        self.stats['bad_frame'] += 1
+        try:
+            _, seq, _, version = protocol.parse_header(data)
+        except protocol.ProtocolError:
+            return
+        send(protocol.encode_ack(seq, [(protocol.BAD_FRAME, None)], version))
+
+    async def handle(self, frame, connection, peer, send):
+        """Queue one request frame and send its ACK once the batch is written."""
+        self.stats['frames'] += 1
+        try:
+            token, records = protocol.decode_request(frame)
+        except protocol.ProtocolError:
+            self.stats['bad_frame'] += 1
+            send(protocol.encode_ack(frame.seq, [(protocol.BAD_FRAME, None)], frame.version))
+            return
+        if token:
+            connection.token = token
+        token = connection.token
+
+        key = (token or peer, frame.seq)
+        future = self.replay.get(key)
+        if future is None:
+            future = self.writer.submit(token, records)
+            if len(self.replay) >= self.replay_size:
+                self.replay.popitem(last=False)
+            self.replay[key] = future
+        else:
+            self.stats['replayed'] += 1
+        results = await asyncio.shield(future)
+        if any(code in RETRYABLE for code, _ in results):
+            # Let a resend of this frame be processed again
+            self.replay.pop(key, None)
+        # In the request's version: version 1 clients read u32 message ids
+        send(protocol.encode_ack(frame.seq, results, frame.version))
+
+    async def _handle_tcp(self, reader, writer):
+        connection = _Connection()
+        peer = (writer.get_extra_info('peername') or ('?',))[0]
+
+        def send(frame):
+            if not writer.is_closing():
+                writer.write(frame)
+
+        try:
+            while True:
+                header = await reader.readexactly(protocol.HEADER.size)
+                try:
+                    frame_type, seq, length, version = protocol.parse_header(header)
+                except protocol.ProtocolError:
+                    # The stream is out of sync; the device has to reconnect
+                    self.stats['bad_frame'] += 1
+                    break
+                payload = await reader.readexactly(length)
+                self.spawn(self.handle(protocol.Frame(frame_type, seq, payload, version), connection, peer, send))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Open the listeners and start the writer. Returns the bound (udp, tcp) ports."""
+        loop = asyncio.get_running_loop()
+        self.spawn(self.writer.run())
+        udp_port = tcp_port = None
+        self.udp_transport = self.tcp_server = None
+        if self.udp_port is not None:
+            self.udp_transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self), local_addr=(self.host, self.udp_port)
+            )
+            udp_port = self.udp_transport.get_extra_info('sockname')[1]
+        if self.tcp_port is not None:
+            self.tcp_server = await asyncio.start_server(self._handle_tcp, self.host, self.tcp_port)
+            tcp_port = self.tcp_server.sockets[0].getsockname()[1]
+        return udp_port, tcp_port
+
+    async def stop(self):
+        """Close the listeners and write whatever is still queued."""
+        if self.udp_transport is not None:
+            self.udp_transport.close()
+        if self.tcp_server is not None:
+            self.tcp_server.close()
+        await self.writer.flush()
+        for task in list(self.tasks):
+            task.cancel()
@@ -0,0 +1,236 @@
+"""
+Binary framing for the gateway ingest server (see communication/ingest.py).
+
+Every frame starts with a 10-byte header, integers big-endian:
+
+    magic    2 bytes   b'LR'
+    version  1 byte    1 or 2
+    type     1 byte    STATUS, MESSAGE, BATCH or ACK
+    seq      4 bytes   chosen by the sender; the ACK echoes it
+    length   2 bytes   payload length
+
+Over UDP each datagram carries exactly one frame; over TCP frames follow each
+other on the stream. A request payload starts with the device token (str8,
+may be empty when auth is disabled or the TCP connection already sent one)
+followed by its record(s):
+
+    STATUS   device_id (str8), status (u8: 0 OFFLINE, 1 ONLINE)
+    MESSAGE  from device_id (str8), to device_id (str8), message_type (u8),
+             ttl_seconds (u32, 0 = per-type default), content (str16)
+    BATCH    count (u16), then count x (record type (u8), STATUS/MESSAGE record)
+
+str8/str16 are UTF-8 strings prefixed with a u8/u16 byte length. An ACK
+payload is count (u16) followed by count x (result (u8), message id (u64,
+0 if none)), one entry per record in request order.
+
+Version 1 differs only in the ACK: its message ids are u32. The server
+answers every frame in the version it was sent with. Ids only outgrow u32
+with MESSAGE_SHARDS (sharded ids start at 2**40); a version 1 client then
+gets ID_OVERFLOW for a message that was stored but whose id it cannot read.
+"""
+import struct
+from collections import namedtuple
+
+MAGIC = b'LR'
+VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)
+HEADER = struct.Struct('!2sBBIH')
+MAX_PAYLOAD = 0xFFFF
+
+# Frame types
+STATUS = 0x01
+MESSAGE = 0x02
+BATCH = 0x03
+ACK = 0x80
+REQUEST_TYPES = (STATUS, MESSAGE, BATCH)
+
+# ACK result codes
+OK = 0
+BAD_FRAME = 1
+UNAUTHORIZED = 2
+FORBIDDEN = 3
+UNKNOWN_NODE = 4
+INVALID = 5
+RATE_LIMITED = 6
+SERVER_ERROR = 7
+ID_OVERFLOW = 8
+RESULT_NAMES = {
+    OK: 'ok',
+    BAD_FRAME: 'bad_frame',
+    UNAUTHORIZED: 'unauthorized',
+    FORBIDDEN: 'forbidden',
+    UNKNOWN_NODE: 'unknown_node',
+    INVALID: 'invalid',
+    RATE_LIMITED: 'rate_limited',
+    SERVER_ERROR: 'server_error',
+    ID_OVERFLOW: 'id_overflow',
+}
+
+# Wire value -> Message.message_type
+MESSAGE_TYPES = ('TEXT', 'ALERT', 'COMMAND')
+
+Frame = namedtuple('Frame', 'type seq payload version', defaults=(VERSION,))
+StatusRecord = namedtuple('StatusRecord', 'device_id status')
+MessageRecord = namedtuple('MessageRecord', 'from_device_id to_device_id message_type ttl_seconds content')
+
+# ACK entry (result, message id) per protocol version
+_ACK_ENTRIES = {1: struct.Struct('!BI'), 2: struct.Struct('!BQ')}
+
+
+class ProtocolError(ValueError):
+    """A frame or payload that cannot be decoded."""
+
+
+def parse_header(data):
+    """Return (type, seq, payload_length, version) from the first HEADER.size bytes of ``data``."""
+    if len(data) < HEADER.size:
+        raise ProtocolError('Frame shorter than header')
+    magic, version, frame_type, seq, length = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ProtocolError('Bad magic')
+    if version not in SUPPORTED_VERSIONS:
+        raise ProtocolError(f'Unsupported protocol version {version}')
+    return frame_type, seq, length, version
+
+
+def encode_frame(frame_type, seq, payload=b'', version=VERSION):
+    if len(payload) > MAX_PAYLOAD:
+        raise ProtocolError('Payload too large for one frame')
+    return HEADER.pack(MAGIC, version, frame_type, seq & 0xFFFFFFFF, len(payload)) + payload
+
+
+def decode_frame(data):
+    """Decode one complete frame, e.g. a UDP datagram."""
+    frame_type, seq, length, version = parse_header(data)
+    if len(data) != HEADER.size + length:
+        raise ProtocolError('Payload length does not match header')
+    return Frame(frame_type, seq, bytes(data[HEADER.size:]), version)
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def take(self, size):
+        end = self.pos + size
+        if end > len(self.data):
+            raise ProtocolError('Truncated payload')
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return chunk
+
+    def uint(self, fmt):
+        size = struct.calcsize(fmt)
+        return struct.unpack(fmt, self.take(size))[0]
+
+    def string(self, length_fmt):
+        try:
+            return self.take(self.uint(length_fmt)).decode('utf-8')
+        except UnicodeDecodeError:
+            raise ProtocolError('Invalid UTF-8 string')
+
+    def done(self):
+        if self.pos != len(self.data):
+            raise ProtocolError('Trailing bytes in payload')
+
+
+def _str(value, length_fmt):
+    data = value.encode('utf-8')
+    if len(data) >= 1 << (8 * struct.calcsize(length_fmt)):
+        raise ProtocolError('String too long')
+    return struct.pack(length_fmt, len(data)) + data
+
+
+def _encode_record(record):
+    if isinstance(record, StatusRecord):
+        return STATUS, _str(record.device_id, '!B') + struct.pack('!B', record.status == 'ONLINE')
+    return MESSAGE, b''.join([
+        _str(record.from_device_id, '!B'),
+        _str(record.to_device_id, '!B'),
+        struct.pack('!BI', MESSAGE_TYPES.index(record.message_type), record.ttl_seconds or 0),
+        _str(record.content, '!H'),
+    ])
+
+
+def _decode_record(record_type, reader):
+    if record_type == STATUS:
+        device_id = reader.string('!B')
+        status = reader.uint('!B')
+        if status > 1:
+            raise ProtocolError('Unknown status value')
+        return StatusRecord(device_id, 'ONLINE' if status else 'OFFLINE')
+    if record_type == MESSAGE:
+        from_device_id = reader.string('!B')
+        to_device_id = reader.string('!B')
+        message_type = reader.uint('!B')
+        ttl_seconds = reader.uint('!I')
+        content = reader.string('!H')
+        if message_type >= len(MESSAGE_TYPES):
+            raise ProtocolError('Unknown message type')
+        return MessageRecord(from_device_id, to_device_id, MESSAGE_TYPES[message_type], ttl_seconds, content)
+    raise ProtocolError(f'Unknown record type {record_type}')
+
+
+def encode_request(seq, records, token='', version=VERSION):
+    """
+    Encode ``records`` as one frame: STATUS or MESSAGE for a single record,
+    BATCH for several.
+    """
+    records = list(records)
+    if not records:
+        raise ProtocolError('No records to send')
+    if len(records) == 1:
+        frame_type, body = _encode_record(records[0])
+    else:
+        frame_type = BATCH
+        parts = [struct.pack('!H', len(records))]
+        for record in records:
+            record_type, record_body = _encode_record(record)
+            parts.append(struct.pack('!B', record_type) + record_body)
+        body = b''.join(parts)
+    return encode_frame(frame_type, seq, _str(token, '!B') + body, version)
+
+
+def decode_request(frame):
+    """Return (token, records) for a STATUS, MESSAGE or BATCH frame."""
+    reader = _Reader(frame.payload)
+    token = reader.string('!B')
+    if frame.type == BATCH:
+        count = reader.uint('!H')
+        records = [_decode_record(reader.uint('!B'), reader) for _ in range(count)]
+    elif frame.type in (STATUS, MESSAGE):
+        records = [_decode_record(frame.type, reader)]
+    else:
+        raise ProtocolError(f'Not a request frame type: {frame.type}')
+    reader.done()
+    return token, records
+
+
+def encode_ack(seq, results, version=VERSION):
+    """
+    ACK frame for ``results``, a list of (result code, message id or None), in
+    protocol ``version`` (the request's).
+    """
+    entry = _ACK_ENTRIES[version]
+    largest = (1 << (8 * (entry.size - 1))) - 1
+    results = [
+        (ID_OVERFLOW, None) if message_id is not None and message_id > largest else (code, message_id)
+        for code, message_id in results
+    ]
+    payload = struct.pack('!H', len(results)) + b''.join(
+        entry.pack(code, message_id or 0) for code, message_id in results
+    )
+    return encode_frame(ACK, seq, payload, version)
+
+
+def decode_ack(frame):
+    """Return the list of (result code, message id or None) in an ACK frame."""
+    entry = _ACK_ENTRIES[frame.version]
+    reader = _Reader(frame.payload)
+    results = []
+    for _ in range(reader.uint('!H')):
+        code, message_id = entry.unpack(reader.take(entry.size))
+        results.append((code, message_id or None))
+    reader.done()
+    return results
@@ -0,0 +1,27 @@
+"""
+Django management command to expire mesh links that have not been heard recently.
+Usage: python manage.py expire_links [--ttl SECONDS]
+
+Links not observed for --ttl seconds (default TOPOLOGY['LINK_TTL']) are
+dropped from routing; links expired for longer than that are deleted. Run it
+every few minutes from cron.
+"""
+from django.core.management.base import BaseCommand
+
+from communication.topology import expire_links
+
+
+class Command(BaseCommand):
+    help = 'Expires mesh topology links that have not been heard recently'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ttl',
+            type=int,
+            default=None,
+            help='Seconds without an observation before a link is expired',
+        )
+
+    def handle(self, *args, **options):
+        expired, deleted = expire_links(ttl=options['ttl'])
+        self.stdout.write(self.style.SUCCESS(f'{expired} links expired, {deleted} expired links deleted.'))
@@ -0,0 +1,96 @@
+"""
+Django management command to generate a large synthetic fleet and message history.
+Usage: python manage.py generate_dataset [--nodes 100000] [--messages 50000000] [--executemany] [--drop-indexes]
+
+Senders follow a Zipf distribution (--zipf), timestamps a daily cycle peaking
+at --peak-hour over the last --days days, and statuses/types the given mixes,
+e.g. --status-mix DELIVERED=0.85,SENT=0.1,FAILED=0.05. Every generated user
+has the password given by --password. Use it on a throwaway database:
+DATABASES['default']['NAME'] decides where the data goes.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import Node
+from communication.dataset import DEFAULT_STATUS_MIX, DEFAULT_TYPE_MIX, create_fleet, create_messages
+from communication.models import Message
+
+
+def _mix(value, choices):
+    """Parse "A=0.8,B=0.2" into {'A': 0.8, 'B': 0.2}, checking the keys against ``choices``."""
+    mix = {}
+    for part in value.split(','):
+        key, _, weight = part.partition('=')
+        key = key.strip().upper()
+        if key not in choices:
+            raise CommandError(f'Unknown value {key!r}; choose from {", ".join(choices)}')
+        try:
+            mix[key] = float(weight)
+        except ValueError:
+            raise CommandError(f'Invalid weight in {part!r}')
+    return mix
+
+
+class Command(BaseCommand):
+    help = 'Creates synthetic nodes and messages for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', type=int, default=1000, help='Nodes (and users) to create')
+        parser.add_argument('--messages', type=int, default=100000, help='Messages to create')
+        parser.add_argument('--prefix', default='GEN', help='Prefix of node names, ESP32 IDs and usernames')
+        parser.add_argument('--password', default='testpass123', help='Password of every generated user')
+        parser.add_argument('--online', type=float, default=0.3, help='Share of nodes that are ONLINE (0-1)')
+        parser.add_argument('--gateways', type=int, default=0, help='Number of nodes marked as gateways; the others are relayed by a random one')
+        parser.add_argument('--days', type=int, default=30, help='Spread messages over the last N days')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of the sender distribution')
+        parser.add_argument('--peak-hour', type=int, default=14, help='UTC hour with the most traffic')
+        parser.add_argument('--status-mix', help='Message status weights, e.g. DELIVERED=0.85,SENT=0.1,FAILED=0.05')
+        parser.add_argument('--type-mix', help='Message type weights, e.g. TEXT=0.9,ALERT=0.08,COMMAND=0.02')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Messages per transaction')
+        parser.add_argument(
+            '--executemany',
+            action='store_true',
+            help='Insert messages as plain rows with cursor.executemany() instead of bulk_create()',
+        )
+        parser.add_argument(
+            '--drop-indexes',
+            action='store_true',
+            help='SQLite: drop the message indexes during the load and rebuild them at the end',
+        )
+        parser.add_argument('--existing', action='store_true', help='Add messages between the existing nodes only')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible datasets')
+
+    def handle(self, *args, **options):
+        status_mix = _mix(options['status_mix'], dict(Message.STATUS_CHOICES)) if options['status_mix'] else DEFAULT_STATUS_MIX
+        type_mix = _mix(options['type_mix'], dict(Message.MESSAGE_TYPE_CHOICES)) if options['type_mix'] else DEFAULT_TYPE_MIX
+        if options['days'] <= 0:
+            raise CommandError('--days must be positive')
+
+        start = time.perf_counter()
+        if options['existing']:
+            node_ids = list(Node.objects.values_list('pk', flat=True))
+        else:
+            if Node.objects.filter(esp32_device_id__startswith=f"{options['prefix']}-").exists():
+                raise CommandError(f"Nodes with prefix {options['prefix']!r} exist already; use another --prefix or --existing.")
+            node_ids = create_fleet(
+                options['nodes'], prefix=options['prefix'], password=options['password'],
+                online=options['online'], gateways=options['gateways'], seed=options['seed'],
+                log=self.stdout.write if options['verbosity'] > 1 else None,
+            )
+            self.stdout.write(f'{len(node_ids)} nodes created in {time.perf_counter() - start:.1f}s')
+
+        if len(node_ids) < 2 and options['messages']:
+            raise CommandError('At least two nodes are needed to generate messages.')
+
+        messages_start = time.perf_counter()
+        written = create_messages(
+            node_ids, options['messages'], days=options['days'], zipf=options['zipf'],
+            peak_hour=options['peak_hour'], status_mix=status_mix, type_mix=type_mix,
+            chunk_size=options['chunk_size'], raw=options['executemany'],
+            drop_indexes=options['drop_indexes'], seed=options['seed'],
+            log=self.stdout.write if options['verbosity'] > 1 else None,
+        )
+        elapsed = time.perf_counter() - messages_start
+        self.stdout.write(f'{written} messages created in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f}/s)')
+        self.stdout.write(self.style.SUCCESS(f'Dataset ready in {time.perf_counter() - start:.1f}s.'))
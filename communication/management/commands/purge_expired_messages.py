@@ -0,0 +1,55 @@
+"""
+Django management command to delete expired messages in bounded batches.
+Usage: python manage.py purge_expired_messages [--batch-size N] [--loop --interval SECONDS]
+
+With --loop it keeps running as a background worker and purges every
+--interval seconds.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from communication.expiry import DEFAULT_BATCH_SIZE, expired_count, purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Deletes messages whose expires_at has passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help='Messages deleted per transaction',
+        )
+        parser.add_argument(
+            '--max-batches',
+            type=int,
+            default=None,
+            help='Stop after this many batches per run',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and purge periodically',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=60,
+            help='Seconds between purges when --loop is given',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            expired = expired_count()
+            purged = purge_expired(
+                batch_size=options['batch_size'],
+                max_batches=options['max_batches'],
+            )
+            self.stdout.write(
+                self.style.SUCCESS(f'Expired: {expired}, purged: {purged}, remaining: {expired_count()}')
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,93 @@
+"""
+Django management command to move direct messages into their receivers' message shards.
+Usage: python manage.py rebalance_shards [--node ESP32-ID ... [--to messages_N | --unpin]] [--dry-run]
+
+Without --node every misplaced node is moved: run it after changing
+MESSAGE_SHARDS or turning sharding on for a database that already holds
+messages. --to pins the given nodes to a shard (e.g. a busy node to a shard
+of its own) and moves their messages there; --unpin returns them to their
+hash-placed shard.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import Node
+from communication.rebalance import misplaced, move_messages
+from communication.sharding import message_shards, sharding_enabled
+
+
+class Command(BaseCommand):
+    help = "Moves direct messages to their receivers' message shards"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--node',
+            action='append',
+            default=[],
+            metavar='ESP32-ID',
+            help='Only move this node (repeatable)',
+        )
+        parser.add_argument(
+            '--to',
+            default=None,
+            metavar='ALIAS',
+            help='Pin the --node nodes to this shard first',
+        )
+        parser.add_argument(
+            '--unpin',
+            action='store_true',
+            help='Unpin the --node nodes first (back to hash placement)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='Messages moved per transaction',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list the moves',
+        )
+
+    def handle(self, *args, **options):
+        if not sharding_enabled():
+            raise CommandError('Message sharding is off. Set MESSAGE_SHARDS first.')
+        if (options['to'] or options['unpin']) and not options['node']:
+            raise CommandError('--to and --unpin need --node.')
+        if options['to'] and options['unpin']:
+            raise CommandError('Pass either --to or --unpin, not both.')
+        if options['to'] and options['to'] not in message_shards():
+            raise CommandError(f'Unknown shard {options["to"]}. Shards: {", ".join(message_shards())}')
+
+        node_ids = None
+        pins = {}
+        if options['node']:
+            nodes = dict(Node.objects.filter(esp32_device_id__in=options['node']).values_list('esp32_device_id', 'pk'))
+            unknown = set(options['node']) - set(nodes)
+            if unknown:
+                raise CommandError(f'Unknown nodes: {", ".join(sorted(unknown))}')
+            node_ids = list(nodes.values())
+            if options['to'] or options['unpin']:
+                pins = {node_id: options['to'] or '' for node_id in node_ids}
+                if not options['dry_run']:
+                    # Pinned before moving, so new messages already go to the new shard
+                    Node.objects.filter(pk__in=node_ids).update(message_shard=options['to'] or '')
+
+        moves = misplaced(node_ids, pins)
+        if options['dry_run']:
+            for node_id, source, target in moves:
+                self.stdout.write(f'Node {node_id}: {source} -> {target}')
+            self.stdout.write(f'{len(moves)} node(s) to move.')
+            return
+
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        start = time.perf_counter()
+        moved = 0
+        for node_id, source, target in moves:
+            self.stdout.write(f'Node {node_id}: {source} -> {target}')
+            moved += move_messages(node_id, source, target, options['batch_size'], log)
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {moved} messages of {len(moves)} node(s) in {time.perf_counter() - start:.1f}s.'
+        ))
@@ -0,0 +1,30 @@
+"""
+Django management command to rebuild the conversation and node activity summaries from the Message table.
+Usage: python manage.py rebuild_conversations
+
+Run it after loading messages in bulk outside the app, or if unread counts
+ever drift (e.g. after editing or deleting messages in the Django admin, or
+after a crash between a shard's commit and the default database's, see
+communication/sharding.py).
+Totals of purged messages are lost: the summaries then count the stored
+messages only.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from communication.activity import rebuild_activity
+from communication.conversations import rebuild_conversations
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-node conversation summaries, unread counters and activity totals'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        rows = rebuild_conversations()
+        nodes = rebuild_activity()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {rows} conversation rows and the activity of {nodes} nodes '
+            f'in {time.perf_counter() - start:.1f}s.'
+        ))
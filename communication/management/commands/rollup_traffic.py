@@ -0,0 +1,56 @@
+"""
+Django management command to add new messages to the hourly and daily traffic counters.
+Usage: python manage.py rollup_traffic [--loop --interval SECONDS] [--rebuild]
+
+Only messages past the stored watermark are read, so it is cheap to run
+often (e.g. every minute, or with --loop as a background worker). --rebuild
+drops all counters and recounts the messages still stored.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from communication.traffic import reset, rollup
+
+
+class Command(BaseCommand):
+    help = 'Rolls new messages up into the traffic analytics counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help="Messages aggregated per transaction (default: TRAFFIC['CHUNK_SIZE'])",
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Drop all counters and recount every stored message (purged messages are lost)',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep running and roll up periodically',
+        )
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=60,
+            help='Seconds between rollups when --loop is given',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            reset()
+            self.stdout.write('Traffic counters cleared.')
+        log = self.stdout.write if options['verbosity'] > 1 else None
+        while True:
+            start = time.perf_counter()
+            added = rollup(chunk_size=options['chunk_size'], log=log)
+            self.stdout.write(self.style.SUCCESS(
+                f'Rolled up {added} messages in {time.perf_counter() - start:.1f}s.'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
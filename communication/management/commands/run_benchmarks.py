@@ -0,0 +1,100 @@
+"""
+Django management command to run the benchmark suite (benchmarks/suite.py).
+Usage: python manage.py run_benchmarks [--sizes 10,1000,100000] [--scenarios home,api_get_inbox]
+                                       [--threshold 0.5] [--update-baseline]
+
+Every size runs against its own throwaway test database, never the configured
+one. Results are written to --output; when the baseline file exists they are
+compared with it and the command fails if any metric regressed by more than
+--threshold. --update-baseline stores the new results as the baseline instead.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from benchmarks import suite
+
+
+def _csv(value, convert=str):
+    return [convert(part.strip()) for part in value.split(',') if part.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks latency, query count and allocations of the pages and device API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default=','.join(str(size) for size in suite.DEFAULT_SIZES),
+            help='Comma-separated fleet sizes (number of nodes)',
+        )
+        parser.add_argument(
+            '--scenarios',
+            default=','.join(suite.SCENARIOS),
+            help=f'Comma-separated scenarios out of: {", ".join(suite.SCENARIOS)}',
+        )
+        parser.add_argument('--messages-per-node', type=int, default=10, help='Generated messages per node')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests before timing')
+        parser.add_argument('--seed', type=int, default=1, help='Random seed of the generated dataset')
+        parser.add_argument('--output', default=str(suite.DEFAULT_OUTPUT), help='Where to write the results JSON')
+        parser.add_argument('--baseline', default=str(suite.DEFAULT_BASELINE), help='Baseline results JSON')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.5,
+            help='Allowed relative growth of latency and allocations (0.5 = 50%%)',
+        )
+        parser.add_argument(
+            '--update-baseline',
+            action='store_true',
+            help='Save the results as the new baseline instead of comparing',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            sizes = _csv(options['sizes'], int)
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+        scenarios = _csv(options['scenarios'])
+        unknown = set(scenarios) - set(suite.SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+
+        setup_test_environment(debug=False)
+        try:
+            document = suite.run(
+                sizes, scenarios, messages_per_node=options['messages_per_node'], repeat=options['repeat'],
+                warmup=options['warmup'], seed=options['seed'], log=self.stdout.write,
+            )
+        finally:
+            teardown_test_environment()
+        suite.save(document, options['output'])
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if options['update_baseline']:
+            suite.save(document, options['baseline'])
+            self.stdout.write(self.style.SUCCESS(f"Baseline updated: {options['baseline']}"))
+            return
+        try:
+            baseline = suite.load(options['baseline'])
+        except FileNotFoundError:
+            self.stdout.write(self.style.WARNING('No baseline yet; run again with --update-baseline to create one.'))
+            return
+
+        # Sharded runs query every shard; compare only with a baseline of the same layout
+        shards = (document['meta']['message_shards'], baseline['meta'].get('message_shards', 0))
+        if shards[0] != shards[1]:
+            self.stdout.write(self.style.WARNING(
+                f'Not compared: this run used {shards[0]} message shards, the baseline {shards[1]}; '
+                'pass --baseline with a baseline of the same layout.'
+            ))
+            return
+
+        regressions = suite.compare(document, baseline, options['threshold'])
+        for size, scenario, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(f'{size} nodes, {scenario}: {metric} {before} -> {after}'))
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}.'))
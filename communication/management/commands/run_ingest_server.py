@@ -0,0 +1,54 @@
+"""
+Django management command to run the UDP/TCP gateway ingest server.
+Usage: python manage.py run_ingest_server [--host 127.0.0.1] [--udp-port 9750] [--tcp-port 9751]
+
+Pass 0 as a port to pick a free one, or --no-udp / --no-tcp to disable a
+transport. Stats are printed every --stats-interval seconds; Ctrl-C writes
+whatever is still queued and exits.
+"""
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from communication.ingest import IngestServer, IngestWriter, ingest_setting
+
+
+class Command(BaseCommand):
+    help = 'Accepts framed binary status updates and messages from gateways over UDP/TCP'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default=ingest_setting('HOST'), help='Address to listen on')
+        parser.add_argument('--udp-port', type=int, default=ingest_setting('UDP_PORT'), help='UDP port')
+        parser.add_argument('--tcp-port', type=int, default=ingest_setting('TCP_PORT'), help='TCP port')
+        parser.add_argument('--no-udp', action='store_true', help='Do not listen on UDP')
+        parser.add_argument('--no-tcp', action='store_true', help='Do not listen on TCP')
+        parser.add_argument('--batch-size', type=int, default=None, help='Records written per transaction')
+        parser.add_argument('--flush-interval-ms', type=int, default=None, help='Longest wait before writing a batch')
+        parser.add_argument('--stats-interval', type=float, default=10.0, help='Seconds between stats lines (0 to disable)')
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self.serve(options))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, options):
+        server = IngestServer(
+            host=options['host'],
+            udp_port=None if options['no_udp'] else options['udp_port'],
+            tcp_port=None if options['no_tcp'] else options['tcp_port'],
+            writer=IngestWriter(batch_size=options['batch_size'], flush_interval=options['flush_interval_ms']),
+        )
+        udp_port, tcp_port = await server.start()
+        self.stdout.write(self.style.SUCCESS(
+            f"Ingest server on {options['host']} (UDP: {udp_port or 'off'}, TCP: {tcp_port or 'off'})"
+        ))
+        try:
+            while True:
+                if options['stats_interval']:
+                    await asyncio.sleep(options['stats_interval'])
+                    self.stdout.write(', '.join(f'{key}: {value}' for key, value in sorted(server.stats.items())))
+                else:
+                    await asyncio.Event().wait()
+        finally:
+            await server.stop()
@@ -0,0 +1,85 @@
+"""
+Django management command to drive simulated devices against the ingest server.
+Usage: python manage.py simulate_devices [--devices 100] [--transport udp|tcp] [--batch 1] [--token TOKEN]
+
+Device IDs are taken from the node table. With device token auth enabled,
+pass a token with --token: the devices are then the token's node and, for a
+gateway, the nodes whose relay_gateway it is.
+"""
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from accounts.models import Node
+from accounts.tokens import verify_token
+from communication.device_sim import IngestClient, simulate_devices
+from communication.ingest import ingest_setting
+
+
+class Command(BaseCommand):
+    help = 'Sends heartbeats and messages from simulated devices to the ingest server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Ingest server address')
+        parser.add_argument('--port', type=int, default=None, help='Ingest server port (default: from settings)')
+        parser.add_argument('--transport', choices=['udp', 'tcp'], default='udp')
+        parser.add_argument('--token', default='', help='Device token (a gateway token relaying for the other devices when --devices > 1)')
+        parser.add_argument('--devices', type=int, default=100, help='Number of nodes to simulate')
+        parser.add_argument('--rounds', type=int, default=10, help='Heartbeat rounds')
+        parser.add_argument('--message-rate', type=float, default=0.2, help='Chance per round that a device also sends a message')
+        parser.add_argument('--batch', type=int, default=1, help='Records per frame (>1 simulates a gateway batching)')
+        parser.add_argument('--concurrency', type=int, default=50, help='Frames in flight at once')
+        parser.add_argument('--loss', type=float, default=0.0, help='Share of frames dropped before sending')
+        parser.add_argument('--timeout', type=float, default=1.0, help='Seconds to wait for an ACK before resending')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+
+    def handle(self, *args, **options):
+        nodes = Node.objects.order_by('pk')
+        if options['token']:
+            token_node = verify_token(options['token'])
+            if token_node is None:
+                raise CommandError('Invalid device token.')
+            nodes = nodes.filter(Q(pk=token_node) | Q(relay_gateway_id=token_node, relay_gateway__is_gateway=True))
+        device_ids = list(nodes.values_list('esp32_device_id', flat=True)[:options['devices']])
+        if not device_ids:
+            raise CommandError('No nodes found. Create some nodes first.')
+        port = options['port'] or ingest_setting('UDP_PORT' if options['transport'] == 'udp' else 'TCP_PORT')
+        client = IngestClient(
+            options['host'], port,
+            transport=options['transport'],
+            token=options['token'],
+            timeout=options['timeout'],
+            loss_rate=options['loss'],
+            seed=options['seed'],
+        )
+        results, client_stats = asyncio.run(self.run(client, device_ids, options))
+
+        seconds = results.pop('seconds')
+        records = results.pop('records')
+        self.stdout.write(', '.join(f'{key}: {value}' for key, value in sorted(results.items())))
+        self.stdout.write(
+            f"Frames: {client_stats['frames']}, retries: {client_stats['retries']}, "
+            f"dropped: {client_stats['dropped']}, timeouts: {client_stats['timeouts']}"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'{records} records from {len(device_ids)} devices in {seconds:.2f}s ({records / seconds:.0f} records/s)'
+        ))
+
+    async def run(self, client, device_ids, options):
+        try:
+            await client.connect()
+        except OSError as e:
+            raise CommandError(f'Cannot connect to the ingest server: {e}')
+        try:
+            results = await simulate_devices(
+                client, device_ids,
+                rounds=options['rounds'],
+                message_rate=options['message_rate'],
+                batch=options['batch'],
+                concurrency=options['concurrency'],
+                seed=options['seed'],
+            )
+        finally:
+            await client.close()
+        return results, client.stats
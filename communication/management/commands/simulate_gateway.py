@@ -0,0 +1,61 @@
+"""
+Django management command to run simulated gateways against the delivery queue.
+Usage: python manage.py simulate_gateway [--gateway ESP32-001] [--loss 0.2] [--rounds 10]
+
+With --virtual-clock each round advances a simulated clock by --interval
+seconds instead of sleeping, so retries and backoff play out instantly.
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.models import Node
+from communication.delivery import queue_stats
+from communication.gateway_sim import SimulatedGateway
+
+
+class Command(BaseCommand):
+    help = 'Relays queued messages through simulated gateway nodes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gateway', action='append', help='ESP32 device ID of a gateway (repeatable; default: all gateway nodes)')
+        parser.add_argument('--loss', type=float, default=0.2, help='Simulated packet loss rate (0-1)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Messages claimed per round')
+        parser.add_argument('--rounds', type=int, default=10, help='Number of rounds to run')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between rounds')
+        parser.add_argument('--virtual-clock', action='store_true', help='Advance a simulated clock instead of sleeping')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+
+    def handle(self, *args, **options):
+        gateways = Node.objects.filter(is_gateway=True)
+        if options['gateway']:
+            gateways = Node.objects.filter(esp32_device_id__in=options['gateway'])
+        gateways = list(gateways)
+        if not gateways:
+            raise CommandError('No gateway nodes found. Mark a node as a gateway or pass --gateway.')
+
+        simulators = [
+            SimulatedGateway(gateway, loss_rate=options['loss'], batch_size=options['batch_size'], seed=options['seed'])
+            for gateway in gateways
+        ]
+
+        now = timezone.now()
+        for round_number in range(1, options['rounds'] + 1):
+            for simulator in simulators:
+                result = simulator.run_once(now=now if options['virtual_clock'] else None)
+                self.stdout.write(
+                    f"Round {round_number} [{simulator.gateway.esp32_device_id}]: "
+                    f"claimed {result['claimed']}, delivered {result['delivered']}, lost {result['lost']}"
+                )
+            if options['virtual_clock']:
+                now += timedelta(seconds=options['interval'])
+            elif round_number < options['rounds']:
+                time.sleep(options['interval'])
+
+        stats = queue_stats(now=now if options['virtual_clock'] else None)
+        self.stdout.write(self.style.SUCCESS(
+            f"Queued: {stats['queued']}, due: {stats['due']}, "
+            f"delivered: {stats['delivered']}, failed: {stats['failed']}"
+        ))
@@ -0,0 +1,42 @@
+"""
+Django management command to train the preset dictionary of LoRa-encoded payloads.
+Usage: python manage.py train_payload_dictionary [--messages N] [--size BYTES]
+
+The dictionary is built from the newest stored messages (see
+communication/codec.py) and becomes the active one: payloads encoded from
+then on name it, devices fetch it from /api/codec/dictionary/. Older
+dictionaries are kept, so fragments already handed out still decode.
+Re-run it when the kind of traffic changes.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from communication.codec import train_from_messages
+
+
+class Command(BaseCommand):
+    help = 'Trains a new preset dictionary for LoRa payload compression'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages',
+            type=int,
+            default=None,
+            help="Newest messages to train on (default: PAYLOAD_CODEC['TRAINING_MESSAGES'])",
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=None,
+            help="Dictionary size in bytes (default: PAYLOAD_CODEC['DICTIONARY_SIZE'])",
+        )
+
+    def handle(self, *args, **options):
+        if options['size'] is not None and not 0 < options['size'] <= 32768:
+            raise CommandError('--size must be between 1 and 32768 bytes (the deflate window).')
+        dictionary = train_from_messages(options['messages'], options['size'])
+        if dictionary is None:
+            raise CommandError('No messages to train on.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Trained dictionary {dictionary.pk}: {len(dictionary.data)} bytes '
+            f'from {dictionary.sample_size} messages.'
+        ))
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_node_status_history'),
+        ('communication', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='is_broadcast',
+            field=models.BooleanField(default=False, help_text='Whether this message was sent to every node'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='receiver',
+            field=models.ForeignKey(blank=True, help_text='The node that should receive this message (empty for group/broadcast messages)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='received_messages', to='accounts.node'),
+        ),
+        migrations.CreateModel(
+            name='NodeGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text="Group name used as a message target (e.g., 'gates', 'hilltop')", max_length=100, unique=True)),
+                ('description', models.TextField(blank=True, help_text='Optional description of the group')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('members', models.ManyToManyField(blank=True, help_text='Nodes that receive messages sent to this group', related_name='node_groups', to='accounts.node')),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='group',
+            field=models.ForeignKey(blank=True, help_text='The group this message was sent to, if any', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='messages', to='communication.nodegroup'),
+        ),
+        migrations.CreateModel(
+            name='MessageRecipient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('SENT', 'Sent'), ('DELIVERED', 'Delivered')], default='SENT', max_length=10)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='communication.message')),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_deliveries', to='accounts.node')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('node', 'message'), name='unique_message_recipient')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_node_status_history'),
+        ('communication', '0002_group_messaging'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='communicati_receive_b100d8_idx',
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, help_text='When this message stops being served to devices (empty = never)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='message_type',
+            field=models.CharField(choices=[('TEXT', 'Text'), ('ALERT', 'Alert'), ('COMMAND', 'Command')], default='TEXT', help_text='Type of message', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', '-created_at', 'expires_at'], name='message_inbox_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('expires_at__isnull', False)), fields=['expires_at'], name='message_expires_at_idx'),
+        ),
+    ]
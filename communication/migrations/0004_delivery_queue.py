@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_node_is_gateway'),
+        ('communication', '0003_message_expiry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Number of times this message was handed to a gateway for relaying'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='gateway',
+            field=models.ForeignKey(blank=True, help_text='The gateway node that last took this message for relaying', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='relayed_messages', to='accounts.node'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='last_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='When this message was last handed to a gateway', null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, help_text='When the delivery scheduler should next hand this message to a gateway', null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='status',
+            field=models.CharField(choices=[('SENT', 'Sent'), ('DELIVERED', 'Delivered'), ('FAILED', 'Failed')], default='SENT', help_text='Delivery status', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='messagerecipient',
+            name='status',
+            field=models.CharField(choices=[('SENT', 'Sent'), ('DELIVERED', 'Delivered'), ('FAILED', 'Failed')], default='SENT', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('next_attempt_at__isnull', False), ('status', 'SENT')), fields=['next_attempt_at'], name='message_delivery_queue_idx'),
+        ),
+    ]
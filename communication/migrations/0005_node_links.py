@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_node_directory_indexes'),
+        ('communication', '0004_delivery_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quality', models.FloatField(help_text='Estimated packet delivery ratio (0-1), smoothed over observations; 0 = expired')),
+                ('rssi', models.SmallIntegerField(blank=True, help_text='Last reported RSSI in dBm', null=True)),
+                ('snr', models.FloatField(blank=True, help_text='Last reported SNR in dB', null=True)),
+                ('observations', models.PositiveIntegerField(default=0)),
+                ('last_heard', models.DateTimeField(help_text='When this link was last observed')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source', models.ForeignKey(help_text='The transmitting node', on_delete=django.db.models.deletion.CASCADE, related_name='links_out', to='accounts.node')),
+                ('target', models.ForeignKey(help_text='The node that heard it', on_delete=django.db.models.deletion.CASCADE, related_name='links_in', to='accounts.node')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['updated_at'], name='node_link_updated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('source', 'target'), name='unique_node_link')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Summaries of the messages already stored; see communication/conversations.py
+POPULATE_SQL = """
+INSERT INTO communication_conversation (node_id, peer_id, last_message_id, last_message_at, unread_count)
+SELECT node_id, peer_id, MAX(last_id), MAX(last_at), SUM(unread) FROM (
+    SELECT sender_id AS node_id, receiver_id AS peer_id, MAX(id) AS last_id, MAX(created_at) AS last_at,
+           0 AS unread
+    FROM communication_message WHERE receiver_id IS NOT NULL GROUP BY sender_id, receiver_id
+    UNION ALL
+    SELECT receiver_id, sender_id, MAX(id), MAX(created_at), SUM(CASE WHEN status = 'SENT' THEN 1 ELSE 0 END)
+    FROM communication_message WHERE receiver_id IS NOT NULL GROUP BY receiver_id, sender_id
+) AS directions
+GROUP BY node_id, peer_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_node_directory_indexes'),
+        ('communication', '0005_node_links'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_id', models.BigIntegerField(blank=True, help_text='Newest message in either direction', null=True)),
+                ('last_message_at', models.DateTimeField(help_text='When the newest message was created')),
+                ('unread_count', models.PositiveIntegerField(default=0, help_text='Messages from the peer not acknowledged yet (status SENT)')),
+                ('node', models.ForeignKey(help_text='The node this summary belongs to', on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to='accounts.node')),
+                ('peer', models.ForeignKey(help_text='The other node of the conversation', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.node')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['node', '-last_message_at'], name='conversation_recent_idx')],
+                'constraints': [models.UniqueConstraint(fields=('node', 'peer'), name='unique_conversation')],
+            },
+        ),
+        migrations.RunSQL(POPULATE_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_node_directory_indexes'),
+        ('communication', '0006_conversations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FleetTraffic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('H', 'Hour'), ('D', 'Day')], max_length=1)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day (UTC)')),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('payload_length', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period', 'bucket'), name='unique_fleet_traffic')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TrafficCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('H', 'Hour'), ('D', 'Day')], max_length=1)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour or day (UTC)')),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('payload_length', models.PositiveBigIntegerField(default=0, help_text='Total length of the message payloads in characters')),
+                ('receiver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='traffic_received', to='accounts.node')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='traffic_sent', to='accounts.node')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['receiver', 'period', 'bucket'], name='traffic_receiver_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sender', 'period', 'bucket', 'receiver'), name='unique_traffic_counter')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 02:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communication', '0007_traffic_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trafficrollup',
+            name='database',
+            field=models.CharField(default='default', max_length=100, unique=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_node_message_shard'),
+        ('communication', '0009_message_outbox_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayloadDictionary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField(help_text='Dictionary bytes, most frequent strings last')),
+                ('sample_size', models.PositiveIntegerField(help_text='Messages the dictionary was trained on')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MessageFragment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.PositiveIntegerField(help_text='Transfer id chosen by the sender')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveSmallIntegerField(help_text='Fragments in the transfer')),
+                ('data', models.BinaryField()),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sender', models.ForeignKey(help_text='The node that sent the long message', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='accounts.node')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['received_at'], name='message_fragment_received_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sender', 'tag', 'index'), name='unique_message_fragment')],
+            },
+        ),
+    ]
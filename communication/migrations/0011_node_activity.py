@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-19 03:15
+
+import logging
+from collections import defaultdict
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, migrations, models
+from django.db.models import Count, Max
+
+logger = logging.getLogger(__name__)
+
+
+def backfill(apps, schema_editor):
+    """
+    Count the messages already stored into Conversation.message_count and
+    NodeActivity, over the default database and every message shard (see
+    communication/sharding.py). Frozen copy of rebuild_conversations' counts
+    and rebuild_activity(), on the models as of this migration.
+    """
+    if schema_editor.connection.alias != DEFAULT_DB_ALIAS:
+        return
+    Message = apps.get_model('communication', 'Message')
+    Conversation = apps.get_model('communication', 'Conversation')
+    NodeActivity = apps.get_model('communication', 'NodeActivity')
+
+    pairs = defaultdict(int)
+    totals = defaultdict(lambda: [0, 0, None])
+    for using in [DEFAULT_DB_ALIAS, *getattr(settings, 'MESSAGE_SHARDS', [])]:
+        if Message._meta.db_table not in connections[using].introspection.table_names():
+            logger.warning(
+                'Database %s has no message table yet, so its messages are not counted; if it holds '
+                'messages, run "manage.py rebuild_conversations" once it is migrated.', using,
+            )
+            continue
+        messages = Message.objects.using(using).order_by()
+        direct = messages.filter(receiver__isnull=False)
+        for sender_id, receiver_id, count in direct.values_list('sender_id', 'receiver_id').annotate(Count('pk')):
+            pairs[sender_id, receiver_id] += count
+            pairs[receiver_id, sender_id] += count
+        for column, field, queryset in ((0, 'sender_id', messages), (1, 'receiver_id', direct)):
+            for node_id, count, last_at in queryset.values_list(field).annotate(Count('pk'), Max('created_at')):
+                row = totals[node_id]
+                row[column] += count
+                if row[2] is None or last_at > row[2]:
+                    row[2] = last_at
+
+    conversations = list(Conversation.objects.only('pk', 'node_id', 'peer_id', 'last_message_at'))
+    # node -> (message_count, last_message_at, peer) of its busiest conversation
+    busiest = {}
+    for conversation in conversations:
+        count = conversation.message_count = pairs.get((conversation.node_id, conversation.peer_id), 0)
+        best = busiest.get(conversation.node_id)
+        if count and (best is None or (count, conversation.last_message_at) > best[:2]):
+            busiest[conversation.node_id] = (count, conversation.last_message_at, conversation.peer_id)
+    Conversation.objects.bulk_update(conversations, ['message_count'], batch_size=2000)
+
+    NodeActivity.objects.bulk_create([
+        NodeActivity(
+            node_id=node_id,
+            sent_count=sent,
+            received_count=received,
+            last_message_at=last_at,
+            busiest_peer_id=busiest.get(node_id, (0, None, None))[2],
+            busiest_peer_count=busiest.get(node_id, (0, None, None))[0],
+        )
+        for node_id, (sent, received, last_at) in totals.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_node_message_shard'),
+        ('communication', '0010_payload_codec'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, help_text='Direct messages exchanged in both directions'),
+        ),
+        migrations.CreateModel(
+            name='NodeActivity',
+            fields=[
+                ('node', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='activity', serialize=False, to='accounts.node')),
+                ('sent_count', models.PositiveIntegerField(default=0, help_text='Messages sent, including group and broadcast messages')),
+                ('received_count', models.PositiveIntegerField(default=0, help_text='Direct messages received')),
+                ('last_message_at', models.DateTimeField(blank=True, help_text='Newest message sent or received', null=True)),
+                ('busiest_peer_count', models.PositiveIntegerField(default=0)),
+                ('version', models.PositiveBigIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('busiest_peer', models.ForeignKey(blank=True, help_text='The node with the most direct messages exchanged', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='accounts.node')),
+            ],
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,43 @@
 """
 Models for communication app - Messages
 """
-from django.db import models
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import models, router, transaction
+from django.utils import timezone
 from accounts.models import Node
 
 
+class NodeGroup(models.Model):
+    """
+    A named set of nodes that can be addressed with a single message.
+    """
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        help_text="Group name used as a message target (e.g., 'gates', 'hilltop')"
+    )
+    description = models.TextField(
+        blank=True,
+        help_text="Optional description of the group"
+    )
+    members = models.ManyToManyField(
+        Node,
+        blank=True,
+        related_name='node_groups',
+        help_text="Nodes that receive messages sent to this group"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
 class Message(models.Model):
     """
     Represents a message sent from one node to another.
@@ -12,10 +45,13 @@ class Message(models.Model):
     STATUS_CHOICES = [
         ('SENT', 'Sent'),
         ('DELIVERED', 'Delivered'),
+        ('FAILED', 'Failed'),
     ]
 
     MESSAGE_TYPE_CHOICES = [
         ('TEXT', 'Text'),
+        ('ALERT', 'Alert'),
+        ('COMMAND', 'Command'),
     ]
 
     sender = models.ForeignKey(
@@ -27,8 +63,22 @@ class Message(models.Model):
     receiver = models.ForeignKey(
         Node,
         on_delete=models.CASCADE,
+        null=True,
+        blank=True,
         related_name='received_messages',
-        help_text="The node that should receive this message"
+        help_text="The node that should receive this message (empty for group/broadcast messages)"
+    )
+    group = models.ForeignKey(
+        NodeGroup,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='messages',
+        help_text="The group this message was sent to, if any"
+    )
+    is_broadcast = models.BooleanField(
+        default=False,
+        help_text="Whether this message was sent to every node"
     )
     content = models.TextField(
         help_text="The message content/payload"
@@ -45,6 +95,33 @@ class Message(models.Model):
         default='SENT',
         help_text="Delivery status"
     )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        help_text="Number of times this message was handed to a gateway for relaying"
+    )
+    next_attempt_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When the delivery scheduler should next hand this message to a gateway"
+    )
+    last_attempt_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When this message was last handed to a gateway"
+    )
+    gateway = models.ForeignKey(
+        Node,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='relayed_messages',
+        help_text="The gateway node that last took this message for relaying"
+    )
+    expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When this message stops being served to devices (empty = never)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -52,9 +129,388 @@ class Message(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['-created_at']),
-            models.Index(fields=['receiver', '-created_at']),
+            # Inbox scan; expires_at is in the index so expired rows are skipped without row lookups
+            models.Index(fields=['receiver', '-created_at', 'expires_at'], name='message_inbox_expiry_idx'),
+            # Outbox: a node's newest sent messages without sorting all of them (once per shard)
+            models.Index(fields=['sender', '-created_at'], name='message_outbox_idx'),
+            # Purge scan; only messages that can expire are indexed
+            models.Index(
+                fields=['expires_at'],
+                name='message_expires_at_idx',
+                condition=models.Q(expires_at__isnull=False),
+            ),
+            # Delivery queue; only messages still waiting for a relay are indexed
+            models.Index(
+                fields=['next_attempt_at'],
+                name='message_delivery_queue_idx',
+                condition=models.Q(status='SENT', next_attempt_at__isnull=False),
+            ),
+        ]
+
+    def save(self, *args, using=None, **kwargs):
+        if self._state.adding:
+            self.apply_defaults()
+            if getattr(settings, 'MESSAGE_SHARDS', None):
+                # New messages go where the router places them (the receiver's shard,
+                # see sharding.py), also when QuerySet.create() passes its database
+                using = router.db_for_write(Message, instance=self)
+        using = using or router.db_for_write(Message, instance=self)
+        # One transaction with the post_save handlers, which update the conversation
+        # summaries in the default database
+        with transaction.atomic(savepoint=False), transaction.atomic(using=using, savepoint=False):
+            super().save(*args, using=using, **kwargs)
+
+    def apply_defaults(self, now=None):
+        """
+        Apply the per-type default TTL when no explicit expiry was given, and
+        queue new direct messages for gateway relaying. Called by save() for
+        new messages; call it yourself before bulk_create().
+        """
+        now = now or timezone.now()
+        if self.expires_at is None:
+            ttl = default_ttl(self.message_type)
+            if ttl:
+                self.expires_at = now + ttl
+        if self.receiver_id and self.status == 'SENT' and self.next_attempt_at is None:
+            self.next_attempt_at = now
+
+    def __str__(self):
+        return f"Message from {self.sender.node_name} to {self.target_display} ({self.created_at})"
+
+    @property
+    def target_display(self):
+        """Human-readable target: the receiver node, the group, or all nodes."""
+        if self.receiver_id:
+            return self.receiver.node_name
+        if self.is_broadcast:
+            return 'All nodes'
+        if self.group_id:
+            return f'Group: {self.group.name}'
+        return 'Unknown'
+
+
+def default_ttl(message_type):
+    """
+    Return the default time-to-live for a message type as a timedelta, or None.
+    Configured in seconds via settings.MESSAGE_TYPE_TTL.
+    """
+    seconds = getattr(settings, 'MESSAGE_TYPE_TTL', {}).get(message_type)
+    return timedelta(seconds=seconds) if seconds else None
+
+
+def unexpired(now=None, prefix=''):
+    """Q filter matching messages that have not expired (``prefix`` for related lookups)."""
+    now = now or timezone.now()
+    return (
+        models.Q(**{f'{prefix}expires_at__isnull': True})
+        | models.Q(**{f'{prefix}expires_at__gt': now})
+    )
+
+
+@contextmanager
+def preserve_timestamps():
+    """
+    Switch off auto_now on Message.created_at/updated_at, so bulk_create()
+    keeps the times set on the instances (generated or copied messages).
+    """
+    fields = [Message._meta.get_field('created_at'), Message._meta.get_field('updated_at')]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class MessageRecipient(models.Model):
+    """
+    Per-recipient delivery state for group and broadcast messages.
+    The Message itself is stored once; one slim row per recipient node is bulk-created.
+    """
+    message = models.ForeignKey(
+        Message,
+        on_delete=models.CASCADE,
+        related_name='recipients'
+    )
+    node = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='group_deliveries'
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=Message.STATUS_CHOICES,
+        default='SENT'
+    )
+
+    class Meta:
+        constraints = [
+            # Also serves the inbox scan: WHERE node_id = ? ORDER BY message_id DESC
+            models.UniqueConstraint(fields=['node', 'message'], name='unique_message_recipient'),
+        ]
+
+    def __str__(self):
+        return f"Message {self.message_id} -> node {self.node_id} ({self.status})"
+
+
+class Conversation(models.Model):
+    """
+    Summary of the direct messages ``node`` exchanged with one ``peer``, one
+    row per node and peer. Kept in step with message inserts and
+    acknowledgements by communication/conversations.py, so conversation
+    lists and unread badges never group over the Message table.
+    """
+    node = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='conversations',
+        help_text="The node this summary belongs to"
+    )
+    peer = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='+',
+        help_text="The other node of the conversation"
+    )
+    # A plain id, not a foreign key, so purging messages stays a fast delete
+    last_message_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text="Newest message in either direction"
+    )
+    last_message_at = models.DateTimeField(help_text="When the newest message was created")
+    unread_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Messages from the peer not acknowledged yet (status SENT)"
+    )
+    message_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Direct messages exchanged in both directions"
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['node', 'peer'], name='unique_conversation'),
+        ]
+        indexes = [
+            # Conversation list: WHERE node_id = ? ORDER BY last_message_at DESC
+            models.Index(fields=['node', '-last_message_at'], name='conversation_recent_idx'),
         ]
 
     def __str__(self):
-        return f"Message from {self.sender.node_name} to {self.receiver.node_name} ({self.created_at})"
+        return f"Conversation {self.node_id} <-> {self.peer_id} ({self.unread_count} unread)"
+
 
+class NodeActivity(models.Model):
+    """
+    Message totals of one node, kept in step with message inserts by
+    communication/activity.py so node pages never count over the Message
+    table. ``version`` goes up whenever anything shown about the node's
+    messages changes; it backs the node detail page's ETag.
+    """
+    node = models.OneToOneField(
+        Node,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='activity'
+    )
+    sent_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Messages sent, including group and broadcast messages"
+    )
+    received_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Direct messages received"
+    )
+    last_message_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Newest message sent or received"
+    )
+    busiest_peer = models.ForeignKey(
+        Node,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        help_text="The node with the most direct messages exchanged"
+    )
+    busiest_peer_count = models.PositiveIntegerField(default=0)
+    version = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Activity of {self.node_id}: {self.sent_count} sent, {self.received_count} received"
+
+
+class NodeLink(models.Model):
+    """
+    A directed radio link: ``target`` has heard ``source``.
+    Built from neighbor reports and relayed packet paths (see communication/topology.py).
+    """
+    source = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='links_out',
+        help_text="The transmitting node"
+    )
+    target = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='links_in',
+        help_text="The node that heard it"
+    )
+    quality = models.FloatField(
+        help_text="Estimated packet delivery ratio (0-1), smoothed over observations; 0 = expired"
+    )
+    rssi = models.SmallIntegerField(
+        null=True,
+        blank=True,
+        help_text="Last reported RSSI in dBm"
+    )
+    snr = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Last reported SNR in dB"
+    )
+    observations = models.PositiveIntegerField(default=0)
+    last_heard = models.DateTimeField(help_text="When this link was last observed")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'target'], name='unique_node_link'),
+        ]
+        indexes = [
+            # Workers pick up links changed by other processes since their last sync
+            models.Index(fields=['updated_at'], name='node_link_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"Link {self.source_id} -> {self.target_id} ({self.quality:.2f})"
+
+
+class TrafficCounter(models.Model):
+    """
+    Direct messages from ``sender`` to ``receiver`` created in one hour or
+    day (``bucket`` is the bucket's start, UTC). Written by the traffic
+    rollup (see communication/traffic.py); outlives purged messages.
+    """
+    HOUR = 'H'
+    DAY = 'D'
+    PERIOD_CHOICES = [
+        (HOUR, 'Hour'),
+        (DAY, 'Day'),
+    ]
+
+    sender = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='traffic_sent'
+    )
+    receiver = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='traffic_received'
+    )
+    period = models.CharField(max_length=1, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the hour or day (UTC)")
+    messages = models.PositiveIntegerField(default=0)
+    payload_length = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Total length of the message payloads in characters"
+    )
+
+    class Meta:
+        constraints = [
+            # Also serves per-sender charts: WHERE sender_id = ? AND period = ? AND bucket >= ?
+            models.UniqueConstraint(
+                fields=['sender', 'period', 'bucket', 'receiver'], name='unique_traffic_counter'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['receiver', 'period', 'bucket'], name='traffic_receiver_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.sender_id} -> {self.receiver_id} {self.period} {self.bucket}: {self.messages}"
+
+
+class FleetTraffic(models.Model):
+    """
+    All messages (direct, group and broadcast) created in one hour or day,
+    fleet-wide, so a 30-day chart reads 720 hourly rows at most.
+    """
+    period = models.CharField(max_length=1, choices=TrafficCounter.PERIOD_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the hour or day (UTC)")
+    messages = models.PositiveIntegerField(default=0)
+    payload_length = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period', 'bucket'], name='unique_fleet_traffic'),
+        ]
+
+    def __str__(self):
+        return f"Fleet {self.period} {self.bucket}: {self.messages}"
+
+
+class TrafficRollup(models.Model):
+    """
+    Watermark of the traffic rollup: messages up to ``last_message_id`` are
+    counted. One row per message database (see communication/sharding.py).
+    """
+    database = models.CharField(max_length=100, unique=True, default='default')
+    last_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Traffic of {self.database} rolled up to message {self.last_message_id}"
+
+
+class PayloadDictionary(models.Model):
+    """
+    A preset compression dictionary for message payloads sent over LoRa,
+    trained from stored messages by ``manage.py train_payload_dictionary``
+    (see communication/codec.py). The newest one is used for encoding;
+    encoded payloads name theirs by id, so older ones stay decodable.
+    """
+    data = models.BinaryField(help_text="Dictionary bytes, most frequent strings last")
+    sample_size = models.PositiveIntegerField(help_text="Messages the dictionary was trained on")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Payload dictionary {self.pk} ({len(self.data)} bytes, {self.sample_size} messages)"
+
+
+class MessageFragment(models.Model):
+    """
+    A fragment of a long message that a gateway heard over LoRa and submitted,
+    kept until every fragment of the transfer has arrived (see
+    communication/codec.py). Transfers are identified by sender and ``tag``.
+    """
+    sender = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name='+',
+        help_text="The node that sent the long message"
+    )
+    tag = models.PositiveIntegerField(help_text="Transfer id chosen by the sender")
+    index = models.PositiveSmallIntegerField()
+    count = models.PositiveSmallIntegerField(help_text="Fragments in the transfer")
+    data = models.BinaryField()
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sender', 'tag', 'index'], name='unique_message_fragment'),
+        ]
+        indexes = [
+            # Incomplete transfers are dropped after PAYLOAD_CODEC['FRAGMENT_TTL']
+            models.Index(fields=['received_at'], name='message_fragment_received_idx'),
+        ]
+
+    def __str__(self):
+        return f"Fragment {self.index + 1}/{self.count} of transfer {self.tag} from {self.sender_id}"
@@ -0,0 +1,218 @@
+"""
+Per-device token-bucket rate limiting for the ESP32 API endpoints.
+
+Each (endpoint, esp32_device_id) pair owns a bucket that refills at ``rate``
+tokens per second up to ``burst`` tokens; every request takes one token. The
+device is the one the request's token belongs to (a gateway's relayed
+requests share the gateway's buckets).
+Buckets live in process memory by default (O(1) per request, bounded by
+MAX_ENTRIES), or in a Django cache backend so several worker processes share
+them. Limits are configured in settings.DEVICE_RATE_LIMIT.
+"""
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+DEFAULT_CONFIG = {
+    'ENABLED': True,
+    'BACKEND': 'memory',
+    'CACHE_ALIAS': 'default',
+    'MAX_ENTRIES': 200000,
+    'DEFAULT': {'rate': 1.0, 'burst': 10},
+    'ENDPOINTS': {},
+    'NODES': {},
+}
+
+# Request body fields that carry the calling device's ID, per endpoint style
+DEVICE_ID_FIELDS = ('esp32_device_id', 'from_esp32_device_id', 'gateway_esp32_device_id')
+
+
+def _config(key):
+    return getattr(settings, 'DEVICE_RATE_LIMIT', {}).get(key, DEFAULT_CONFIG[key])
+
+
+def _take(state, rate, burst, now):
+    """
+    Refill a bucket ``state`` (tokens, last_refill) or None for a new bucket,
+    and take one token. Returns (new state, allowed, retry_after_seconds).
+    """
+    if state is None:
+        tokens = burst
+    else:
+        tokens, last = state
+        tokens = min(burst, tokens + (now - last) * rate)
+
+    if tokens >= 1:
+        return (tokens - 1, now), True, 0
+    return (tokens, now), False, math.ceil((1 - tokens) / rate) if rate > 0 else 60
+
+
+class MemoryTokenBucket:
+    """
+    In-process buckets stored as ``key -> (tokens, last_refill)``.
+    When MAX_ENTRIES is reached the least recently used bucket is dropped; a
+    dropped bucket simply starts full again, so memory stays bounded.
+    A lock serializes requests from the threads of one process.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key, rate, burst, now=None):
+        """
+        Take one token from ``key``'s bucket.
+        Returns (allowed, retry_after_seconds).
+        """
+        now = time.monotonic() if now is None else now
+        buckets = self.buckets
+        with self.lock:
+            state, allowed, retry_after = _take(buckets.get(key), rate, burst, now)
+            if key in buckets:
+                buckets.move_to_end(key)
+            elif len(buckets) >= self.max_entries:
+                buckets.popitem(last=False)
+            buckets[key] = state
+        return allowed, retry_after
+
+
+class CacheTokenBucket:
+    """
+    Buckets stored in a Django cache so all worker processes share them.
+    Read-modify-write is not atomic, so concurrent requests from one device
+    may occasionally get an extra token; that is fine for flood protection.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def hit(self, key, rate, burst, now=None):
+        # Wall clock, since monotonic clocks are not comparable across processes
+        now = time.time() if now is None else now
+        state, allowed, retry_after = _take(self.cache.get(f'ratelimit:{key}'), rate, burst, now)
+        # Expire once the bucket would be full again anyway
+        timeout = max(int(burst / rate) + 1, 1) if rate > 0 else None
+        self.cache.set(f'ratelimit:{key}', state, timeout)
+        return allowed, retry_after
+
+
+_limiter = None
+
+
+def get_limiter():
+    """Return the process-wide bucket store for the configured backend."""
+    global _limiter
+    if _limiter is None:
+        if _config('BACKEND') == 'cache':
+            _limiter = CacheTokenBucket(_config('CACHE_ALIAS'))
+        else:
+            _limiter = MemoryTokenBucket(_config('MAX_ENTRIES'))
+    return _limiter
+
+
+def reset_limiter():
+    """Forget all in-process buckets (e.g. after changing settings)."""
+    global _limiter
+    _limiter = None
+
+
+def limit_for(endpoint, device_id):
+    """Return (rate, burst) for ``endpoint``, with per-node overrides applied."""
+    limit = _config('NODES').get(device_id, {}).get(endpoint) \
+        or _config('ENDPOINTS').get(endpoint) \
+        or _config('DEFAULT')
+    return float(limit['rate']), float(limit['burst'])
+
+
+def allow(endpoint, device_id):
+    """
+    Take one token from ``device_id``'s bucket for ``endpoint``.
+    Returns (allowed, retry_after_seconds); always allowed when disabled.
+    """
+    if not _config('ENABLED'):
+        return True, 0
+    rate, burst = limit_for(endpoint, device_id)
+    return get_limiter().hit(f'{endpoint}:{device_id}', rate, burst)
+
+
+async def aallow(endpoint, device_id):
+    """
+    Async version of allow(). In-process buckets are checked inline; the
+    cache backend is called on a worker thread.
+    """
+    if _config('ENABLED') and _config('BACKEND') == 'cache':
+        return await sync_to_async(allow)(endpoint, device_id)
+    return allow(endpoint, device_id)
+
+
+def _limited(retry_after):
+    response = JsonResponse({'error': 'Rate limit exceeded'}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def device_id_from_request(request, kwargs):
+    """
+    The calling device's ESP32 ID: the device the token belongs to, so a
+    token cannot spend another device's bucket by naming it. Without device
+    authentication, the ID in the URL or the JSON body.
+    """
+    if getattr(request, 'device_esp32_id', None):
+        return request.device_esp32_id
+    if 'esp32_device_id' in kwargs:
+        return kwargs['esp32_device_id']
+    try:
+        data = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    for field in DEVICE_ID_FIELDS:
+        if data.get(field):
+            return str(data[field])
+    return None
+
+
+def device_rate_limit(endpoint):
+    """
+    Decorator limiting a device API view per esp32_device_id.
+    Requests over the limit get 429 with a Retry-After header.
+    Requests without a device ID fall through; the view rejects them anyway.
+    Works for both sync and async views.
+    """
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def async_wrapped(request, *args, **kwargs):
+                device_id = device_id_from_request(request, kwargs) if _config('ENABLED') else None
+                if device_id is not None:
+                    allowed, retry_after = await aallow(endpoint, device_id)
+                    if not allowed:
+                        return _limited(retry_after)
+                return await view_func(request, *args, **kwargs)
+            return async_wrapped
+
+        @wraps(view_func)
+        def wrapped(request, *args, **kwargs):
+            if not _config('ENABLED'):
+                return view_func(request, *args, **kwargs)
+
+            device_id = device_id_from_request(request, kwargs)
+            if device_id is None:
+                return view_func(request, *args, **kwargs)
+
+            allowed, retry_after = allow(endpoint, device_id)
+            if not allowed:
+                return _limited(retry_after)
+            return view_func(request, *args, **kwargs)
+        return wrapped
+    return decorator
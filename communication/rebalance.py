@@ -0,0 +1,101 @@
+"""
+Moving received direct messages between message databases (see sharding.py).
+
+A node's messages are misplaced when they are not in the database its
+receiver maps to: after pinning the node to another shard, after changing
+the number of shards, or when sharding is turned on for a database that
+already holds direct messages. move_messages() copies them in batches:
+
+1. copy the batch into the target with new ids from the target's range
+   (messages copied by an interrupted run, same sender, time and content,
+   are reused instead of copied twice)
+2. in one transaction on the source and the default database, take the
+   counted ones out of the traffic counters (the target's rollup counts
+   them again), point conversation summaries at the copies and delete the
+   originals
+
+Unread counts do not change: the messages are still there, with new ids.
+A gateway acknowledging a message by its old id while it moves gets no
+match and the message is relayed again.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from .conversations import replace_last_messages
+from .dashboard_cache import bump_recent_messages
+from .models import Message, preserve_timestamps
+from .sharding import atomic, message_databases, placer, shard_for_node
+from .traffic import uncount
+
+
+def misplaced(node_ids=None, pins=None):
+    """
+    (node id, source database, target database) for every receiver with
+    direct messages outside its database, limited to ``node_ids`` if given.
+    ``pins`` ({node id: shard or ''}) overrides the stored pins.
+    """
+    place = placer()
+    pins = pins or {}
+    moves = []
+    for using in message_databases():
+        receivers = Message.objects.using(using).filter(receiver__isnull=False)
+        if node_ids is not None:
+            receivers = receivers.filter(receiver_id__in=node_ids)
+        for node_id in receivers.order_by().values_list('receiver_id', flat=True).distinct():
+            target = shard_for_node(node_id, pins[node_id]) if node_id in pins else place(node_id)
+            if target != using:
+                moves.append((node_id, using, target))
+    return moves
+
+
+def move_messages(node_id, source, target, batch_size=2000, log=None):
+    """
+    Move the direct messages received by node ``node_id`` from database
+    ``source`` to ``target``. Returns the number of messages moved.
+    """
+    moved = 0
+    while True:
+        batch = list(Message.objects.using(source).filter(receiver_id=node_id).order_by('pk')[:batch_size])
+        if not batch:
+            break
+        old_ids = [message.pk for message in batch]
+
+        # Copies left behind by an interrupted move
+        existing = defaultdict(list)
+        for pk, sender_id, created_at, content in (
+            Message.objects.using(target)
+            .filter(
+                receiver_id=node_id,
+                created_at__gte=min(message.created_at for message in batch),
+                created_at__lte=max(message.created_at for message in batch),
+            )
+            .values_list('pk', 'sender_id', 'created_at', 'content')
+        ):
+            existing[(sender_id, created_at, content)].append(pk)
+
+        new_ids = {}
+        copies = []
+        for message in batch:
+            copied = existing.get((message.sender_id, message.created_at, message.content))
+            if copied:
+                new_ids[message.pk] = copied.pop()
+            else:
+                copies.append((message.pk, message))
+        for _, message in copies:
+            message.pk = None
+            message._state.adding = True
+        with transaction.atomic(using=target), preserve_timestamps():
+            Message.objects.using(target).bulk_create([message for _, message in copies])
+        new_ids.update((old_id, message.pk) for old_id, message in copies)
+
+        with atomic(source):
+            uncount(source, old_ids)
+            replace_last_messages(node_id, new_ids)
+            Message.objects.using(source).filter(pk__in=old_ids).delete()
+        moved += len(batch)
+        if log:
+            log(f'  {moved} messages moved')
+    if moved:
+        bump_recent_messages()
+    return moved
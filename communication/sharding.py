@@ -0,0 +1,277 @@
+"""
+Optional horizontal sharding of direct messages by receiver.
+
+settings.MESSAGE_SHARDS lists extra database aliases (e.g. one SQLite file
+each). When it is set, every direct message is stored in its receiver's
+shard: the one the node is pinned to (``Node.message_shard``, set by the
+rebalance_shards command) or else ``crc32(node id) % len(MESSAGE_SHARDS)``.
+Group and broadcast messages, their MessageRecipient rows and every other
+table stay in the default database. With no shards configured every helper
+here falls back to plain single-database queries.
+
+- Writes: MessageShardRouter places new messages (Message.save() asks it
+  even when QuerySet.create() names a database); bulk inserts split their
+  rows with placer().
+- Inbox reads: the router sends ``node.received_messages`` to the node's
+  shard, so an inbox reads exactly one shard (plus the default database for
+  group messages).
+- Everything else (outboxes, the admin pages, the delivery queue, purges,
+  analytics) visits every database in message_databases() and merges the
+  results, e.g. with newest().
+
+Shards cannot join to the node tables, which live in the default database,
+so related nodes are fetched with a second query (with_related()). Shard k
+(1-based position in MESSAGE_SHARDS) hands out message ids from
+``k << ID_BITS`` upwards, so ids stay unique across databases and
+database_for_id() finds a message's shard from its id alone.
+
+Writes spanning a shard and the default database (atomic(), Message.save(),
+rebalance.move_messages()) nest two ordinary transactions; there is no
+two-phase commit. The shard commits first. If the process dies before the
+default database commits, the shard keeps its change while the conversation
+summaries, unread counts and node activity (or, for a rebalance, the
+traffic counter adjustments) in the default database do not, and nothing
+detects the difference. After a crash, ``manage.py rebuild_conversations``
+recounts the summaries and activity from the stored messages, and
+``manage.py rollup_traffic --rebuild`` recounts the traffic counters.
+"""
+import heapq
+import zlib
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import prefetch_related_objects
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+from django.utils.functional import SimpleLazyObject
+
+from accounts.models import Node
+from .models import Message
+
+# Message ids of shard k start at k << ID_BITS (about 1.1 trillion ids per shard)
+ID_BITS = 40
+
+# Tables created in the shards. MessageRecipient stays empty there, but
+# deleting messages checks it for recipients.
+SHARDED_MODELS = {'message', 'messagerecipient'}
+
+
+def message_shards():
+    return list(getattr(settings, 'MESSAGE_SHARDS', []))
+
+
+def sharding_enabled():
+    return bool(getattr(settings, 'MESSAGE_SHARDS', None))
+
+
+def message_databases():
+    """Every database holding messages: the default one (group, broadcast) and the shards."""
+    return [DEFAULT_DB_ALIAS] + message_shards()
+
+
+def shard_for_node(node_id, pinned=''):
+    """The database holding the direct messages received by node ``node_id``."""
+    shards = message_shards()
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    if pinned in shards:
+        return pinned
+    return shards[zlib.crc32(str(node_id).encode()) % len(shards)]
+
+
+def placer():
+    """
+    A function mapping receiver node ids to their databases, with the pinned
+    nodes read once, for bulk inserts.
+    """
+    if not sharding_enabled():
+        return lambda node_id: DEFAULT_DB_ALIAS
+    pinned = dict(Node.objects.exclude(message_shard='').values_list('pk', 'message_shard'))
+    return lambda node_id: shard_for_node(node_id, pinned.get(node_id, '')) if node_id else DEFAULT_DB_ALIAS
+
+
+def split(items, receiver_id):
+    """
+    {database: [item, ...]} for messages about to be bulk inserted, by
+    ``receiver_id(item)``. Everything goes to the default database when
+    sharding is off.
+    """
+    if not sharding_enabled():
+        return {DEFAULT_DB_ALIAS: items} if items else {}
+    place = placer()
+    by_database = defaultdict(list)
+    for item in items:
+        by_database[place(receiver_id(item))].append(item)
+    return by_database
+
+
+def bulk_create(messages, **kwargs):
+    """Message.objects.bulk_create() with every message written to its receiver's database."""
+    for using, part in split(messages, attrgetter('receiver_id')).items():
+        Message.objects.using(using).bulk_create(part, **kwargs)
+    return messages
+
+
+def database_for_message(message):
+    """Where a new ``message`` belongs: its receiver's shard, or the default database."""
+    if not message.receiver_id or not sharding_enabled():
+        return DEFAULT_DB_ALIAS
+    if Message.receiver.is_cached(message):
+        pinned = message.receiver.message_shard
+    else:
+        pinned = Node.objects.filter(pk=message.receiver_id).values_list('message_shard', flat=True).first() or ''
+    return shard_for_node(message.receiver_id, pinned)
+
+
+def database_for_id(message_id):
+    """The database a message id was handed out by."""
+    shards = message_shards()
+    position = message_id >> ID_BITS
+    return shards[position - 1] if 0 < position <= len(shards) else DEFAULT_DB_ALIAS
+
+
+def ids_by_database(ids):
+    """{database: [message id, ...]} for a list of message ids."""
+    by_database = defaultdict(list)
+    for pk in ids:
+        by_database[database_for_id(pk)].append(pk)
+    return by_database
+
+
+def first_id(using):
+    """First message id of database ``using``'s range."""
+    shards = message_shards()
+    return (shards.index(using) + 1) << ID_BITS if using in shards else 1
+
+
+class MessageShardRouter:
+    """
+    Routes Message by receiver and everything else to the default database.
+    Listed in DATABASE_ROUTERS when MESSAGE_SHARDS is set.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model is not Message:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if isinstance(instance, Node):
+            # Meant for node.received_messages. Sent and relayed messages are spread
+            # over every shard: query them with Message.objects.filter() and newest().
+            return shard_for_node(instance.pk, instance.message_shard)
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model is not Message:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if isinstance(instance, Message):
+            # A new message's _state.db is only a guess: assigning the sender
+            # stamps it with the sender's shard
+            if instance._state.adding or not instance._state.db:
+                return database_for_message(instance)
+            return instance._state.db
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Messages in a shard refer to nodes and groups in the default database by id
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in message_shards():
+            return app_label == 'communication' and model_name in SHARDED_MODELS
+        return None
+
+
+@receiver(post_migrate)
+def prepare_shard(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Start a migrated shard's message ids at its range and turn its foreign
+    key checks back off (migrations turn them on; the nodes a shard's
+    messages refer to are in another database).
+    """
+    if sender.label != 'communication' or using not in message_shards():
+        return
+    connection = connections[using]
+    table = Message._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('PRAGMA foreign_keys = OFF')
+            cursor.execute('DELETE FROM sqlite_sequence WHERE name = %s AND seq < %s', [table, first_id(using) - 1])
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s '
+                'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                [table, first_id(using) - 1, table],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                f'GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {table})))',
+                [first_id(using) - 1],
+            )
+
+
+@contextmanager
+def atomic(using):
+    """
+    One transaction on message database ``using`` and on the default
+    database, where the conversation counters live. Just the default
+    database's transaction when ``using`` is the default database.
+    Not atomic across the two databases: see the module docstring.
+    """
+    with transaction.atomic(), transaction.atomic(using=using, savepoint=False):
+        yield
+
+
+def with_related(queryset, *fields):
+    """
+    ``queryset.select_related(*fields)`` for a Message queryset, or with
+    sharding on, prefetch_related() so the nodes come from the default
+    database instead of a join inside the shard.
+    """
+    if sharding_enabled():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def newest(queryset, limit, related=()):
+    """
+    The newest ``limit`` messages of ``queryset`` (ordered newest first, no
+    select_related) across every message database, with the ``related``
+    fields attached. Evaluated on first use, like a queryset, so cached
+    template fragments do not pay for it.
+    """
+    if not sharding_enabled():
+        return queryset.select_related(*related)[:limit]
+
+    def gather():
+        parts = [list(queryset.using(using)[:limit]) for using in message_databases()]
+        messages = list(islice(heapq.merge(*parts, key=attrgetter('created_at'), reverse=True), limit))
+        prefetch_related_objects(messages, *related)
+        return messages
+
+    return SimpleLazyObject(gather)
+
+
+def in_bulk(queryset, ids):
+    """``queryset.in_bulk(ids)``, asking each database only for the ids of its range."""
+    ids = [pk for pk in ids if pk is not None]
+    if not sharding_enabled():
+        return queryset.in_bulk(ids)
+    found = {}
+    for using, pks in ids_by_database(ids).items():
+        found.update(queryset.using(using).in_bulk(pks))
+    return found
+
+
+def delete_node_messages(node_id):
+    """Delete a deleted node's direct messages from the shards (the default database cascades by itself)."""
+    for using in message_shards():
+        Message.objects.using(using).filter(gateway_id=node_id).update(gateway=None)
+        Message.objects.using(using).filter(sender_id=node_id).delete()
+        Message.objects.using(using).filter(receiver_id=node_id).delete()
@@ -0,0 +1,41 @@
+"""
+Signal handlers keeping cached dashboard fragments and conversation summaries
+fresh, and removing deleted nodes' messages from the shards.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from accounts.models import Node
+from .conversations import record_messages
+from .dashboard_cache import bump_nodes, bump_recent_messages
+from .models import Message
+from .sharding import delete_node_messages
+
+# Node saves limited to these fields (status heartbeats) don't affect the messages panel
+STATUS_ONLY_FIELDS = {'status', 'last_seen', 'updated_at'}
+
+
+# No post_delete receiver for Message: it would stop bulk purges from using
+# fast deletes. Bulk update/delete paths call bump_recent_messages() themselves.
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created=False, raw=False, **kwargs):
+    # Runs inside Message.save()'s transaction
+    if created and not raw:
+        record_messages([instance])
+    bump_recent_messages()
+
+
+@receiver(post_save, sender=Node)
+def node_saved(sender, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= STATUS_ONLY_FIELDS:
+        return
+    bump_recent_messages()
+    bump_nodes()
+
+
+@receiver(post_delete, sender=Node)
+def node_deleted(sender, instance, **kwargs):
+    # The cascade only reaches messages in the default database
+    delete_node_messages(instance.pk)
+    bump_recent_messages()
+    bump_nodes()
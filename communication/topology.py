@@ -0,0 +1,470 @@
+"""
+Mesh topology and multi-hop relay routes.
+
+Nodes report which neighbors they hear (with RSSI/SNR), and gateways report
+the hop-by-hop paths of packets they relayed. Each observation updates a
+NodeLink row: ``quality`` is a smoothed packet delivery ratio, estimated from
+SNR for neighbor reports and counted as a success for a relayed hop.
+
+Every worker keeps the graph in memory as adjacency lists, plus one
+shortest-path tree per gateway. A link's cost is ``-log(quality)`` plus a
+small per-hop penalty, so the cheapest route is the most reliable one and
+ties go to fewer hops. When a link changes only the affected part of each
+tree is recomputed: a cheaper link relaxes outward from its target; a worse
+or lost tree link re-attaches just the subtree that hung off it. Links
+written by other processes are picked up every SYNC_INTERVAL seconds from
+the ``updated_at`` index. A row is stamped before its transaction commits,
+so each sync reads back SYNC_SETTLE seconds before the previous one started
+(re-applying a link is a no-op).
+"""
+import heapq
+import json
+import math
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Node
+
+from .models import NodeLink
+
+DEFAULT_CONFIG = {
+    # Weight of a new observation in the smoothed link quality
+    'EWMA_ALPHA': 0.3,
+    # SNR (dB) mapped to quality 0 and 1 for neighbor reports
+    'SNR_FLOOR': -15.0,
+    'SNR_GOOD': 5.0,
+    # Links below this quality are left out of the graph
+    'MIN_QUALITY': 0.05,
+    'HOP_PENALTY': 0.05,
+    # Links not heard for this many seconds are expired by "manage.py expire_links"
+    'LINK_TTL': 24 * 60 * 60,
+    'SYNC_INTERVAL': 2,
+    # Overlap between syncs, for link rows committed after the time they are stamped with
+    'SYNC_SETTLE': 10,
+}
+
+_INF = float('inf')
+_EPSILON = 1e-12
+
+
+def topology_setting(key):
+    return getattr(settings, 'TOPOLOGY', {}).get(key, DEFAULT_CONFIG[key])
+
+
+def snr_quality(snr):
+    """Delivery ratio estimate for a link reported with ``snr`` dB."""
+    floor, good = topology_setting('SNR_FLOOR'), topology_setting('SNR_GOOD')
+    return min(max((snr - floor) / (good - floor), 0.0), 1.0)
+
+
+def link_cost(quality):
+    return -math.log(quality) + topology_setting('HOP_PENALTY')
+
+
+class ShortestPathTree:
+    """Cheapest routes from ``root`` to every reachable node, maintained edge by edge."""
+
+    def __init__(self, graph, root):
+        self.graph = graph
+        self.root = root
+        self.dist = {root: 0.0}
+        self.parent = {root: None}
+        self.children = {}
+        self._relax([(0.0, root)])
+
+    def _attach(self, node, parent, dist):
+        old = self.parent.get(node)
+        if old is not None:
+            self.children[old].discard(node)
+        self.parent[node] = parent
+        self.dist[node] = dist
+        self.children.setdefault(parent, set()).add(node)
+
+    def _relax(self, heap):
+        # Dijkstra from the given labels; only nodes whose distance improves are visited
+        heapq.heapify(heap)
+        out = self.graph.out
+        dist = self.dist
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist.get(node, _INF):
+                continue
+            for neighbor, cost in out.get(node, {}).items():
+                candidate = d + cost
+                if candidate < dist.get(neighbor, _INF) - _EPSILON:
+                    self._attach(neighbor, node, candidate)
+                    heapq.heappush(heap, (candidate, neighbor))
+
+    def link_changed(self, source, target, old_cost, new_cost):
+        """Update the tree after link source -> target went from ``old_cost`` to ``new_cost`` (None = absent)."""
+        if new_cost is not None and (old_cost is None or new_cost < old_cost):
+            base = self.dist.get(source)
+            if base is not None and base + new_cost < self.dist.get(target, _INF) - _EPSILON:
+                self._attach(target, source, base + new_cost)
+                self._relax([(base + new_cost, target)])
+            return
+        if self.parent.get(target) != source:
+            return  # A worse link that no route uses
+
+        # Detach the subtree below target, then re-attach each of its nodes
+        # through its cheapest in-link from outside the subtree
+        subtree = []
+        stack = [target]
+        while stack:
+            node = stack.pop()
+            subtree.append(node)
+            stack.extend(self.children.pop(node, ()))
+        self.children[source].discard(target)
+        for node in subtree:
+            del self.dist[node]
+            del self.parent[node]
+
+        heap = []
+        incoming = self.graph.inc
+        for node in subtree:
+            best, via = _INF, None
+            for neighbor, cost in incoming.get(node, {}).items():
+                candidate = self.dist.get(neighbor, _INF) + cost
+                if candidate < best:
+                    best, via = candidate, neighbor
+            if via is not None:
+                self._attach(node, via, best)
+                heap.append((best, node))
+        self._relax(heap)
+
+    def path(self, node):
+        """Node ids from the root to ``node``, or None if unreachable."""
+        if node not in self.dist:
+            return None
+        path = []
+        while node is not None:
+            path.append(node)
+            node = self.parent[node]
+        path.reverse()
+        return path
+
+
+class MeshGraph:
+    """
+    Directed link graph as adjacency lists (``out[source][target]`` and
+    ``inc[target][source]`` hold the link cost) plus a ShortestPathTree per gateway.
+    """
+
+    def __init__(self):
+        self.out = {}
+        self.inc = {}
+        self.quality = {}
+        self.trees = {}
+        self.version = 0
+
+    def set_link(self, source, target, quality):
+        """Add, update or (quality below MIN_QUALITY) remove a link and repair the routes."""
+        old_cost = self.out.get(source, {}).get(target)
+        if quality is None or quality < topology_setting('MIN_QUALITY'):
+            if old_cost is None:
+                return
+            del self.out[source][target]
+            del self.inc[target][source]
+            del self.quality[source, target]
+            new_cost = None
+        else:
+            new_cost = link_cost(quality)
+            self.quality[source, target] = quality
+            if old_cost is not None and abs(old_cost - new_cost) < _EPSILON:
+                return
+            self.out.setdefault(source, {})[target] = new_cost
+            self.inc.setdefault(target, {})[source] = new_cost
+        for tree in self.trees.values():
+            tree.link_changed(source, target, old_cost, new_cost)
+        self.version += 1
+
+    def set_gateways(self, gateway_ids):
+        gateway_ids = set(gateway_ids)
+        if gateway_ids == self.trees.keys():
+            return
+        for root in self.trees.keys() - gateway_ids:
+            del self.trees[root]
+        for root in gateway_ids - self.trees.keys():
+            self.trees[root] = ShortestPathTree(self, root)
+        self.version += 1
+
+    def route(self, target, source=None):
+        """
+        Cheapest route to ``target`` as (path, cost), path including both ends,
+        or None. Without ``source`` the route starts at the best gateway.
+        """
+        if source is None:
+            best = min(self.trees.values(), key=lambda tree: tree.dist.get(target, _INF), default=None)
+            if best is None or target not in best.dist:
+                return None
+            return best.path(target), best.dist[target]
+        if source in self.trees:
+            tree = self.trees[source]
+            return (tree.path(target), tree.dist[target]) if target in tree.dist else None
+        return self._search(source, target)
+
+    def _search(self, source, target):
+        # One-off Dijkstra that stops as soon as the target is settled
+        dist = {source: 0.0}
+        parent = {source: None}
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parent[node]
+                return path[::-1], d
+            if d > dist[node]:
+                continue
+            for neighbor, cost in self.out.get(node, {}).items():
+                if d + cost < dist.get(neighbor, _INF):
+                    dist[neighbor] = d + cost
+                    parent[neighbor] = node
+                    heapq.heappush(heap, (d + cost, neighbor))
+        return None
+
+    def nodes(self):
+        return self.out.keys() | self.inc.keys() | self.trees.keys()
+
+    def hops(self):
+        """{node: fewest hops from any gateway}, by one breadth-first search from all of them."""
+        hops = dict.fromkeys(self.trees, 0)
+        queue = deque(self.trees)
+        while queue:
+            node = queue.popleft()
+            for neighbor in self.out.get(node, ()):
+                if neighbor not in hops:
+                    hops[neighbor] = hops[node] + 1
+                    queue.append(neighbor)
+        return hops
+
+
+class Topology:
+    """The process-wide MeshGraph, synced with NodeLink rows written by any process."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.graph = None
+        self.watermark = None
+        self.synced_at = 0.0
+        self._rendered = {}
+
+    def _load(self):
+        graph = MeshGraph()
+        rows = (
+            NodeLink.objects.filter(quality__gte=topology_setting('MIN_QUALITY'))
+            .values_list('source_id', 'target_id', 'quality')
+            .iterator(chunk_size=10000)
+        )
+        # Fill the adjacency lists before the trees exist, so each tree is built once
+        for source, target, quality in rows:
+            graph.set_link(source, target, quality)
+        graph.set_gateways(Node.objects.filter(is_gateway=True).values_list('pk', flat=True))
+        return graph
+
+    def current(self):
+        """The graph, after applying links changed elsewhere since the last sync."""
+        with self.lock:
+            now = time.monotonic()
+            settle = timedelta(seconds=topology_setting('SYNC_SETTLE'))
+            if self.graph is None:
+                self.watermark = timezone.now() - settle
+                self.graph = self._load()
+                self.synced_at = now
+            elif now - self.synced_at >= topology_setting('SYNC_INTERVAL'):
+                started = timezone.now() - settle
+                changed = NodeLink.objects.filter(updated_at__gte=self.watermark).values_list(
+                    'source_id', 'target_id', 'quality'
+                )
+                for source, target, quality in changed:
+                    self.graph.set_link(source, target, quality)
+                self.graph.set_gateways(Node.objects.filter(is_gateway=True).values_list('pk', flat=True))
+                self.watermark = started
+                self.synced_at = now
+            return self.graph
+
+    def apply(self, links):
+        """Apply (source, target, quality) changes written by this process right away."""
+        with self.lock:
+            if self.graph is not None:
+                for source, target, quality in links:
+                    self.graph.set_link(source, target, quality)
+
+    def route(self, target, source=None):
+        """(path, reliability) to ``target``, or None; reliability is the product of link qualities."""
+        with self.lock:
+            graph = self.current()
+            route = graph.route(target, source)
+            if route is None:
+                return None
+            path = route[0]
+            return path, math.prod(graph.quality[hop] for hop in zip(path, path[1:]))
+
+    def routes_from(self, gateway_id, targets):
+        """{target: path} through one gateway, for the targets it can reach."""
+        with self.lock:
+            tree = self.current().trees.get(gateway_id)
+            if tree is None:
+                return {}
+            return {target: tree.path(target) for target in targets if target in tree.dist}
+
+    def render(self, min_quality=0.0):
+        """
+        The graph as compact JSON bytes for the visualization: column arrays
+        for nodes and links, links referring to nodes by array index and
+        quality in percent. Re-rendered when the graph changed, at most every
+        SYNC_INTERVAL seconds.
+        """
+        # Qualities are shown in percent, so finer thresholds render the same
+        # links; rounding also bounds the cache to 101 entries (NaN, which
+        # no key equals, counts as 0)
+        min_quality = round(min(max(min_quality, 0.0), 1.0), 2) if not math.isnan(min_quality) else 0.0
+        with self.lock:
+            graph = self.current()
+            version, rendered_at, body = self._rendered.get(min_quality, (None, 0.0, None))
+            if version == graph.version or time.monotonic() - rendered_at < topology_setting('SYNC_INTERVAL'):
+                return body
+
+            node_ids = sorted(graph.nodes())
+            index = {node_id: i for i, node_id in enumerate(node_ids)}
+            hops = graph.hops()
+            sources, targets, qualities = [], [], []
+            for (source, target), quality in graph.quality.items():
+                if quality >= min_quality:
+                    sources.append(index[source])
+                    targets.append(index[target])
+                    qualities.append(int(quality * 100 + 0.5))
+            gateways = set(graph.trees)
+            version = graph.version
+
+        # Reading the whole table is cheaper than an IN list of thousands of ids
+        names, devices, online = [''] * len(node_ids), [''] * len(node_ids), [0] * len(node_ids)
+        for pk, device_id, name, status in Node.objects.values_list(
+            'pk', 'esp32_device_id', 'node_name', 'status'
+        ).iterator(chunk_size=5000):
+            i = index.get(pk)
+            if i is not None:
+                devices[i], names[i], online[i] = device_id, name, int(status == 'ONLINE')
+        body = json.dumps({
+            'nodes': {
+                'id': node_ids,
+                'esp32_device_id': devices,
+                'name': names,
+                'online': online,
+                'gateway': [int(node_id in gateways) for node_id in node_ids],
+                'hops': [hops.get(node_id, -1) for node_id in node_ids],
+            },
+            'links': {'source': sources, 'target': targets, 'quality': qualities},
+        }, separators=(',', ':')).encode()
+        with self.lock:
+            self._rendered[min_quality] = (version, time.monotonic(), body)
+        return body
+
+
+_topology = None
+_topology_lock = threading.Lock()
+
+
+def get_topology():
+    global _topology
+    if _topology is None:
+        with _topology_lock:
+            if _topology is None:
+                _topology = Topology()
+    return _topology
+
+
+def reset_topology():
+    """Drop the in-memory graph; it is reloaded from NodeLink on next use."""
+    global _topology
+    _topology = None
+
+
+def observe_links(samples, when=None):
+    """
+    Record link observations. ``samples`` is a sequence of
+    (source_id, target_id, quality_sample, rssi, snr); each smooths the link's
+    quality with EWMA_ALPHA. Returns the number of links written.
+    """
+    when = when or timezone.now()
+    if not samples:
+        return 0
+    alpha = topology_setting('EWMA_ALPHA')
+    pairs = {(source, target) for source, target, *_ in samples}
+    with transaction.atomic():
+        existing = {
+            (link.source_id, link.target_id): link
+            for link in NodeLink.objects.filter(
+                source_id__in={source for source, _ in pairs},
+                target_id__in={target for _, target in pairs},
+            )
+            if (link.source_id, link.target_id) in pairs
+        }
+        for source, target, sample, rssi, snr in samples:
+            link = existing.get((source, target))
+            if link is None or link.quality <= 0:
+                link = existing[source, target] = NodeLink(
+                    source_id=source, target_id=target, quality=sample, observations=0, rssi=rssi, snr=snr
+                )
+            else:
+                link.quality = (1 - alpha) * link.quality + alpha * sample
+                link.rssi = rssi if rssi is not None else link.rssi
+                link.snr = snr if snr is not None else link.snr
+            link.observations += 1
+            link.last_heard = when
+        # The sync watermark compares updated_at, so stamp it as close to the commit as possible
+        written_at = timezone.now()
+        for link in existing.values():
+            link.updated_at = written_at
+        NodeLink.objects.bulk_create(
+            existing.values(),
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['source', 'target'],
+            update_fields=['quality', 'rssi', 'snr', 'observations', 'last_heard', 'updated_at'],
+        )
+    get_topology().apply((link.source_id, link.target_id, link.quality) for link in existing.values())
+    return len(existing)
+
+
+def record_neighbors(reporter_id, neighbors, when=None):
+    """``reporter_id`` heard each of ``neighbors``, a list of (node_id, rssi, snr)."""
+    return observe_links([
+        (node_id, reporter_id, snr_quality(snr) if snr is not None else 1.0, rssi, snr)
+        for node_id, rssi, snr in neighbors
+        if node_id != reporter_id
+    ], when)
+
+
+def record_path(path, when=None):
+    """A packet travelled hop by hop along ``path`` (node ids); each hop succeeded."""
+    return observe_links([
+        (source, target, 1.0, None, None)
+        for source, target in zip(path, path[1:])
+        if source != target
+    ], when)
+
+
+def expire_links(now=None, ttl=None):
+    """
+    Set the quality of links not heard for ``ttl`` seconds (default LINK_TTL)
+    to 0, which removes them from every worker's graph on its next sync, and
+    delete links that have been expired for another ``ttl``. Returns (expired, deleted).
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=ttl if ttl is not None else topology_setting('LINK_TTL'))
+    expired = NodeLink.objects.filter(last_heard__lt=cutoff, quality__gt=0).update(quality=0, updated_at=now)
+    # Kept until every worker has synced the expiry, then dropped
+    deleted, _ = NodeLink.objects.filter(quality=0, updated_at__lt=cutoff).delete()
+    get_topology().apply(
+        NodeLink.objects.filter(quality=0, updated_at=now).values_list('source_id', 'target_id', 'quality')
+    )
+    return expired, deleted
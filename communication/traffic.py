@@ -0,0 +1,265 @@
+"""
+Time-bucketed traffic analytics.
+
+The rollup job (``manage.py rollup_traffic``) reads only messages newer than
+its watermark, a message id stored in TrafficRollup, in id ranges of
+CHUNK_SIZE. Each range is grouped by (sender, receiver, hour) in the
+database and added to the hourly and daily counters in one transaction
+together with the new watermark, so a crashed or concurrent run never counts
+a message twice:
+
+- TrafficCounter: per (sender, receiver) pair, direct messages only
+- FleetTraffic: fleet-wide totals of all messages, including group and
+  broadcast messages
+
+Messages newer than SETTLE_SECONDS are left for the next run, so ids of
+transactions still in flight are not skipped. Counters are history: purging
+expired messages does not change them. Hourly pair counters older than
+HOURLY_RETENTION_DAYS are pruned; daily ones are kept.
+
+With sharded messages (see sharding.py) each message database has its own
+watermark row; the counters themselves are in the default database.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import CharField, Count, Max, Min, Sum
+from django.db.models.functions import Length, Substr, TruncHour
+from django.utils import timezone
+
+from .models import FleetTraffic, Message, TrafficCounter, TrafficRollup
+from .sharding import atomic, first_id, message_databases
+
+DEFAULT_CONFIG = {
+    # Messages aggregated per transaction
+    'CHUNK_SIZE': 100000,
+    # Messages younger than this are left for the next run
+    'SETTLE_SECONDS': 5,
+    'HOURLY_RETENTION_DAYS': 35,
+    # SQLite page cache of the rollup's connection; the counter indexes are updated at random
+    'SQLITE_CACHE_MB': 256,
+}
+
+HOUR = TrafficCounter.HOUR
+DAY = TrafficCounter.DAY
+
+_PAIR_UPSERT = (
+    f'INSERT INTO {TrafficCounter._meta.db_table} AS t '
+    '(sender_id, receiver_id, period, bucket, messages, payload_length) VALUES (%s, %s, %s, %s, %s, %s) '
+    'ON CONFLICT (sender_id, period, bucket, receiver_id) DO UPDATE SET '
+    'messages = t.messages + excluded.messages, payload_length = t.payload_length + excluded.payload_length'
+)
+_FLEET_UPSERT = (
+    f'INSERT INTO {FleetTraffic._meta.db_table} AS t (period, bucket, messages, payload_length) VALUES (%s, %s, %s, %s) '
+    'ON CONFLICT (period, bucket) DO UPDATE SET '
+    'messages = t.messages + excluded.messages, payload_length = t.payload_length + excluded.payload_length'
+)
+# Taking counted messages back out (see uncount())
+_PAIR_SUBTRACT = (
+    f'UPDATE {TrafficCounter._meta.db_table} SET messages = messages - %s, payload_length = payload_length - %s '
+    'WHERE sender_id = %s AND receiver_id = %s AND period = %s AND bucket = %s'
+)
+_FLEET_SUBTRACT = (
+    f'UPDATE {FleetTraffic._meta.db_table} SET messages = messages - %s, payload_length = payload_length - %s '
+    'WHERE period = %s AND bucket = %s'
+)
+
+
+def traffic_setting(key):
+    return getattr(settings, 'TRAFFIC', {}).get(key, DEFAULT_CONFIG[key])
+
+
+def _settled_until(now, using=DEFAULT_DB_ALIAS):
+    """
+    Highest id up to which every message was created at least
+    SETTLE_SECONDS ago: just below the oldest unsettled message's id, or the
+    newest id if all have settled (0 if none). Messages moved in by
+    rebalance_shards get new ids with their old times, so the newest settled
+    message is not necessarily the one with the highest id.
+    """
+    cutoff = now - timedelta(seconds=traffic_setting('SETTLE_SECONDS'))
+    messages = Message.objects.using(using)
+    unsettled = messages.filter(created_at__gt=cutoff).aggregate(first=Min('pk'))['first']
+    if unsettled is not None:
+        return unsettled - 1
+    return messages.aggregate(last=Max('pk'))['last'] or 0
+
+
+def _hourly_groups(messages):
+    """(sender_id, receiver_id, hour, count, length) of the ``messages`` queryset."""
+    messages = messages.order_by()
+    if connections[messages.db].vendor != 'sqlite':
+        return (
+            messages.annotate(hour=TruncHour('created_at', tzinfo=dt_timezone.utc))
+            .values_list('sender_id', 'receiver_id', 'hour')
+            .annotate(count=Count('pk'), length=Sum(Length('content')))
+        )
+    # SQLite stores "YYYY-MM-DD HH:MM:SS" in UTC; grouping on the hour prefix avoids
+    # calling Django's Python truncation function for every row
+    groups = (
+        messages.annotate(hour=Substr('created_at', 1, 13, output_field=CharField()))
+        .values_list('sender_id', 'receiver_id', 'hour')
+        .annotate(count=Count('pk'), length=Sum(Length('content')))
+    )
+    hours = {}
+    for sender_id, receiver_id, hour, count, length in groups:
+        if hour not in hours:
+            hours[hour] = datetime.strptime(hour, '%Y-%m-%d %H').replace(tzinfo=dt_timezone.utc)
+        yield sender_id, receiver_id, hours[hour], count, length
+
+
+def _add(queryset, subtract=False):
+    """Add the messages of ``queryset`` to the counters (or take them out). Returns the number of messages."""
+    adapt = connection.ops.adapt_datetimefield_value
+    # Bucket starts as database values, converted once per distinct hour
+    buckets = {}
+    pairs = {}
+    fleet = {}
+    total = 0
+    for sender_id, receiver_id, hour, count, length in _hourly_groups(queryset):
+        length = length or 0
+        total += count
+        keys = buckets.get(hour)
+        if keys is None:
+            keys = buckets[hour] = ((HOUR, adapt(hour)), (DAY, adapt(hour.replace(hour=0))))
+        for key in keys:
+            messages, payload = fleet.get(key, (0, 0))
+            fleet[key] = (messages + count, payload + length)
+            if receiver_id is not None:
+                pair_key = (sender_id, receiver_id) + key
+                messages, payload = pairs.get(pair_key, (0, 0))
+                pairs[pair_key] = (messages + count, payload + length)
+
+    with connection.cursor() as cursor:
+        if subtract:
+            cursor.executemany(_PAIR_SUBTRACT, [
+                (messages, payload, sender_id, receiver_id, period, bucket)
+                for (sender_id, receiver_id, period, bucket), (messages, payload) in pairs.items()
+            ])
+            cursor.executemany(_FLEET_SUBTRACT, [
+                (messages, payload, period, bucket)
+                for (period, bucket), (messages, payload) in fleet.items()
+            ])
+            return total
+        cursor.executemany(_PAIR_UPSERT, [
+            (sender_id, receiver_id, period, bucket, messages, payload)
+            for (sender_id, receiver_id, period, bucket), (messages, payload) in pairs.items()
+        ])
+        cursor.executemany(_FLEET_UPSERT, [
+            (period, bucket, messages, payload)
+            for (period, bucket), (messages, payload) in fleet.items()
+        ])
+    return total
+
+
+def uncount(using, ids):
+    """
+    Take messages ``ids`` of database ``using`` back out of the counters,
+    those the rollup has already counted. For messages about to be moved to
+    another database, where they get new ids and are counted again; call in
+    the transaction that deletes them.
+    """
+    watermark = TrafficRollup.objects.filter(database=using).values_list('last_message_id', flat=True).first()
+    if not watermark:
+        return 0
+    return _add(Message.objects.using(using).filter(pk__in=ids, pk__lte=watermark), subtract=True)
+
+
+def rollup(now=None, chunk_size=None, log=None):
+    """
+    Count every settled message past the watermark, one id range per
+    transaction. Returns the number of messages added.
+    """
+    now = now or timezone.now()
+    chunk_size = chunk_size or traffic_setting('CHUNK_SIZE')
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA cache_size = {-traffic_setting('SQLITE_CACHE_MB') * 1024}")
+    added = 0
+    for using in message_databases():
+        until = _settled_until(now, using)
+        while True:
+            with atomic(using):
+                state, _ = TrafficRollup.objects.select_for_update().get_or_create(
+                    database=using, defaults={'last_message_id': first_id(using) - 1},
+                )
+                if state.last_message_id >= until:
+                    break
+                last_id = min(state.last_message_id + chunk_size, until)
+                added += _add(Message.objects.using(using).filter(pk__gt=state.last_message_id, pk__lte=last_id))
+                state.last_message_id = last_id
+                state.save(update_fields=['last_message_id', 'updated_at'])
+            if log:
+                log(f'Rolled up to message {last_id} ({added} messages)')
+    prune(now)
+    return added
+
+
+def prune(now=None):
+    """Delete hourly pair counters older than HOURLY_RETENTION_DAYS. Returns the number deleted."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=traffic_setting('HOURLY_RETENTION_DAYS'))
+    deleted, _ = TrafficCounter.objects.filter(period=HOUR, bucket__lt=cutoff).delete()
+    return deleted
+
+
+def reset():
+    """Forget all counters and the watermark, so the next rollup recounts every message."""
+    with transaction.atomic():
+        TrafficCounter.objects.all().delete()
+        FleetTraffic.objects.all().delete()
+        TrafficRollup.objects.all().delete()
+
+
+def rolled_up_until():
+    """When the rollup last advanced, or None if it never ran."""
+    return TrafficRollup.objects.aggregate(last=Max('updated_at'))['last']
+
+
+def _buckets(period, count, now):
+    """Starts of the last ``count`` hours or days, oldest first, ending with the current one."""
+    if period == HOUR:
+        current, step = now.replace(minute=0, second=0, microsecond=0), timedelta(hours=1)
+    else:
+        current, step = now.replace(hour=0, minute=0, second=0, microsecond=0), timedelta(days=1)
+    return [current - step * i for i in range(count - 1, -1, -1)]
+
+
+def _dense(buckets, rows):
+    """[(bucket, value)] to one value per bucket, 0 where nothing was counted."""
+    values = dict(rows)
+    return [values.get(bucket, 0) for bucket in buckets]
+
+
+def fleet_series(days=30, period=HOUR, now=None):
+    """
+    Fleet-wide messages per hour (or day) over the last ``days`` days:
+    {'buckets': [ISO start, ...], 'messages': [count, ...]}. Reads at most
+    24 * ``days`` rows.
+    """
+    now = (now or timezone.now()).astimezone(dt_timezone.utc)
+    buckets = _buckets(period, days * 24 if period == HOUR else days, now)
+    rows = FleetTraffic.objects.filter(period=period, bucket__gte=buckets[0]).values_list('bucket', 'messages')
+    return {
+        'buckets': [bucket.isoformat() for bucket in buckets],
+        'messages': _dense(buckets, rows),
+    }
+
+
+def node_series(node, days=7, period=HOUR, now=None):
+    """
+    Direct messages sent and received by ``node`` per hour (or day) over the
+    last ``days`` days: {'buckets': [...], 'sent': [...], 'received': [...]}.
+    Sums the node's pair counters in the database, one row per bucket.
+    """
+    now = (now or timezone.now()).astimezone(dt_timezone.utc)
+    buckets = _buckets(period, days * 24 if period == HOUR else days, now)
+    counters = TrafficCounter.objects.filter(period=period, bucket__gte=buckets[0]).order_by()
+    sent = counters.filter(sender=node).values_list('bucket').annotate(total=Sum('messages'))
+    received = counters.filter(receiver=node).values_list('bucket').annotate(total=Sum('messages'))
+    return {
+        'buckets': [bucket.isoformat() for bucket in buckets],
+        'sent': _dense(buckets, sent),
+        'received': _dense(buckets, received),
+    }
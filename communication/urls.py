@@ -3,6 +3,7 @@ URL configuration for communication app
 """
 from django.urls import path
 from . import views
+from .device_urls import urlpatterns as device_urlpatterns
 
 app_name = 'communication'
 
@@ -13,10 +14,7 @@ urlpatterns = [
     path('add-node/', views.add_node, name='add_node'),
     path('delete-node/<int:node_id>/', views.delete_node, name='delete_node'),
     path('track-nodes/', views.track_nodes, name='track_nodes'),
-    
-    # API endpoints for ESP32
-    path('api/nodes/update-status/', views.api_update_status, name='api_update_status'),
-    path('api/messages/send/', views.api_send_message, name='api_send_message'),
-    path('api/messages/inbox/<str:esp32_device_id>/', views.api_get_inbox, name='api_get_inbox'),
-]
-
+    path('api/nodes/directory/', views.api_node_directory, name='api_node_directory'),
+    path('topology/', views.topology_map, name='topology_map'),
+    path('topology/graph/', views.topology_graph, name='topology_graph'),
+] + device_urlpatterns  # API endpoints for ESP32
@@ -1,19 +1,36 @@
 """
-Views for communication app
+Views for communication app. The device API for ESP32 nodes and gateways
+lives in device_api.py.
 """
+import math
+from hashlib import md5
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core.paginator import Paginator
 from django.contrib import messages
-from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.http import HttpResponse, JsonResponse
 from django.utils import timezone
-import json
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_http_methods
 from .models import Message
+from .activity import activity_for
+from .conversations import conversations_for, unread_total
+from .dashboard_cache import nodes_changed_at, recent_messages_version
+from .sharding import newest, with_related
+from .topology import get_topology
+from .traffic import fleet_series, node_series, rolled_up_until
 from .forms import AdminNodeForm
 from accounts.models import Node
+from accounts.directory import node_status_counts, search_nodes
+from accounts.presence import apply_presence
+from accounts.uptime import availability, cached_fleet_availability
 from django.contrib.auth.models import User
 
+# Rows per page in the admin node tables
+NODES_PER_PAGE = 50
+
 
 @user_passes_test(lambda u: u.is_staff or u.is_superuser)
 def admin_dashboard(request):
@@ -21,15 +38,22 @@ def admin_dashboard(request):
     Admin dashboard showing all nodes and messages.
     Only accessible to staff/superuser.
     """
-    total_nodes = Node.objects.count()
-    online_nodes = Node.objects.filter(status='ONLINE').count()
-    offline_nodes = Node.objects.filter(status='OFFLINE').count()
+    total_nodes, online_nodes, offline_nodes = node_status_counts()
 
-    # Get all nodes
-    all_nodes = Node.objects.all().order_by('node_name')
+    # One page of nodes at a time so the page cost stays flat as the fleet grows
+    all_nodes = Paginator(Node.objects.order_by('node_name', 'id'), NODES_PER_PAGE).get_page(request.GET.get('page'))
+    all_nodes.object_list = apply_presence(all_nodes.object_list)
 
-    # Get recent messages (last 50)
-    recent_messages = Message.objects.all()[:50]
+    # Get recent messages (last 50), merged across the message shards if any.
+    # Lazy, so it only runs when the cached panel fragment has to be re-rendered.
+    recent_messages = newest(Message.objects.all(), 50, related=('sender', 'receiver', 'group'))
+
+    # Traffic charts from the rolled-up counters, never from Message
+    traffic_device_id = request.GET.get('traffic_node', '').strip()
+    traffic_node = Node.objects.filter(esp32_device_id=traffic_device_id).first() if traffic_device_id else None
+    traffic = {'fleet': fleet_series(days=30)}
+    if traffic_node:
+        traffic['node'] = node_series(traffic_node, days=7)
 
     context = {
         'total_nodes': total_nodes,
@@ -37,25 +61,77 @@ def admin_dashboard(request):
         'offline_nodes': offline_nodes,
         'all_nodes': all_nodes,
         'recent_messages': recent_messages,
+        'recent_messages_version': recent_messages_version(),
+        'traffic': traffic,
+        'traffic_device_id': traffic_device_id,
+        'traffic_node': traffic_node,
+        'traffic_rolled_up': rolled_up_until(),
     }
     return render(request, 'communication/admin_dashboard.html', context)
 
 
+def _node_detail_validators(request, node, activity):
+    """
+    ETag and Last-Modified of a node detail page: the node's activity version
+    (its messages and unread counts), the node itself and its presence, edits
+    to any node (peer names) and the viewer. The current hour is included so
+    the uptime percentages are recomputed at least hourly.
+    """
+    hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+    changed = [hour, nodes_changed_at(), node.updated_at, node.last_seen, activity['updated_at']]
+    # Full precision: Last-Modified only has whole seconds
+    state = md5(repr((node.status, request.user.pk, changed)).encode(), usedforsecurity=False).hexdigest()
+    etag = f'"node-{node.pk}-{activity["version"]}-{state[:16]}"'
+    return etag, max(moment for moment in changed if moment)
+
+
 @user_passes_test(lambda u: u.is_staff or u.is_superuser)
 def node_detail(request, node_id):
     """
     Admin view to see details of a specific node.
+    Conditional requests (If-None-Match / If-Modified-Since) for an unchanged
+    page get 304 Not Modified without touching the message tables.
     """
-    node = get_object_or_404(Node, pk=node_id)
-    
-    # Get messages for this node
-    sent_messages = node.sent_messages.all()[:50]
-    received_messages = node.received_messages.all()[:50]
+    node = get_object_or_404(Node.objects.select_related('user'), pk=node_id)
+    apply_presence([node])
+    activity = activity_for(node.pk)
+    etag, last_modified = _node_detail_validators(request, node, activity)
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if response is None:
+        response = _render_node_detail(request, node, activity)
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified.timestamp())
+    # Browsers keep the page but must revalidate it on every visit
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _render_node_detail(request, node, activity):
+    """The full node detail page."""
+    # Get messages for this node: sent ones from every shard, received ones from the node's shard
+    sent_messages = newest(Message.objects.filter(sender=node), 50, related=('receiver', 'group'))
+    received_messages = with_related(node.received_messages.all(), 'sender')[:50]
+
+    # Uptime over the last week and month, plus the most recent transitions
+    uptime_7d = availability([node.pk], days=7)[node.pk]
+    uptime_30d = availability([node.pk], days=30)[node.pk]
+    status_changes = node.status_changes.all()[:20]
+
+    busiest_peer = None
+    if activity['busiest_peer_id']:
+        busiest_peer = Node.objects.only('node_name').filter(pk=activity['busiest_peer_id']).first()
 
     context = {
         'node': node,
+        'activity': activity,
+        'busiest_peer': busiest_peer,
         'sent_messages': sent_messages,
         'received_messages': received_messages,
+        'uptime_7d': uptime_7d,
+        'uptime_30d': uptime_30d,
+        'status_changes': status_changes,
+        'conversations': conversations_for(node),
+        'unread_total': unread_total(node),
     }
     return render(request, 'communication/node_detail.html', context)
 
@@ -119,147 +195,96 @@ def track_nodes(request):
     """
     Admin view to track all nodes and their status.
     """
-    all_nodes = Node.objects.all().order_by('node_name')
-    
-    # Statistics
-    total_nodes = all_nodes.count()
-    online_nodes = all_nodes.filter(status='ONLINE').count()
-    offline_nodes = all_nodes.filter(status='OFFLINE').count()
-    
-    # Group nodes by status
-    online_nodes_list = all_nodes.filter(status='ONLINE')
-    offline_nodes_list = all_nodes.filter(status='OFFLINE')
-    
+    total_nodes, online_nodes, offline_nodes = node_status_counts()
+
+    # Group nodes by status, one page of each at a time
+    online_page = Paginator(
+        Node.objects.filter(status='ONLINE').order_by('node_name', 'id'), NODES_PER_PAGE
+    ).get_page(request.GET.get('online_page'))
+    offline_page = Paginator(
+        Node.objects.filter(status='OFFLINE').order_by('node_name', 'id'), NODES_PER_PAGE
+    ).get_page(request.GET.get('offline_page'))
+
+    # Live last_seen from the presence store, then 30-day availability for the nodes on this page
+    online_page.object_list = apply_presence(online_page.object_list)
+    offline_page.object_list = apply_presence(offline_page.object_list)
+    page_nodes = list(online_page) + list(offline_page)
+    uptime = availability([node.pk for node in page_nodes], days=30)
+    for node in page_nodes:
+        node.uptime = uptime.get(node.pk)
+
     context = {
-        'all_nodes': all_nodes,
-        'online_nodes': online_nodes_list,
-        'offline_nodes': offline_nodes_list,
+        'online_nodes': online_page,
+        'offline_nodes': offline_page,
         'total_nodes': total_nodes,
         'online_count': online_nodes,
         'offline_count': offline_nodes,
+        'fleet_uptime': cached_fleet_availability(days=30),
+        # Keep the other table's page when paging one of them
+        'online_extra': f'offline_page={offline_page.number}',
+        'offline_extra': f'online_page={online_page.number}',
     }
     return render(request, 'communication/track_nodes.html', context)
 
 
-# ==================== API ENDPOINTS FOR ESP32 ====================
-
-@csrf_exempt
-@require_http_methods(["POST"])
-def api_update_status(request):
+@login_required
+@require_http_methods(["GET"])
+def api_node_directory(request):
     """
-    API endpoint for ESP32 to update node status.
-    POST /api/nodes/update-status/
-    Request: {"esp32_device_id": "ESP32-001", "status": "ONLINE"}
+    Node directory for dashboard autocomplete and paging.
+    GET /api/nodes/directory/?q=<prefix>&after=<cursor>&limit=25
+    Matches node name or ESP32 ID prefixes (case-insensitive). Pass the returned
+    next_cursor as "after" to get the next page. Node users never see their own node.
     """
     try:
-        data = json.loads(request.body)
-        esp32_device_id = data.get('esp32_device_id')
-        status = data.get('status', 'ONLINE').upper()
-
-        if not esp32_device_id:
-            return JsonResponse({'error': 'esp32_device_id is required'}, status=400)
-
-        if status not in ['ONLINE', 'OFFLINE']:
-            return JsonResponse({'error': 'status must be ONLINE or OFFLINE'}, status=400)
-
-        try:
-            node = Node.objects.get(esp32_device_id=esp32_device_id)
-            node.status = status
-            node.last_seen = timezone.now()
-            node.save()
-            return JsonResponse({
-                'success': True,
-                'message': f'Status updated to {status}',
-                'node_name': node.node_name
-            })
-        except Node.DoesNotExist:
-            return JsonResponse({'error': 'Node not found'}, status=404)
-
-    except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON'}, status=400)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
-
-
-@csrf_exempt
-@require_http_methods(["POST"])
-def api_send_message(request):
+        limit = int(request.GET.get('limit', 25))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+
+    exclude_pk = None
+    if not (request.user.is_staff or request.user.is_superuser):
+        exclude_pk = Node.objects.filter(user=request.user).values_list('pk', flat=True).first()
+
+    try:
+        nodes, next_cursor = search_nodes(
+            request.GET.get('q', ''), after=request.GET.get('after'), limit=limit, exclude_pk=exclude_pk
+        )
+    except ValueError:
+        return JsonResponse({'error': 'after must be a next_cursor returned by this API'}, status=400)
+    return JsonResponse({
+        'success': True,
+        'nodes': [{
+            'id': node.id,
+            'node_name': node.node_name,
+            'esp32_device_id': node.esp32_device_id,
+            'lora_node_id': node.lora_node_id,
+            'status': node.status,
+            'last_seen': node.last_seen.isoformat() if node.last_seen else None,
+        } for node in apply_presence(nodes)],
+        'next_cursor': next_cursor,
+    })
+
+
+@user_passes_test(lambda u: u.is_staff or u.is_superuser)
+def topology_map(request):
     """
-    API endpoint for ESP32 to send messages.
-    POST /api/messages/send/
-    Request: {
-        "from_esp32_device_id": "ESP32-001",
-        "to_esp32_device_id": "ESP32-002",
-        "payload": "Hello from Node 1"
-    }
+    Admin view drawing the mesh topology; the graph is loaded from topology_graph.
     """
-    try:
-        data = json.loads(request.body)
-        from_esp32_id = data.get('from_esp32_device_id')
-        to_esp32_id = data.get('to_esp32_device_id')
-        payload = data.get('payload', '')
-
-        if not all([from_esp32_id, to_esp32_id, payload]):
-            return JsonResponse({
-                'error': 'from_esp32_device_id, to_esp32_device_id, and payload are required'
-            }, status=400)
-
-        try:
-            sender_node = Node.objects.get(esp32_device_id=from_esp32_id)
-            receiver_node = Node.objects.get(esp32_device_id=to_esp32_id)
-
-            message = Message.objects.create(
-                sender=sender_node,
-                receiver=receiver_node,
-                content=payload,
-                status='SENT'
-            )
-
-            return JsonResponse({
-                'success': True,
-                'message_id': message.id,
-                'message': 'Message sent successfully'
-            })
-        except Node.DoesNotExist as e:
-            return JsonResponse({'error': f'Node not found: {str(e)}'}, status=404)
-
-    except json.JSONDecodeError:
-        return JsonResponse({'error': 'Invalid JSON'}, status=400)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+    return render(request, 'communication/topology.html')
 
 
+@user_passes_test(lambda u: u.is_staff or u.is_superuser)
 @require_http_methods(["GET"])
-def api_get_inbox(request, esp32_device_id):
+def topology_graph(request):
     """
-    API endpoint for ESP32 to fetch messages.
-    GET /api/messages/inbox/<esp32_device_id>/
-    Returns JSON list of messages for that node.
+    Mesh graph for the topology map as column arrays (see Topology.render).
+    GET /topology/graph/?min_quality=0.2
     """
     try:
-        node = Node.objects.get(esp32_device_id=esp32_device_id)
-        messages = node.received_messages.all()[:50]  # Last 50 messages
-
-        messages_data = [{
-            'id': msg.id,
-            'from': {
-                'node_name': msg.sender.node_name,
-                'esp32_device_id': msg.sender.esp32_device_id,
-            },
-            'content': msg.content,
-            'status': msg.status,
-            'created_at': msg.created_at.isoformat(),
-        } for msg in messages]
-
-        return JsonResponse({
-            'success': True,
-            'node_name': node.node_name,
-            'messages': messages_data,
-            'count': len(messages_data)
-        })
-
-    except Node.DoesNotExist:
-        return JsonResponse({'error': 'Node not found'}, status=404)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
-
+        min_quality = float(request.GET.get('min_quality', 0))
+    except ValueError:
+        min_quality = math.nan
+    # NaN and infinities would each render and cache a graph of their own
+    if not math.isfinite(min_quality):
+        return JsonResponse({'error': 'min_quality must be a number'}, status=400)
+    return HttpResponse(get_topology().render(min_quality), content_type='application/json')
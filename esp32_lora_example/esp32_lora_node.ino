@@ -25,6 +25,7 @@ const char* ssid = "YOUR_WIFI_SSID";
 const char* password = "YOUR_WIFI_PASSWORD";
 const char* serverURL = "http://192.168.1.100:8000";  // Your Django server IP
 const char* esp32DeviceID = "ESP32-001";  // Must match registered node ID
+const char* deviceToken = "YOUR_DEVICE_TOKEN";  // From: python manage.py issue_device_tokens --device ESP32-001
 
 // LoRa Pin Definitions
 #define LORA_SCK     18
@@ -127,6 +128,7 @@ void updateStatus(const char* status) {
   String url = String(serverURL) + "/communication/api/nodes/update-status/";
   
   http.begin(url);
+  http.addHeader("Authorization", String("Token ") + deviceToken);
   http.addHeader("Content-Type", "application/json");
   
   StaticJsonDocument<200> doc;
@@ -174,6 +176,9 @@ void checkLoRaMessages() {
 }
 
 // ============ FORWARD LoRa MESSAGE TO SERVER ============
+// Sends on behalf of the LoRa sender with this node's token: the server only
+// allows that for a gateway (is_gateway) that is the sender's relay_gateway,
+// so mark this node as a gateway and set it on the nodes it forwards for.
 void forwardLoRaMessageToServer(uint8_t sourceAddress, String message) {
   if (WiFi.status() != WL_CONNECTED) return;
   
@@ -181,6 +186,7 @@ void forwardLoRaMessageToServer(uint8_t sourceAddress, String message) {
   String url = String(serverURL) + "/communication/api/messages/send/";
   
   http.begin(url);
+  http.addHeader("Authorization", String("Token ") + deviceToken);
   http.addHeader("Content-Type", "application/json");
   
   StaticJsonDocument<300> doc;
@@ -203,6 +209,7 @@ void checkInbox() {
   String url = String(serverURL) + "/communication/api/messages/inbox/" + String(esp32DeviceID) + "/";
   
   http.begin(url);
+  http.addHeader("Authorization", String("Token ") + deviceToken);
   int httpResponseCode = http.GET();
   
   if (httpResponseCode > 0) {
@@ -236,6 +243,7 @@ void sendMessageToServer(String toESP32ID, String payload) {
   String url = String(serverURL) + "/communication/api/messages/send/";
   
   http.begin(url);
+  http.addHeader("Authorization", String("Token ") + deviceToken);
   http.addHeader("Content-Type", "application/json");
   
   StaticJsonDocument<300> doc;
@@ -0,0 +1,225 @@
+"""
+HTTP compression middleware for device and dashboard traffic.
+
+CompressionMiddleware compresses responses with Brotli (if the optional
+``brotli`` package is installed) or gzip, whichever the client prefers via
+Accept-Encoding. Responses below COMPRESSION['MIN_SIZE'] bytes, such as
+status heartbeat replies, are sent as-is since compressing them costs CPU
+and saves nothing. Streaming responses are compressed chunk by chunk.
+
+RequestDecompressionMiddleware accepts gzip-compressed request bodies from
+gateways (``Content-Encoding: gzip``).
+
+Both run natively in sync (WSGI) and async (ASGI) middleware chains.
+"""
+import re
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:  # Brotli support is optional
+    brotli = None
+
+DEFAULT_CONFIG = {
+    'MIN_SIZE': 512,
+    'BROTLI_QUALITY': 4,
+    # Django's BREACH mitigation for gzip: random bytes in the gzip header
+    'GZIP_MAX_RANDOM_BYTES': 100,
+    'COMPRESSIBLE_TYPES': (
+        'text/', 'application/json', 'application/javascript',
+        'application/xml', 'image/svg+xml', 'text/csv',
+    ),
+}
+
+_ACCEPT_ENCODING_RE = re.compile(r'\s*([\w*]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?')
+
+
+def _config(key):
+    return getattr(settings, 'COMPRESSION', {}).get(key, DEFAULT_CONFIG[key])
+
+
+def negotiate_encoding(accept_encoding):
+    """Return 'br', 'gzip' or None for an Accept-Encoding header value."""
+    weights = {}
+    for part in accept_encoding.split(','):
+        match = _ACCEPT_ENCODING_RE.match(part)
+        if not match:
+            continue
+        name, q = match.group(1).lower(), match.group(2)
+        try:
+            weights[name] = float(q) if q is not None else 1.0
+        except ValueError:
+            continue
+
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_q = None, 0.0
+    for name in candidates:
+        q = weights.get(name, weights.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def _brotli_stream(sequence, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in sequence:
+        data = compressor.process(chunk)
+        # Flush so each chunk reaches the client without waiting for the end
+        data += compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def _abrotli_stream(sequence, quality):
+    compressor = brotli.Compressor(quality=quality)
+    async for chunk in sequence:
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+async def _agzip_stream(sequence, max_random_bytes):
+    # Each chunk becomes its own gzip member, as in Django's GZipMiddleware
+    async for chunk in sequence:
+        yield compress_string(chunk, max_random_bytes=max_random_bytes)
+
+
+class _HybridMiddleware:
+    """Runs natively in both WSGI and ASGI middleware chains, without a thread hop."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class CompressionMiddleware(_HybridMiddleware):
+    """
+    Negotiated Brotli/gzip response compression with a minimum-size threshold.
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        return self.compress(request, response)
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        return self.compress(request, response)
+
+    def compress(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code == 206:
+            return response
+
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if not content_type.startswith(tuple(_config('COMPRESSIBLE_TYPES'))):
+            return response
+
+        # The response varies on Accept-Encoding even when it ends up uncompressed
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming and response.is_async:
+            if encoding == 'br':
+                response.streaming_content = _abrotli_stream(
+                    response.streaming_content, _config('BROTLI_QUALITY')
+                )
+            else:
+                response.streaming_content = _agzip_stream(
+                    response.streaming_content, _config('GZIP_MAX_RANDOM_BYTES')
+                )
+            del response['Content-Length']
+        elif response.streaming:
+            if encoding == 'br':
+                response.streaming_content = _brotli_stream(
+                    response.streaming_content, _config('BROTLI_QUALITY')
+                )
+            else:
+                response.streaming_content = compress_sequence(
+                    response.streaming_content,
+                    max_random_bytes=_config('GZIP_MAX_RANDOM_BYTES'),
+                )
+            del response['Content-Length']
+        else:
+            if len(response.content) < _config('MIN_SIZE'):
+                return response
+            if encoding == 'br':
+                compressed = brotli.compress(response.content, quality=_config('BROTLI_QUALITY'))
+            else:
+                compressed = compress_string(
+                    response.content, max_random_bytes=_config('GZIP_MAX_RANDOM_BYTES')
+                )
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+
+        # Compressed and uncompressed representations must not share a strong ETag
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+
+class RequestDecompressionMiddleware(_HybridMiddleware):
+    """
+    Transparently decompress request bodies sent with Content-Encoding gzip.
+    The decompressed size is capped at DATA_UPLOAD_MAX_MEMORY_SIZE so a small
+    compressed body cannot expand without limit.
+    """
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        error = self.process_request(request)
+        if error is not None:
+            return error
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # The body is already buffered by the ASGI handler, so reading it does not block
+        error = self.process_request(request)
+        if error is not None:
+            return error
+        return await self.get_response(request)
+
+    def process_request(self, request):
+        encoding = request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding and encoding != 'identity':
+            return self.decompress(request, encoding)
+        return None
+
+    def decompress(self, request, encoding):
+        limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 2621440
+        if encoding != 'gzip':
+            return JsonResponse({'error': f'Unsupported Content-Encoding: {encoding}'}, status=415)
+        try:
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            body = decompressor.decompress(request.body, limit + 1)
+        except zlib.error:
+            return JsonResponse({'error': 'Invalid compressed request body'}, status=400)
+
+        if len(body) > limit or decompressor.unconsumed_tail:
+            return JsonResponse({'error': 'Decompressed request body too large'}, status=413)
+
+        request._body = body
+        request.META['CONTENT_LENGTH'] = str(len(body))
+        del request.META['HTTP_CONTENT_ENCODING']
+        return None
@@ -2,6 +2,7 @@
 Django settings for lora_comm project.
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -36,6 +37,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Compresses responses last (outermost), decompresses gzip request bodies first
+    'lora_comm.middleware.CompressionMiddleware',
+    'lora_comm.middleware.RequestDecompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -63,6 +67,13 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'lora_comm.wsgi.application'
+ASGI_APPLICATION = 'lora_comm.asgi.application'
+
+# Serve api_update_status, api_send_message and api_get_inbox with their native
+# async views under an ASGI server. Off by default: with SQLite every query
+# still runs on a worker thread, and benchmarks/asgi_vs_wsgi.py measured them
+# slower than the sync views under WSGI.
+DEVICE_API_ASYNC = os.environ.get('DEVICE_API_ASYNC', '0') == '1'
 
 
 # Database
@@ -72,6 +83,46 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Many concurrent device requests (threads under WSGI, per-request
+        # threads under ASGI): WAL lets reads run alongside a write, and
+        # IMMEDIATE transactions wait for the write lock up front instead of
+        # failing with "database is locked" when upgrading a read lock.
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
+    }
+}
+
+# Message shards (communication/sharding.py): direct messages are spread over
+# MESSAGE_SHARDS=N extra SQLite files by receiver. Off (0) by default. Create
+# each shard with "python manage.py migrate --database messages_1" etc.
+MESSAGE_SHARDS = [f'messages_{n}' for n in range(1, int(os.environ.get('MESSAGE_SHARDS', '0')) + 1)]
+for _alias in MESSAGE_SHARDS:
+    DATABASES[_alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'{_alias}.sqlite3',
+        'OPTIONS': dict(
+            DATABASES['default']['OPTIONS'],
+            # The nodes a shard's messages refer to live in the default database
+            init_command='PRAGMA foreign_keys=OFF; ' + DATABASES['default']['OPTIONS']['init_command'],
+        ),
+    }
+DATABASE_ROUTERS = ['communication.sharding.MessageShardRouter'] if MESSAGE_SHARDS else []
+
+
+# Cache
+# Used for dashboard template fragments. LocMemCache is per process; point this
+# at a shared backend (e.g. Redis or Memcached) when running several workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'lora-comm',
+        'OPTIONS': {
+            # One entry per dashboard node row; the default of 300 would cull constantly
+            'MAX_ENTRIES': 50000,
+        },
     }
 }
 
@@ -123,3 +174,124 @@ LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = 'accounts:node_dashboard'
 LOGOUT_REDIRECT_URL = 'accounts:home'
 
+
+# Default message time-to-live per message_type, in seconds (None = never expires).
+# Expired messages are hidden from inboxes and deleted by purge_expired_messages.
+MESSAGE_TYPE_TTL = {
+    'TEXT': None,
+    'ALERT': 10 * 60,
+    'COMMAND': 5 * 60,
+}
+
+# Store-and-forward delivery through gateway nodes.
+# Retry delay after attempt n is BASE_SECONDS * 2 ** (n - 1), capped at MAX_SECONDS.
+# After MAX_ATTEMPTS unacknowledged hand-offs a message is marked FAILED.
+DELIVERY_RETRY = {
+    'BASE_SECONDS': 30,
+    'MAX_SECONDS': 60 * 60,
+    'MAX_ATTEMPTS': 8,
+    'BATCH_SIZE': 20,
+}
+
+# Device API authentication (per-node tokens, see accounts/tokens.py).
+# Set DEVICE_API_AUTH = False only for local experiments with unprovisioned devices.
+DEVICE_API_AUTH = True
+DEVICE_TOKEN_CACHE = {
+    'TTL_SECONDS': 60,
+    'MAX_ENTRIES': 100000,
+}
+
+# Per-device token-bucket rate limits for the device API (see communication/ratelimit.py).
+# rate = tokens refilled per second, burst = bucket size. NODES overrides per ESP32 ID,
+# e.g. 'NODES': {'ESP32-001': {'send_message': {'rate': 5, 'burst': 50}}}.
+# Use BACKEND 'cache' to share buckets between worker processes via CACHES[CACHE_ALIAS].
+DEVICE_RATE_LIMIT = {
+    'ENABLED': True,
+    'BACKEND': 'memory',
+    'CACHE_ALIAS': 'default',
+    'MAX_ENTRIES': 200000,
+    'DEFAULT': {'rate': 1.0, 'burst': 10},
+    'ENDPOINTS': {
+        'update_status': {'rate': 0.2, 'burst': 5},
+        'send_message': {'rate': 1.0, 'burst': 10},
+        'inbox': {'rate': 0.5, 'burst': 5},
+        'gateway_pull': {'rate': 2.0, 'burst': 20},
+        'gateway_ack': {'rate': 2.0, 'burst': 20},
+        'gateway_fragments': {'rate': 5.0, 'burst': 50},
+        'topology_report': {'rate': 0.1, 'burst': 5},
+        'route': {'rate': 1.0, 'burst': 10},
+    },
+    'NODES': {},
+}
+
+# Response compression (see lora_comm/middleware.py). Brotli is used when the
+# optional "brotli" package is installed and the client accepts it, else gzip.
+# Responses smaller than MIN_SIZE bytes (e.g. status heartbeats) are not compressed.
+COMPRESSION = {
+    'MIN_SIZE': 512,
+    'BROTLI_QUALITY': 4,
+    'GZIP_MAX_RANDOM_BYTES': 100,
+}
+
+# Gateway ingest server (python manage.py run_ingest_server): framed binary
+# packets over UDP/TCP, written in batches of up to BATCH_SIZE records or
+# every FLUSH_INTERVAL_MS milliseconds, whichever comes first.
+INGEST_SERVER = {
+    'HOST': '127.0.0.1',
+    'UDP_PORT': 9750,
+    'TCP_PORT': 9751,
+    'BATCH_SIZE': 500,
+    'FLUSH_INTERVAL_MS': 20,
+    'NODE_MAP_TTL': 60,
+    'REPLAY_CACHE_SIZE': 50000,
+}
+
+# LoRa payload codec (communication/codec.py): long messages are compressed
+# (deflate with a preset dictionary trained by "python manage.py
+# train_payload_dictionary") and split into FRAGMENT_SIZE-byte fragments,
+# header included. Incomplete transfers from gateways are dropped after
+# FRAGMENT_TTL seconds.
+PAYLOAD_CODEC = {
+    'FRAGMENT_SIZE': 200,
+    'DICTIONARY_SIZE': 4096,
+    'TRAINING_MESSAGES': 20000,
+    'FRAGMENT_TTL': 600,
+}
+
+# Presence store (accounts/presence.py): current status and last_seen of every
+# node, shared by all worker processes. 'mmap' keeps it in a memory-mapped file
+# next to the database (PATH overrides the location); 'cache' uses the
+# CACHE_ALIAS cache, e.g. a Redis/memcached server shared by several hosts;
+# None reads and writes the Node table directly. Heartbeats only reach the
+# database through "python manage.py sweep_presence", which also marks nodes
+# OFFLINE after OFFLINE_AFTER seconds without a heartbeat.
+PRESENCE = {
+    'BACKEND': 'mmap',
+    'PATH': None,
+    'CACHE_ALIAS': 'default',
+    'OFFLINE_AFTER': 300,
+}
+
+# Mesh topology (communication/topology.py): link quality is smoothed with
+# EWMA_ALPHA; links below MIN_QUALITY are not used for routing, and links not
+# heard for LINK_TTL seconds are expired by "python manage.py expire_links".
+# Workers pick up links reported to other processes every SYNC_INTERVAL seconds,
+# re-reading the last SYNC_SETTLE seconds for rows committed late.
+TOPOLOGY = {
+    'EWMA_ALPHA': 0.3,
+    'MIN_QUALITY': 0.05,
+    'HOP_PENALTY': 0.05,
+    'LINK_TTL': 24 * 60 * 60,
+    'SYNC_INTERVAL': 2,
+    'SYNC_SETTLE': 10,
+}
+
+# Traffic analytics (communication/traffic.py): "python manage.py rollup_traffic"
+# adds messages older than SETTLE_SECONDS to hourly and daily counters,
+# CHUNK_SIZE messages per transaction. Hourly per-pair counters are kept for
+# HOURLY_RETENTION_DAYS; daily and fleet-wide counters are kept for good.
+TRAFFIC = {
+    'CHUNK_SIZE': 100000,
+    'SETTLE_SECONDS': 5,
+    'HOURLY_RETENTION_DAYS': 35,
+}
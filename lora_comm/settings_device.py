@@ -0,0 +1,36 @@
+"""
+Lean settings for workers that only serve the device API.
+
+Same database, cache, presence store and device settings as the full site
+(lora_comm/settings.py), but only the apps the device endpoints need, no
+session, auth, CSRF or messages middleware (device requests carry a token,
+not a session cookie) and a URLconf with just the ESP32 endpoints
+(lora_comm/urls_device.py). Workers start faster and each request passes
+through fewer middleware. Run migrations and the web pages with the full
+settings:
+
+    DJANGO_SETTINGS_MODULE=lora_comm.settings_device gunicorn lora_comm.wsgi
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    # Node.user points at auth's User, whose permissions need contenttypes
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'accounts',
+    'communication',
+]
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'lora_comm.middleware.CompressionMiddleware',
+    'lora_comm.middleware.RequestDecompressionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+ROOT_URLCONF = 'lora_comm.urls_device'
+
+# JSON responses only: no template engine, and no translation catalogs to load
+TEMPLATES = []
+USE_I18N = False
@@ -0,0 +1,9 @@
+"""
+URL configuration of the device-API profile (lora_comm/settings_device.py):
+only the ESP32 endpoints, at the same paths as on the full site.
+"""
+from django.urls import path, include
+
+urlpatterns = [
+    path('communication/', include('communication.device_urls')),
+]